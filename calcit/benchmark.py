@@ -0,0 +1,355 @@
+""" Measures the overhead of CalcIt itself
+
+    A benchmark runs process_jobs end to end on localhost with a
+    stand-in program (share/fake_program.py, selected through the
+    custom_run_script share/benchmark.bash) in place of ORCA, GAMESS or
+    DALTON. The stand-in sleeps or keeps a core busy for a duration
+    drawn from a distribution and writes an ORCA-like output, so jobs
+    are rendered, queued, dispatched, run and returned like real jobs.
+
+    Every run reports the throughput (jobs/s), the slot time per job
+    that was not spent in the program (the overhead), the time spent in
+    every phase of the jobs (see calcit.trace) and the resident memory
+    of the master. Runs are appended to a JSON lines file and compared
+    with the last stored run with the same settings so regressions
+    show up.
+
+    Slaves are started with ssh like in a real run, so ssh to localhost
+    must work without a password.
+"""
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy
+
+from .molecule import Molecule
+from .orca import OrcaEnergyJob
+from .process import process_jobs
+from .strings import version_str
+from .trace import TraceRecorder
+
+RUN_SCRIPT = "benchmark.bash"
+FAKE_PROGRAM = "fake_program.py"
+
+DISTRIBUTIONS = ['fixed', 'uniform', 'exponential', 'lognormal']
+MODES = ['sleep', 'burn']
+
+# spread of the lognormal distribution of job durations
+LOGNORMAL_SIGMA = 1.0
+
+# seconds between samples of the resident memory of the master
+MEMORY_SAMPLE_INTERVAL = 0.05
+
+# relative change of a metric that is reported as a regression
+REGRESSION_TOLERANCE = 0.2
+
+# settings that identify comparable runs
+RUN_SETTINGS = ('jobs', 'slaves', 'distribution', 'mean_duration', 'mode', 'max_batch_size', 'prepare_workers')
+
+# metrics compared between runs and whether larger values are better
+COMPARED_METRICS = (('jobs_per_second', True), ('overhead_per_job', False), ('master_rss_peak', False))
+
+# phases of the jobs in the order they happen
+PHASES = ('render', 'queue', 'pickup', 'wait', 'run', 'transfer')
+
+
+def water():
+    """ Returns the Molecule every benchmark job is set up with """
+    return Molecule([8, 1, 1], [[0.0, 0.0, 0.1173], [0.0, 0.7572, -0.4692], [0.0, -0.7572, -0.4692]])
+
+
+class BenchmarkJob(OrcaEnergyJob):
+    """ ORCA energy job run by the stand-in program
+
+        The input file is written like that of a real ORCA job but the
+        run script starts share/fake_program.py with the python running
+        CalcIt.
+
+        Arguments:
+        ----------
+        basename -- name of the job
+        duration -- seconds the job takes
+        mode -- 'sleep' or 'burn' to keep a core busy
+        fake_program -- path of the stand-in program
+        kwargs -- keyword based arguments given to the job. The
+                  custom_run_script should be share/benchmark.bash.
+    """
+    __slots__ = ('duration', 'mode', 'fake_program')
+
+    def __init__(self, basename, duration=0.0, mode='sleep', fake_program=None, **kwargs):
+        kwargs.setdefault('geometry', water)
+        OrcaEnergyJob.__init__(self, basename, **kwargs)
+        self.duration = float(duration)
+        self.mode = mode
+        self.fake_program = fake_program
+
+    def get_scfinfo(self):
+        return "HF"
+
+    def _program_substitutions(self):
+        """ Load the substitutions of the stand-in program """
+        self._run_script_substitutions['PROGPATH'] = sys.executable
+        self._run_script_substitutions['FAKE_PROGRAM'] = self.fake_program
+        self._run_script_substitutions['DURATION'] = "{0:.6f}".format(self.duration)
+        self._run_script_substitutions['MODE'] = self.mode
+        self._comp_chem_substitutions['SCFINFO'] = "HF"
+
+    def __str__(self):
+        return "Benchmark ({0:s})".format(self.basename)
+
+    def __repr__(self):
+        return "BenchmarkJob('{0:s}')".format(self.basename)
+
+
+def job_durations(count, mean_duration, distribution='fixed', seed=0):
+    """ Returns the durations of the jobs of a benchmark
+
+        Arguments:
+        ----------
+        count -- the number of jobs
+        mean_duration -- the mean duration in seconds
+        distribution -- 'fixed' for the same duration for every job,
+                        'uniform' between zero and twice the mean,
+                        'exponential' or 'lognormal' for a long tail of
+                        slow jobs
+        seed -- seed of the random numbers so runs can be compared
+    """
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError("Unknown distribution '{0:s}'. Please use one of {1}".format(distribution, DISTRIBUTIONS))
+    generator = numpy.random.default_rng(seed)
+    if distribution == 'fixed' or mean_duration <= 0:
+        return numpy.full(count, max(mean_duration, 0.0))
+    if distribution == 'uniform':
+        return generator.uniform(0.0, 2 * mean_duration, count)
+    if distribution == 'exponential':
+        return generator.exponential(mean_duration, count)
+    # the mean of a lognormal distribution is exp(mu + sigma^2 / 2)
+    mu = numpy.log(mean_duration) - LOGNORMAL_SIGMA**2 / 2
+    return generator.lognormal(mu, LOGNORMAL_SIGMA, count)
+
+
+def resident_memory():
+    """ Returns the resident memory of this process in MB
+
+        Uses /proc where it exists and the peak resident memory
+        otherwise.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024.0**2
+    except (IOError, OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS and kB elsewhere
+        if sys.platform == 'darwin':
+            return peak / 1024.0**2
+        return peak / 1024.0
+
+
+class MemorySampler(object):
+    """ Samples the resident memory of the master in a background thread
+
+        Arguments:
+        ----------
+        interval -- seconds between samples
+    """
+    def __init__(self, interval=MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.start = resident_memory()
+        self.peak = self.start
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="calcit-memory-sampler")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while not self.closed.wait(self.interval):
+            self.peak = max(self.peak, resident_memory())
+
+    def close(self):
+        """ Stops sampling and returns the memory at the start and the peak """
+        self.closed.set()
+        self.thread.join()
+        self.peak = max(self.peak, resident_memory())
+        return self.start, self.peak
+
+
+def run_benchmark(jobs, slaves, global_paths, mean_duration=0.0, distribution='fixed', mode='sleep', max_batch_size=1, prepare_workers=1, port=31415, seed=0, work_dir=None):
+    """ Runs benchmark jobs on localhost and returns what they cost
+
+        Arguments:
+        ----------
+        jobs -- the number of jobs
+        slaves -- the number of slaves on localhost
+        global_paths -- directories used to find calcit and its data folders.
+        mean_duration -- the mean seconds the jobs take
+        distribution -- the distribution of job durations, see job_durations
+        mode -- 'sleep' or 'burn' to keep a core busy
+        max_batch_size -- largest number of jobs a slave fetches at once
+        prepare_workers -- number of threads preparing jobs
+        port -- the port of the master
+        seed -- seed of the job durations
+        work_dir -- directory the jobs run in. None uses a temporary
+                    directory which is removed afterwards. The master
+                    runs in it like in a real run and changes back when
+                    the run is done.
+
+        Returns:
+        --------
+        dictionary of the settings and results of the run
+    """
+    temporary = work_dir is None
+    if temporary:
+        work_dir = tempfile.mkdtemp(prefix="calcit-benchmark-")
+    work_dir = os.path.abspath(work_dir)
+    share = global_paths['share']
+    durations = job_durations(jobs, mean_duration, distribution, seed)
+    # jobs are generated as they are consumed, like in a real run, so the
+    # memory of the master shows how it streams jobs
+    benchmark_jobs = (BenchmarkJob("bench{0:07d}".format(index), duration, mode, os.path.join(share, FAKE_PROGRAM),
+                                   work_dir=work_dir, scratch_directory=work_dir, custom_run_script=os.path.join(share, RUN_SCRIPT))
+                      for index, duration in enumerate(durations))
+
+    trace = TraceRecorder()
+    memory = MemorySampler()
+    cwd = os.getcwd()
+    try:
+        os.chdir(work_dir)
+        started = time.time()
+        process_jobs(port, "calcit-benchmark-{0:d}".format(port), benchmark_jobs, [('localhost', slaves)], slaves, work_dir, 'ssh', global_paths, True,
+                     max_batch_size=max_batch_size, prepare_workers=prepare_workers, trace=trace)
+        ended = time.time()
+    finally:
+        rss_start, rss_peak = memory.close()
+        os.chdir(cwd)
+        if temporary:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    phases = trace.phase_spans()
+    runs = numpy.array(phases.get('run', [(started, started)]), dtype=numpy.float64)
+    first_start = float(runs[:, 0].min())
+    run_time = float(numpy.sum(runs[:, 1] - runs[:, 0]))
+    wall_time = ended - started
+    # slots are only counted from when the first job started so the
+    # time it takes ssh to start the slaves is reported on its own
+    slot_time = slaves * (ended - first_start)
+
+    result = {'jobs': jobs,
+              'slaves': slaves,
+              'distribution': distribution,
+              'mean_duration': mean_duration,
+              'mode': mode,
+              'max_batch_size': max_batch_size,
+              'prepare_workers': prepare_workers,
+              'seed': seed,
+              'wall_time': wall_time,
+              'startup_time': first_start - started,
+              'jobs_per_second': jobs / max(ended - first_start, 1.0e-9),
+              'ideal_time': float(durations.sum()) / slaves,
+              'run_time': run_time,
+              'overhead_per_job': (slot_time - run_time) / max(jobs, 1),
+              'efficiency': run_time / slot_time if slot_time > 0 else 0.0,
+              'master_rss_start': rss_start,
+              'master_rss_peak': rss_peak,
+              'phases': {}}
+    for phase in PHASES:
+        spans = numpy.array(phases.get(phase, []), dtype=numpy.float64).reshape(-1, 2)
+        times = numpy.maximum(spans[:, 1] - spans[:, 0], 0.0)
+        result['phases'][phase] = {'mean': float(times.mean()) if len(times) else None,
+                                   'p99': float(numpy.percentile(times, 99)) if len(times) else None}
+    return result
+
+
+def source_revision(global_paths):
+    """ Returns the git commit CalcIt runs from or None """
+    try:
+        output = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=global_paths['path'],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if output.returncode != 0:
+        return None
+    return output.stdout.decode("utf-8").strip() or None
+
+
+def load_results(filename):
+    """ Returns the stored benchmark runs of a JSON lines file
+
+        Arguments:
+        ----------
+        filename -- the file with one run per line. A missing file has
+                    no runs.
+    """
+    results = []
+    if not os.path.isfile(filename):
+        return results
+    with open(filename, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                results.append(json.loads(line))
+    return results
+
+
+def store_result(filename, result):
+    """ Appends a benchmark run to a JSON lines file
+
+        Arguments:
+        ----------
+        filename -- the file with one run per line
+        result -- the run as returned by run_benchmark
+    """
+    with open(filename, "a") as f:
+        f.write(json.dumps(result, sort_keys=True))
+        f.write("\n")
+
+
+def describe_environment(global_paths):
+    """ Returns where and with what a benchmark is run """
+    return {'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'version': version_str,
+            'revision': source_revision(global_paths)}
+
+
+def previous_result(result, results):
+    """ Returns the last stored run with the same settings as result or None """
+    key = tuple(result[setting] for setting in RUN_SETTINGS)
+    for previous in reversed(results):
+        if tuple(previous.get(setting) for setting in RUN_SETTINGS) == key:
+            return previous
+    return None
+
+
+def regressions(result, previous, tolerance=REGRESSION_TOLERANCE):
+    """ Returns the metrics of a run that are worse than in a previous run
+
+        Arguments:
+        ----------
+        result -- the new run
+        previous -- the earlier run with the same settings
+        tolerance -- relative change that is accepted
+
+        Returns:
+        --------
+        list of (metric, previous value, new value)
+    """
+    worse = []
+    for metric, larger_is_better in COMPARED_METRICS:
+        old, new = previous.get(metric), result.get(metric)
+        if old is None or new is None or old == 0:
+            continue
+        change = (new - old) / abs(old)
+        if (larger_is_better and change < -tolerance) or (not larger_is_better and change > tolerance):
+            worse.append((metric, old, new))
+    return worse
@@ -0,0 +1,174 @@
+""" Content addressed cache of job outputs shared between runs
+
+    Outputs are stored under a hash of the rendered input file, the
+    program and its version so the same calculation submitted again,
+    even under another name, is copied from the cache instead of run.
+    The cache is kept below a size limit by evicting the least
+    recently used outputs.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+# default size limit of the cache in MB
+DEFAULT_MAX_SIZE = 10240
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    program TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    stored REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+
+def cacheable(job):
+    """ Returns whether the output is the only file of a job other jobs can use
+
+        Jobs writing other files, i.e. densities for embedding, are
+        always run since only outputs are stored in the cache.
+    """
+    return job.get_products() == [job.get_output_filename()]
+
+
+def job_cache_key(job):
+    """ Returns the cache key of a prepared job
+
+        The key is a SHA-256 hash of the program, its version, the
+        input file written when the job was prepared and the keys of
+        the jobs it depends on. The files written by those jobs are not
+        hashed since outputs hold timings, dates and hostnames that
+        change on every run.
+
+        Arguments:
+        ----------
+        job -- the job to get the key of. Its input file and those of
+               the jobs it depends on must exist.
+    """
+    h = hashlib.sha256()
+    h.update(job.get_program().encode("utf-8") + b"\0")
+    h.update(job.get_program_version().encode("utf-8") + b"\0")
+    with open(job.get_input_filename(), "rb") as f:
+        h.update(f.read())
+    for dependency in job.dependencies:
+        h.update(job_cache_key(dependency).encode("ascii") + b"\0")
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    """ Cache of job outputs in a directory
+
+        The outputs are stored as files named after their key and an
+        SQLite index keeps their sizes and when they were last used.
+        Several runs can share the same cache directory.
+
+        Arguments:
+        ----------
+        directory -- the cache directory. Created if it does not exist.
+        max_size -- the size limit of the cache in MB
+    """
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size * 1024 * 1024
+        os.makedirs(os.path.join(self.directory, "objects"), exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(self.directory, "index.sqlite"), timeout=60, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _object_filename(self, key):
+        return os.path.join(self.directory, "objects", key[:2], key)
+
+    def fetch(self, key, filename):
+        """ Copies the output stored under key to filename
+
+            Arguments:
+            ----------
+            key -- the cache key of the job
+            filename -- where to write the output
+
+            Returns:
+            --------
+            True if the output was in the cache
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return False
+            try:
+                shutil.copyfile(self._object_filename(key), filename)
+            except FileNotFoundError:
+                # removed by another run sharing the cache
+                self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.connection.commit()
+                self.misses += 1
+                return False
+            self.connection.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+            self.hits += 1
+            return True
+
+    def store(self, key, program, filename):
+        """ Stores the output in filename under key
+
+            Outputs larger than the cache are not stored.
+
+            Arguments:
+            ----------
+            key -- the cache key of the job
+            program -- the program that wrote the output
+            filename -- the output file of the job
+        """
+        size = os.path.getsize(filename)
+        if size > self.max_size:
+            return
+        object_filename = self._object_filename(key)
+        os.makedirs(os.path.dirname(object_filename), exist_ok=True)
+
+        # copy to a temporary name first so a partial file is never used
+        temporary = "{0:s}.{1:d}.tmp".format(object_filename, os.getpid())
+        shutil.copyfile(filename, temporary)
+        os.replace(temporary, object_filename)
+
+        now = time.time()
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO entries (key, program, size, stored, last_used) VALUES (?, ?, ?, ?, ?)",
+                                    (key, program, size, now, now))
+            self._evict()
+            self.connection.commit()
+
+    def _evict(self):
+        """ Removes least recently used outputs until the cache fits in max_size """
+        total, = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if total <= self.max_size:
+            return
+        for key, size in self.connection.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall():
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(self._object_filename(key))
+            except FileNotFoundError:
+                pass
+            self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            logging.info("Evicted {0:s} ({1:d} bytes) from the result cache.".format(key, size))
+
+    def size(self):
+        """ Returns the total size of the stored outputs in bytes """
+        with self.lock:
+            return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
@@ -0,0 +1,167 @@
+""" Estimates the relative cost of jobs so they can be ordered
+    before they are sent to the job queue.
+
+    The estimates are in arbitrary units and are only meant to
+    rank jobs against each other.
+"""
+import collections
+import heapq
+
+
+# approximate number of basis functions for (hydrogen/helium, other elements)
+BASIS_FUNCTIONS = {
+    'sto-3g': (1, 5),
+    '3-21g': (2, 9),
+    '6-31g': (2, 9),
+    '6-31g*': (2, 15),
+    '6-31g(d)': (2, 15),
+    '6-31+g*': (2, 19),
+    '6-31+g(d)': (2, 19),
+    'cc-pvdz': (5, 14),
+    'cc-pvtz': (14, 30),
+    'aug-cc-pvdz': (9, 23),
+    'aug-cc-pvtz': (23, 46),
+}
+DEFAULT_BASIS_FUNCTIONS = (5, 14)
+
+# rough relative speed of the supported programs for the same calculation
+PROGRAM_FACTORS = {'orca': 1.0, 'gamess': 1.5, 'dalton': 1.5}
+
+# DFT calculations pay extra for the numerical integration grid
+DFT_FACTOR = 1.3
+
+# formal scaling of an SCF calculation with the number of basis functions
+SCALING_EXPONENT = 3
+
+# the number of atoms, the approximate number of basis functions and the
+# Hill formula of a job. See Job.get_size.
+JobSize = collections.namedtuple('JobSize', ['n_atoms', 'n_basis', 'composition'])
+
+ORDER_POLICIES = ['input', 'longest-first', 'shortest-first']
+
+# default number of jobs read ahead and ordered by cost
+ORDER_WINDOW = 1000
+
+
+def count_basis_functions(elements, basis_set):
+    """ Returns the approximate number of basis functions
+
+        Arguments:
+        ----------
+        elements -- iterable of element labels
+        basis_set -- name of the basis set
+    """
+    light, heavy = BASIS_FUNCTIONS.get(basis_set.lower(), DEFAULT_BASIS_FUNCTIONS)
+    n_basis = 0
+    for element in elements:
+        if element.capitalize() in ('H', 'He'):
+            n_basis += light
+        else:
+            n_basis += heavy
+    return n_basis
+
+
+def hill_formula(elements):
+    """ Returns the element composition as a Hill formula, i.e. C2H6O
+
+        Arguments:
+        ----------
+        elements -- iterable of element labels
+    """
+    counts = collections.Counter(element.capitalize() for element in elements)
+    order = sorted(counts)
+    if 'C' in counts:
+        order = ['C'] + (['H'] if 'H' in counts else []) + [e for e in order if e not in ('C', 'H')]
+
+    s = ""
+    for element in order:
+        s += element
+        if counts[element] > 1:
+            s += "{0:d}".format(counts[element])
+    return s
+
+
+def job_size(elements, basis_set):
+    """ Returns the JobSize of a job
+
+        Arguments:
+        ----------
+        elements -- the element labels of the atoms of the job
+        basis_set -- name of the basis set
+    """
+    return JobSize(len(elements), count_basis_functions(elements, basis_set), hill_formula(elements))
+
+
+def estimate_cost_from(program, n_basis, dft_functional, cores):
+    """ Returns the estimated wall time in arbitrary units
+
+        Arguments:
+        ----------
+        program -- the quantum chemistry program
+        n_basis -- the number of basis functions
+        dft_functional -- the DFT functional or None for Hartree-Fock
+        cores -- the number of cores the calculation runs on
+    """
+    cost = PROGRAM_FACTORS.get(program, 1.0) * n_basis**SCALING_EXPONENT
+    if dft_functional is not None:
+        cost *= DFT_FACTOR
+    return cost / max(cores, 1)
+
+
+def estimate_cost(job):
+    """ Returns the estimated wall time of a job in arbitrary units
+
+        The estimate uses the number of basis functions from the atoms
+        and basis set of the job, the program, whether DFT is used and
+        the number of cores the job runs on.
+
+        Arguments:
+        ----------
+        job -- the job to estimate the cost of
+    """
+    return estimate_cost_from(job.get_program(), job.get_size().n_basis, job.dft_functional, job.cores_per_job)
+
+
+def order_jobs(jobs, policy='longest-first', cost=estimate_cost, window=ORDER_WINDOW):
+    """ Orders jobs according to a policy
+
+        Jobs are read ahead window jobs at a time so the first jobs are
+        returned before all jobs have been read. Every job returned is
+        the best of the window of jobs read so far that have not been
+        returned.
+
+        Arguments:
+        ----------
+        jobs -- iterable of jobs
+        policy -- one of ORDER_POLICIES. 'input' keeps the order of jobs.
+        cost -- function returning the cost of a job
+        window -- the number of jobs ordered at a time. None (or 0)
+                  reads and orders all jobs before the first is returned.
+
+        Returns:
+        --------
+        iterable of jobs in the requested order
+    """
+    if policy not in ORDER_POLICIES:
+        raise ValueError("Order policy '{0:s}' not supported. Please use one of {1}".format(policy, ORDER_POLICIES))
+
+    if policy == 'input':
+        return jobs
+
+    sign = -1.0 if policy == 'longest-first' else 1.0
+    if not window:
+        return sorted(jobs, key=lambda job: sign * cost(job))
+    return _order_window(jobs, sign, cost, window)
+
+
+def _order_window(jobs, sign, cost, window):
+    """ Yields jobs in order of sign times their cost from a sliding window """
+    heap = []
+    for sequence, job in enumerate(jobs):
+        item = (sign * cost(job), sequence, job)
+        if len(heap) < window:
+            heapq.heappush(heap, item)
+        else:
+            yield heapq.heappushpop(heap, item)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
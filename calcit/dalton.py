@@ -1,6 +1,8 @@
 import os
+import shutil
 
 from .job import Job
+from .util import CalcItJobCreateError
 
 class DALTONJob(Job):
     """ Base class for all DALTON calculations
@@ -8,50 +10,26 @@ class DALTONJob(Job):
         Subclasses are responsible for setting the correct parameters
         in the calculation.
     """
+    __slots__ = ()
+
     def __init__(self, basename, **kwargs):
         Job.__init__(self, basename, **kwargs)
         self.program = 'dalton'
         self.input_extension = 'dal'
 
     def get_coordinates(self):
-        xyz_data = self.xyz_data
-        Z = {'H': 1, 'C': 6, 'N': 7, 'O': 8, 'S': 16}
-
         # DALTON groups coordinates with the same nuclear charge.
-        # we first loop over coordinates to get information we
-        # need to later make the correcting printing.
-
-        # for each group we need their nuclear charge which is
-        # what differentiates them
-        n_atom_types = 0
-        group_nuclear_charge= -1
-        groupcounts = []
-        groupcharges = []
-        for elem, coord in xyz_data:
-            if group_nuclear_charge != Z[elem]:
-                 group_nuclear_charge= Z[elem]
-                 n_atom_types += 1
-                 groupcounts.append(0)
-                 groupcharges.append(group_nuclear_charge)
-
-            # store the number of atoms in the group
-            groupcounts[n_atom_types-1] += 1
+        # Each run of consecutive atoms of the same element is a group
+        # which is preceded by its nuclear charge and number of atoms.
+        groups = self.molecule.groups()
 
         # We force that no molecule shall be treated (or attempted) to be
         # treated with symmetry.
-        s = "AtomTypes={0:d} Charge={1:d} Angstrom NoSymmetry\n".format(n_atom_types, self.molecular_charge)
-
-        # now print atoms
-        n_atom_types = 0
-        group_nuclear_charge= -1
-        for elem, coord in xyz_data:
-            if group_nuclear_charge != Z[elem]:
-                 group_nuclear_charge= Z[elem]
-                 n_atom_types += 1
-                 s += "Charge={0:d} Atoms={1:d}\n".format(group_nuclear_charge, groupcounts[n_atom_types-1])
-
-            s += "{0:<3s} {1[0]:22.10f} {1[1]:14.10f} {1[2]:14.10f}\n".format(elem, coord)
-        return s
+        lines = ["AtomTypes={0:d} Charge={1:d} Angstrom NoSymmetry".format(len(groups), self.molecular_charge)]
+        for nuclear_charge, start, stop in groups:
+            lines.append("Charge={0:d} Atoms={1:d}".format(nuclear_charge, stop - start))
+            lines.append(self.molecule.format_atoms("{0:<3s} {2:22.10f} {3:14.10f} {4:14.10f}", start, stop))
+        return "\n".join(lines) + "\n"
 
 
     def _program_substitutions(self):
@@ -62,12 +40,38 @@ class DALTONJob(Job):
 
         self._run_script_substitutions['PROGPATH'] = path
 
+        # extra options to the dalton script, i.e. files to copy to and from its scratch
+        self._run_script_substitutions['DALTON_FILES'] = self.get_dalton_files()
+
         # then input substitutions
         # self._comp_chem_substitutions['SCFINFO'] = ".HF"
 
     def get_memory(self):
         return self.memory_per_job
 
+    def get_dalton_files(self):
+        """ Returns options to the dalton script for files used or written by the job """
+        return ""
+
+    def get_density_filename(self):
+        """ Returns the file the density of the job is saved to """
+        return os.path.join(self.get_job_directory(), "{0:s}.h5".format(self.get_jobname()))
+
+    def _stage_file(self, filename, destination):
+        """ Copies a file written by a job this job depends on
+
+            Raises: CalcItJobCreateError if the file does not exist
+
+            Arguments:
+            ----------
+            filename -- the file to copy
+            destination -- where to copy it to
+        """
+        if not os.path.isfile(filename):
+            raise CalcItJobCreateError("Job: {0:s} needs '{1:s}' which does not exist.".format(str(self), filename))
+        if os.path.abspath(filename) != os.path.abspath(destination):
+            shutil.copyfile(filename, destination)
+
     def get_basis_set(self):
         return self.basis_set
 
@@ -82,6 +86,8 @@ class DALTONJob(Job):
         return "\n"
 
 class DALTONEnergyJob(DALTONJob):
+    __slots__ = ()
+
     def __init__(self, basename, **kwargs):
         DALTONJob.__init__(self, basename, **kwargs)
         self.runtype = 'energy'
@@ -94,3 +100,180 @@ class DALTONEnergyJob(DALTONJob):
 
     def __repr__(self):
         return "DALTONEnergyJob('{0:s}')".format(self.basename)
+
+
+class DALTONLoPropJob(DALTONJob):
+    """ Linear response calculation with the input needed for
+        localized properties (LoProp)
+    """
+    __slots__ = ()
+
+    def __init__(self, basename, **kwargs):
+        DALTONJob.__init__(self, basename, **kwargs)
+        self.runtype = 'loprop'
+
+    def __str__(self):
+        return "DALTON LoProp ({0:s})".format(self.basename)
+
+    def __repr__(self):
+        return "DALTONLoPropJob('{0:s}')".format(self.basename)
+
+
+class DALTONPDEMonomerJob(DALTONJob):
+    """ Saves the density of a fragment for polarizable density embedding
+
+        The density is copied back from the DALTON scratch directory to
+        <jobname>.h5 in the job directory.
+    """
+    __slots__ = ()
+
+    def __init__(self, basename, **kwargs):
+        DALTONJob.__init__(self, basename, **kwargs)
+        self.runtype = 'pde_monomer'
+
+    def get_dalton_files(self):
+        return '-get "{0:s}.h5"'.format(self.get_jobname())
+
+    def get_products(self):
+        return [self.get_output_filename(), self.get_density_filename()]
+
+    def __str__(self):
+        return "DALTON PDE Monomer ({0:s})".format(self.basename)
+
+    def __repr__(self):
+        return "DALTONPDEMonomerJob('{0:s}')".format(self.basename)
+
+
+class DALTONPDEDimerJob(DALTONJob):
+    """ Computes the embedding integrals of the density of a fragment
+        in the basis of the molecule
+
+        The density saved by the fragment is copied to <jobname>.h5
+        when the job is prepared and the integrals are added to it.
+        The job depends on the fragment so it is only prepared once
+        the density exists.
+
+        Arguments:
+        ----------
+        basename -- base name of the molecule
+        fragment -- the DALTONPDEMonomerJob of the fragment
+    """
+    __slots__ = ('fragment',)
+
+    def __init__(self, basename, fragment=None, **kwargs):
+        if fragment is None:
+            raise ValueError("DALTONPDEDimerJob '{0:s}' needs the fragment job whose density to use.".format(basename))
+        kwargs['dependencies'] = (fragment,) + tuple(kwargs.get('dependencies', ()))
+        DALTONJob.__init__(self, basename, **kwargs)
+        self.runtype = 'pde_dimer'
+        self.fragment = fragment
+
+    def _setup_files(self, share_path):
+        job_dir = self.get_job_directory()
+        os.makedirs(job_dir, exist_ok=True)
+        self._stage_file(self.fragment.get_density_filename(), self.get_density_filename())
+        return DALTONJob._setup_files(self, share_path)
+
+    def get_dalton_files(self):
+        return '-put "{0:s}.h5" -get "{0:s}.h5"'.format(self.get_jobname())
+
+    def get_products(self):
+        return [self.get_output_filename(), self.get_density_filename()]
+
+    def __str__(self):
+        return "DALTON PDE Dimer ({0:s}, {1:s})".format(self.basename, self.fragment.basename)
+
+    def __repr__(self):
+        return "DALTONPDEDimerJob('{0:s}', '{1:s}')".format(self.basename, self.fragment.basename)
+
+
+class DALTONExcitationJob(DALTONJob):
+    """ Base class for excitation energies of embedded molecules
+
+        Arguments:
+        ----------
+        basename -- base name of the molecule
+        mprank -- the multipole rank of the fitted charges (QFIT)
+        excitations -- the number of excitations to calculate
+    """
+    __slots__ = ('mprank', 'excitations')
+
+    def __init__(self, basename, mprank=2, excitations=3, **kwargs):
+        DALTONJob.__init__(self, basename, **kwargs)
+        self.mprank = mprank
+        self.excitations = excitations
+
+    def _program_substitutions(self):
+        DALTONJob._program_substitutions(self)
+        self._comp_chem_substitutions['MPRANK'] = self.mprank
+        self._comp_chem_substitutions['NEXCITATIONS'] = self.excitations
+
+
+class DALTONPEEXJob(DALTONExcitationJob):
+    """ Excitation energies with polarizable embedding
+
+        Arguments:
+        ----------
+        basename -- base name of the molecule
+        potential -- the embedding potential (.pot) file. Give the job
+                     writing it in dependencies if it is made in the same run.
+    """
+    __slots__ = ('potential',)
+
+    def __init__(self, basename, potential=None, **kwargs):
+        if potential is None:
+            raise ValueError("DALTONPEEXJob '{0:s}' needs an embedding potential file.".format(basename))
+        DALTONExcitationJob.__init__(self, basename, **kwargs)
+        self.runtype = 'peex'
+        self.potential = os.path.abspath(potential)
+
+    def get_dalton_files(self):
+        return '-pot "{0:s}"'.format(self.potential)
+
+    def __str__(self):
+        return "DALTON PE Excitations ({0:s})".format(self.basename)
+
+    def __repr__(self):
+        return "DALTONPEEXJob('{0:s}')".format(self.basename)
+
+
+class DALTONPDEEXJob(DALTONExcitationJob):
+    """ Excitation energies with polarizable density embedding
+
+        The embedding file of the given job is copied to the job
+        directory when the job is prepared.
+
+        Arguments:
+        ----------
+        basename -- base name of the molecule
+        embedding -- the DALTONPDEDimerJob with the embedding integrals
+    """
+    __slots__ = ('embedding',)
+
+    def __init__(self, basename, embedding=None, **kwargs):
+        if embedding is None:
+            raise ValueError("DALTONPDEEXJob '{0:s}' needs the job with its embedding integrals.".format(basename))
+        kwargs['dependencies'] = (embedding,) + tuple(kwargs.get('dependencies', ()))
+        DALTONExcitationJob.__init__(self, basename, **kwargs)
+        self.runtype = 'pdeex'
+        self.embedding = embedding
+
+    def _setup_files(self, share_path):
+        job_dir = self.get_job_directory()
+        os.makedirs(job_dir, exist_ok=True)
+        density = self.embedding.get_density_filename()
+        self._stage_file(density, os.path.join(job_dir, os.path.basename(density)))
+        return DALTONExcitationJob._setup_files(self, share_path)
+
+    def _program_substitutions(self):
+        DALTONExcitationJob._program_substitutions(self)
+        self._comp_chem_substitutions['PDEFILE'] = os.path.basename(self.embedding.get_density_filename())
+
+    def get_dalton_files(self):
+        return '-put "{0:s}"'.format(os.path.basename(self.embedding.get_density_filename()))
+
+    def __str__(self):
+        return "DALTON PDE Excitations ({0:s})".format(self.basename)
+
+    def __repr__(self):
+        return "DALTONPDEEXJob('{0:s}')".format(self.basename)
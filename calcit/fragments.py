@@ -0,0 +1,304 @@
+""" Splits molecular clusters into fragments for many-body calculations
+
+    A cluster is split into fragments (monomers), either molecules found
+    from covalent bonds or fixed-size groups of consecutive atoms. Pairs
+    and triples of fragments with atoms within a distance cutoff are
+    found with a cell list, so the cost grows linearly with the size of
+    the cluster. Jobs are created from the fragments directly and read
+    their atoms from the cluster when their input files are written,
+    so no fragment files are written.
+"""
+import itertools
+import os
+import threading
+
+import numpy
+
+from .jobs import RuntypeJob
+from .molecule import Molecule, ELEMENTS
+
+# covalent radii in Angstrom by atomic number (B. Cordero et al., Dalton Trans. 2008, 2832)
+COVALENT_RADII = {
+    'H': 0.31, 'He': 0.28, 'Li': 1.28, 'Be': 0.96, 'B': 0.84, 'C': 0.76, 'N': 0.71, 'O': 0.66,
+    'F': 0.57, 'Ne': 0.58, 'Na': 1.66, 'Mg': 1.41, 'Al': 1.21, 'Si': 1.11, 'P': 1.07, 'S': 1.05,
+    'Cl': 1.02, 'Ar': 1.06, 'K': 2.03, 'Ca': 1.76, 'Sc': 1.70, 'Ti': 1.60, 'V': 1.53, 'Cr': 1.39,
+    'Mn': 1.39, 'Fe': 1.32, 'Co': 1.26, 'Ni': 1.24, 'Cu': 1.32, 'Zn': 1.22, 'Ga': 1.22, 'Ge': 1.20,
+    'As': 1.19, 'Se': 1.20, 'Br': 1.20, 'Kr': 1.16, 'I': 1.39, 'Xe': 1.40,
+}
+DEFAULT_COVALENT_RADIUS = 1.50
+RADII = numpy.array([COVALENT_RADII.get(symbol, DEFAULT_COVALENT_RADIUS) for symbol in ELEMENTS])
+
+# atoms are bonded when closer than BOND_TOLERANCE times the sum of their covalent radii
+BOND_TOLERANCE = 1.2
+
+# default distance in Angstrom between the closest atoms of fragments in a dimer or trimer
+DEFAULT_CUTOFF = 4.0
+
+# the 13 neighbouring cells in one half of the shell around a cell. Together
+# with the cell itself every pair of neighbouring cells is visited once.
+HALF_SHELL = [offset for offset in itertools.product((-1, 0, 1), repeat=3) if offset > (0, 0, 0)]
+
+# clusters read by this process keyed on filename
+_clusters = {}
+_clusters_lock = threading.Lock()
+
+
+def read_cluster(filename):
+    """ Returns the Molecule of a cluster .xyz file
+
+        The file is read once per process.
+
+        Arguments:
+        ----------
+        filename -- absolute path of the file
+    """
+    with _clusters_lock:
+        molecule = _clusters.get(filename)
+        if molecule is None:
+            molecule = Molecule.from_xyz(filename)
+            _clusters[filename] = molecule
+        return molecule
+
+
+def neighbor_pairs(coordinates, cutoff):
+    """ Returns all pairs of points closer than cutoff
+
+        The points are sorted into cubic cells with sides of cutoff so
+        only points in the same or neighbouring cells are compared.
+
+        Arguments:
+        ----------
+        coordinates -- (number of points, 3) coordinates
+        cutoff -- the largest distance
+
+        Returns:
+        --------
+        arrays i and j of the indices of the pairs with i < j
+    """
+    coordinates = numpy.asarray(coordinates, dtype=numpy.float64).reshape(-1, 3)
+    if len(coordinates) < 2 or cutoff <= 0:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+
+    cells = numpy.floor((coordinates - coordinates.min(axis=0)) / cutoff).astype(numpy.int64)
+    shape = cells.max(axis=0) + 1
+    keys = (cells[:, 0] * shape[1] + cells[:, 1]) * shape[2] + cells[:, 2]
+    order = numpy.argsort(keys, kind='stable')
+    unique_keys, starts, counts = numpy.unique(keys[order], return_index=True, return_counts=True)
+    unique_cells = cells[order[starts]]
+    atom_cell = numpy.repeat(numpy.arange(len(unique_keys)), counts)
+
+    pairs_i = []
+    pairs_j = []
+    for offset in [(0, 0, 0)] + HALF_SHELL:
+        # the neighbouring cell of every occupied cell or -1 if it is empty
+        neighbors = unique_cells + offset
+        inside = numpy.all((neighbors >= 0) & (neighbors < shape), axis=1)
+        neighbor_keys = (neighbors[:, 0] * shape[1] + neighbors[:, 1]) * shape[2] + neighbors[:, 2]
+        found = numpy.searchsorted(unique_keys, neighbor_keys)
+        found = numpy.minimum(found, len(unique_keys) - 1)
+        neighbor = numpy.where(inside & (unique_keys[found] == neighbor_keys), found, -1)
+
+        # pair every point (in sorted order) with the points of the neighbouring cell
+        neighbor = neighbor[atom_cell]
+        first = numpy.flatnonzero(neighbor >= 0)
+        n_candidates = counts[neighbor[first]]
+        i = numpy.repeat(first, n_candidates)
+        ends = numpy.cumsum(n_candidates)
+        j = numpy.repeat(starts[neighbor[first]] - (ends - n_candidates), n_candidates) + numpy.arange(ends[-1] if len(ends) else 0)
+        if offset == (0, 0, 0):
+            keep = j > i
+            i, j = i[keep], j[keep]
+        i, j = order[i], order[j]
+        distances = numpy.sum((coordinates[i] - coordinates[j])**2, axis=1)
+        keep = distances <= cutoff * cutoff
+        pairs_i.append(i[keep])
+        pairs_j.append(j[keep])
+
+    i = numpy.concatenate(pairs_i)
+    j = numpy.concatenate(pairs_j)
+    return numpy.minimum(i, j), numpy.maximum(i, j)
+
+
+def bonded_fragments(molecule, tolerance=BOND_TOLERANCE):
+    """ Returns the fragment of every atom with fragments being the
+        molecules formed by covalent bonds
+
+        Fragments are numbered in the order of their first atom.
+
+        Arguments:
+        ----------
+        molecule -- the Molecule of the cluster
+        tolerance -- atoms are bonded when closer than tolerance times
+                     the sum of their covalent radii
+    """
+    radii = RADII[molecule.numbers]
+    labels = numpy.arange(len(molecule))
+    if len(molecule) == 0:
+        return labels
+    i, j = neighbor_pairs(molecule.coordinates, 2 * tolerance * radii.max())
+    distances = numpy.sqrt(numpy.sum((molecule.coordinates[i] - molecule.coordinates[j])**2, axis=1))
+    bonded = distances <= tolerance * (radii[i] + radii[j])
+    i, j = i[bonded], j[bonded]
+
+    # connected components by propagating the smallest atom index
+    while True:
+        previous = labels.copy()
+        numpy.minimum.at(labels, i, labels[j])
+        numpy.minimum.at(labels, j, labels[i])
+        labels = labels[labels]
+        if numpy.array_equal(labels, previous):
+            break
+    return numpy.unique(labels, return_inverse=True)[1].reshape(-1)
+
+
+def split_fragments(molecule, atoms_per_fragment=None):
+    """ Returns the atom indices of every fragment of a cluster
+
+        Arguments:
+        ----------
+        molecule -- the Molecule of the cluster
+        atoms_per_fragment -- the number of consecutive atoms in every
+                              fragment, i.e. 3 for water. None finds
+                              the molecules from covalent bonds.
+    """
+    if atoms_per_fragment is None:
+        fragment = bonded_fragments(molecule)
+    else:
+        if len(molecule) % atoms_per_fragment != 0:
+            raise ValueError("Cannot split {0:d} atoms into fragments of {1:d} atoms.".format(len(molecule), atoms_per_fragment))
+        fragment = numpy.arange(len(molecule)) // atoms_per_fragment
+    order = numpy.argsort(fragment, kind='stable')
+    n_fragments = int(fragment.max()) + 1 if len(fragment) else 0
+    return numpy.split(order, numpy.cumsum(numpy.bincount(fragment, minlength=n_fragments))[:-1])
+
+
+def fragment_neighbors(molecule, fragments, cutoff=DEFAULT_CUTOFF):
+    """ Returns the pairs of fragments with atoms within cutoff of each other
+
+        Arguments:
+        ----------
+        molecule -- the Molecule of the cluster
+        fragments -- the atom indices of every fragment
+        cutoff -- the largest distance in Angstrom between the closest
+                  atoms of two fragments
+
+        Returns:
+        --------
+        sorted list of (a, b) fragment indices with a < b
+    """
+    fragment = numpy.zeros(len(molecule), dtype=numpy.int64)
+    for index, atoms in enumerate(fragments):
+        fragment[atoms] = index
+    i, j = neighbor_pairs(molecule.coordinates, cutoff)
+    a, b = fragment[i], fragment[j]
+    different = a != b
+    a, b = numpy.minimum(a[different], b[different]), numpy.maximum(a[different], b[different])
+    keys = numpy.unique(a * len(fragments) + b)
+    return list(zip((keys // len(fragments)).tolist(), (keys % len(fragments)).tolist()))
+
+
+def fragment_trimers(pairs):
+    """ Returns the triples of fragments that are all pairwise neighbours
+
+        Arguments:
+        ----------
+        pairs -- sorted (a, b) pairs of neighbouring fragments with a < b
+
+        Returns:
+        --------
+        list of (a, b, c) fragment indices with a < b < c
+    """
+    neighbors = {}
+    for a, b in pairs:
+        neighbors.setdefault(a, set()).add(b)
+    trimers = []
+    for a, b in pairs:
+        for c in sorted(neighbors.get(a, set()) & neighbors.get(b, set())):
+            trimers.append((a, b, c))
+    return trimers
+
+
+class FragmentGeometry(object):
+    """ Geometry of one or more fragments of a cluster
+
+        Calling it returns the calcit.molecule.Molecule of the atoms
+        so it can be given to a job as its geometry. It only keeps the
+        atom indices so it is cheap to keep and to pickle.
+
+        Arguments:
+        ----------
+        filename -- absolute path of the cluster .xyz file
+        atoms -- the indices of the atoms in the cluster
+    """
+    def __init__(self, filename, atoms):
+        self.filename = filename
+        self.atoms = numpy.asarray(atoms, dtype=numpy.int32)
+
+    def __call__(self):
+        cluster = read_cluster(self.filename)
+        return Molecule(cluster.numbers[self.atoms], cluster.coordinates[self.atoms])
+
+
+def fragments(filename, order=2, cutoff=DEFAULT_CUTOFF, atoms_per_fragment=None):
+    """ Yields the fragments of a cluster to create jobs from
+
+        Arguments:
+        ----------
+        filename -- the cluster .xyz file
+        order -- 1 for monomers, 2 to add dimers and 3 to add trimers
+        cutoff -- the largest distance in Angstrom between the closest
+                  atoms of every pair of fragments in a dimer or trimer
+        atoms_per_fragment -- the number of consecutive atoms in every
+                              fragment. None finds the molecules from
+                              covalent bonds.
+
+        Returns:
+        --------
+        generator of fragment basenames, i.e. 'data/water_m0007' for
+        monomer 7, 'data/water_d0003_0007' for a dimer and
+        'data/water_t0003_0007_0012' for a trimer of data/water.xyz, and
+        the FragmentGeometry of the fragment
+    """
+    if order not in (1, 2, 3):
+        raise ValueError("Fragment order must be 1, 2 or 3 but got {0}.".format(order))
+    # jobs are created next to the cluster like jobs of .xyz files
+    base = os.path.splitext(filename)[0]
+    filename = os.path.abspath(filename)
+    cluster = read_cluster(filename)
+    monomers = split_fragments(cluster, atoms_per_fragment)
+    width = max(4, len(str(len(monomers))))
+
+    def name(kind, indices):
+        return "{0:s}_{1:s}{2:s}".format(base, kind, "_".join("{0:0{1}d}".format(index, width) for index in indices))
+
+    for index, atoms in enumerate(monomers):
+        yield name('m', (index,)), FragmentGeometry(filename, atoms)
+    if order == 1:
+        return
+    pairs = fragment_neighbors(cluster, monomers, cutoff)
+    for indices in pairs:
+        yield name('d', indices), FragmentGeometry(filename, numpy.concatenate([monomers[index] for index in indices]))
+    if order == 2:
+        return
+    for indices in fragment_trimers(pairs):
+        yield name('t', indices), FragmentGeometry(filename, numpy.concatenate([monomers[index] for index in indices]))
+
+
+def fragment_jobs(filename, program, order=2, cutoff=DEFAULT_CUTOFF, atoms_per_fragment=None, runtype='energy', **kwargs):
+    """ Yields a job for every monomer, dimer and trimer of a cluster
+
+        Arguments:
+        ----------
+        filename -- the cluster .xyz file
+        program -- the quantum chemistry program to run
+        order -- 1 for monomers, 2 to add dimers and 3 to add trimers
+        cutoff -- the largest distance in Angstrom between the closest
+                  atoms of every pair of fragments in a dimer or trimer
+        atoms_per_fragment -- the number of consecutive atoms in every
+                              fragment. None finds the molecules from
+                              covalent bonds.
+        runtype -- the kind of calculation
+        kwargs -- keyword based arguments given to the jobs
+    """
+    for basename, geometry in fragments(filename, order, cutoff, atoms_per_fragment):
+        yield RuntypeJob(basename, program, runtype, geometry=geometry, **kwargs)
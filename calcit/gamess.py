@@ -8,6 +8,8 @@ class GAMESSJob(Job):
         Subclasses are responsible for setting the correct parameters
         in the calculation.
     """
+    __slots__ = ()
+
     def __init__(self, basename, **kwargs):
         Job.__init__(self, basename, **kwargs)
         self.program = 'gamess'
@@ -19,12 +21,9 @@ class GAMESSJob(Job):
             NB! This should return ONLY the coordinates
                 and nothing else
         """
-        Z = {'H': 1, 'C': 6, 'N': 7, 'O': 8, 'S': 16}
-        s = ""
-        for label, coordinates in self.xyz_data:
-            s += "{0:s}{1:2d}{2[0]:20.9f}{2[1]:16.9f}{2[2]:16.9f}\n".format(label, Z[label], coordinates)
-
-        return s[:-1]
+        # the symbol and nuclear charge are separate fields even for
+        # two letter symbols with two digit charges, i.e. 'Cl 17.0'
+        return self.molecule.format_atoms("{0:<2s}{1:5.1f}{2:20.9f}{3:16.9f}{4:16.9f}")
 
     def _program_substitutions(self):
         """ Load GAMESS specific substitutions.
@@ -96,6 +95,8 @@ class GAMESSJob(Job):
 
 
 class GAMESSEnergyJob(GAMESSJob):
+    __slots__ = ()
+
     def __init__(self, basename, **kwargs):
         GAMESSJob.__init__(self, basename, **kwargs)
         self.runtype = 'energy'
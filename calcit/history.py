@@ -0,0 +1,212 @@
+""" Stores the wall time of finished jobs in a local SQLite database
+    and predicts the wall time of new jobs from it.
+"""
+import collections
+import sqlite3
+import threading
+import time
+
+import numpy
+
+from .cost import SCALING_EXPONENT, estimate_cost_from
+
+# fitted exponents of the runtime with the number of basis functions are
+# clamped to this range to avoid wild extrapolation from few measurements
+MIN_SCALING_EXPONENT = 1.0
+MAX_SCALING_EXPONENT = 4.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    finished REAL NOT NULL,
+    job TEXT NOT NULL,
+    program TEXT NOT NULL,
+    runtype TEXT NOT NULL,
+    basis_set TEXT NOT NULL,
+    dft_functional TEXT NOT NULL,
+    n_atoms INTEGER NOT NULL,
+    n_basis INTEGER NOT NULL,
+    composition TEXT NOT NULL,
+    cores INTEGER NOT NULL,
+    node TEXT NOT NULL,
+    wall_time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_method ON runs (program, runtype, basis_set, dft_functional, cores);
+"""
+
+JobInfo = collections.namedtuple('JobInfo', ['program', 'runtype', 'basis_set', 'dft_functional', 'n_atoms', 'n_basis', 'composition', 'cores'])
+
+
+def describe_job(job):
+    """ Returns the JobInfo of a job used to store and predict runtimes
+
+        Arguments:
+        ----------
+        job -- the job to describe
+    """
+    size = job.get_size()
+    return JobInfo(program=job.get_program(),
+                   runtype=job.get_runtype(),
+                   basis_set=job.basis_set.lower(),
+                   dft_functional=(job.dft_functional or '').lower(),
+                   n_atoms=size.n_atoms,
+                   n_basis=size.n_basis,
+                   composition=size.composition,
+                   cores=job.cores_per_job)
+
+
+class RuntimeHistory(object):
+    """ Runtime history of finished jobs
+
+        The fits used to predict wall times are kept until new runs
+        are committed so jobs can be ordered without reading the
+        stored runs for every job. The history is used by the thread
+        producing jobs and the thread retrieving results at once.
+
+        Arguments:
+        ----------
+        filename -- the SQLite database file. Created if it does not exist.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+        self.lock = threading.Lock()
+        self._recorded = False
+        self._fits = {}
+        self._calibration = None
+
+    def record(self, job_name, info, node, wall_time):
+        """ Stores the wall time of a finished job
+
+            Call commit to write the records to disk.
+
+            Arguments:
+            ----------
+            job_name -- the name of the job
+            info -- the JobInfo of the job
+            node -- the node the job ran on
+            wall_time -- the wall time of the job in seconds
+        """
+        with self.lock:
+            self.connection.execute("INSERT INTO runs (finished, job, program, runtype, basis_set, dft_functional, n_atoms, n_basis, composition, cores, node, wall_time) "
+                                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (time.time(), job_name) + tuple(info) + (node, float(wall_time)))
+            self._recorded = True
+
+    def commit(self):
+        """ Writes recorded runs to disk and drops the fits made without them """
+        with self.lock:
+            self.connection.commit()
+            if self._recorded:
+                self._recorded = False
+                self._fits.clear()
+                self._calibration = None
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+    def runs(self, program=None, runtype=None, basis_set=None, dft_functional=None, cores=None):
+        """ Returns stored runs as (n_basis, wall_time) tuples
+
+            Arguments set to None do not restrict the runs returned.
+        """
+        query = "SELECT n_basis, wall_time FROM runs"
+        conditions = []
+        values = []
+        for column, value in (('program', program), ('runtype', runtype), ('basis_set', basis_set), ('dft_functional', dft_functional), ('cores', cores)):
+            if value is not None:
+                conditions.append("{0:s} = ?".format(column))
+                values.append(value)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        with self.lock:
+            return self.connection.execute(query, values).fetchall()
+
+    def fit(self, program, runtype, basis_set, dft_functional, cores):
+        """ Returns the exponent and logarithm of the prefactor of the
+            power law fitted to the matching runs or None if there are none
+
+            Fits are kept until new runs are committed.
+
+            Arguments set to None do not restrict the runs fitted.
+        """
+        key = (program, runtype, basis_set, dft_functional, cores)
+        if key in self._fits:
+            return self._fits[key]
+        runs = self.runs(program, runtype, basis_set, dft_functional, cores)
+        fit = None
+        if runs:
+            n_basis, wall_time = numpy.array(runs, dtype=numpy.float64).T
+            log_n = numpy.log(numpy.maximum(n_basis, 1.0))
+            log_t = numpy.log(numpy.maximum(wall_time, 1.0e-3))
+            exponent = SCALING_EXPONENT
+            if numpy.ptp(log_n) > 0.0:
+                exponent = numpy.polyfit(log_n, log_t, 1)[0]
+                exponent = min(max(exponent, MIN_SCALING_EXPONENT), MAX_SCALING_EXPONENT)
+            fit = (float(exponent), float(numpy.mean(log_t - exponent * log_n)))
+        self._fits[key] = fit
+        return fit
+
+    def predict(self, info):
+        """ Returns the predicted wall time in seconds of a job
+
+            Runs with the same program, runtype, basis set, functional
+            and cores are fitted to a power law in the number of basis
+            functions. If there are no such runs, runs in any basis set
+            are used instead as the fit is in the number of basis
+            functions. The cores and functional always match as the fit
+            does not model how they change the runtime. The exponent is
+            fixed to SCALING_EXPONENT when all runs have the same size.
+
+            Arguments:
+            ----------
+            info -- the JobInfo of the job
+
+            Returns:
+            --------
+            predicted wall time in seconds or None if there are no runs to predict from
+        """
+        fit = self.fit(info.program, info.runtype, info.basis_set, info.dft_functional, info.cores)
+        if fit is None:
+            fit = self.fit(info.program, info.runtype, None, info.dft_functional, info.cores)
+        if fit is None:
+            return None
+
+        exponent, log_a = fit
+        return float(numpy.exp(log_a + exponent * numpy.log(max(info.n_basis, 1))))
+
+    def calibration(self):
+        """ Returns the median ratio of measured wall time to the
+            estimate of calcit.cost over all stored runs, or None
+        """
+        if self._calibration is None:
+            with self.lock:
+                rows = self.connection.execute("SELECT program, n_basis, dft_functional, cores, wall_time FROM runs").fetchall()
+            if not rows:
+                return None
+            ratios = [wall_time / estimate_cost_from(program, n_basis, dft_functional or None, cores)
+                      for program, n_basis, dft_functional, cores, wall_time in rows]
+            self._calibration = float(numpy.median(ratios))
+        return self._calibration
+
+    def cost(self, job):
+        """ Returns the predicted wall time in seconds of a job
+
+            Falls back to the calibrated estimate of calcit.cost for jobs
+            that have no matching runs so all jobs can be compared.
+            Can be used as the cost function of calcit.cost.order_jobs.
+
+            Arguments:
+            ----------
+            job -- the job to predict the wall time of
+        """
+        info = describe_job(job)
+        predicted = self.predict(info)
+        if predicted is not None:
+            return predicted
+        estimate = estimate_cost_from(info.program, info.n_basis, info.dft_functional or None, info.cores)
+        return estimate * (self.calibration() or 1.0)
@@ -1,8 +1,11 @@
 import logging
 import os
 import stat
+import sys
 
 import calcit.util
+from calcit.cost import job_size
+from calcit.molecule import Molecule
 
 class Job(object):
     """ Job is the base class for all computations in CalcIt
@@ -15,25 +18,78 @@ class Job(object):
         the appropriate directories and are standing (i.e. os.getcwd()) is
         the actual temporary calculation area the Job.cmd command below
         will give the wrong work_dir
+
+        Jobs are small descriptors so millions of them can be kept by
+        the master. The geometry is only loaded while the input file is
+        written (or when it is asked for) and the substitutions are
+        released when the job has been set up. Subclasses must declare
+        __slots__ as well.
     """
+    __slots__ = ('basename', 'work_dir', 'memory_per_job', 'molecular_charge', 'dft_functional',
+                 'basis_set', 'cores_per_job', 'scratch_directory', 'scratch_per_job', 'custom_run_script',
+                 'geometry', 'dependencies', 'input_extension', 'program', 'runtype', 'size', '_molecule',
+                 '_program_version', '_run_script_substitutions', '_comp_chem_substitutions')
+
     def __init__(self, basename, **kwargs):
         self.basename = basename
-        self.work_dir = kwargs.get('work_dir', os.getcwd())
+        # directories are shared by all jobs so only one copy is kept
+        self.work_dir = sys.intern(kwargs.get('work_dir', os.getcwd()))
         work_dir = os.path.split(self.work_dir)
         if work_dir[1] == self.basename:
-            self.work_dir = work_dir[0]
+            self.work_dir = sys.intern(work_dir[0])
 
         self.memory_per_job = kwargs.get('memory_per_job', 512) # in MB
         self.molecular_charge = kwargs.get('charge', 0)
         self.dft_functional = kwargs.get('dft_functional', None)
         self.basis_set = kwargs.get('basis_set', 'sto-3g') # sto-3g per default
         self.cores_per_job = kwargs.get('cores_per_job', 1)
-        self.scratch_directory = kwargs.get('scratch_directory', os.environ.get('SCRATCH', ''))
+        self.scratch_directory = sys.intern(kwargs.get('scratch_directory', os.environ.get('SCRATCH', '')))
+        self.scratch_per_job = kwargs.get('scratch_per_job', 0) # in MB of node local scratch
 
         self.custom_run_script = kwargs.get('custom_run_script', None)
 
-        self.xyz_data = list(calcit.util.read_xyz("{0}.xyz".format(basename)))
+        # the geometry is read from <basename>.xyz unless a function returning
+        # the Molecule, i.e. a calcit.trajectory.TrajectoryFrame, is given
+        self.geometry = kwargs.get('geometry', None)
+
+        # jobs that must finish before this job can be prepared and run.
+        # See calcit.workflow.JobGraph.
+        self.dependencies = tuple(kwargs.get('dependencies', ()))
         self.input_extension = "inp"
+        # the JobSize found from the geometry, see get_size
+        self.size = None
+        self._molecule = None
+        self._program_version = None
+        self._run_script_substitutions = None
+        self._comp_chem_substitutions = None
+
+    def load_molecule(self):
+        """ Reads the geometry of the job """
+        if self.geometry is None:
+            return Molecule.from_xyz("{0}.xyz".format(self.basename))
+        return self.geometry()
+
+    @property
+    def molecule(self):
+        """ The Molecule of the job
+
+            Unless the job is being set up the geometry is read every
+            time and not kept by the job.
+        """
+        if self._molecule is not None:
+            return self._molecule
+        return self.load_molecule()
+
+    def get_size(self):
+        """ Returns the JobSize of the job
+
+            The size is found from the geometry the first time, or when
+            the job is prepared, and kept so the master does not read the
+            geometry again to estimate the cost or record the runtime.
+        """
+        if self.size is None:
+            self.size = job_size(self.molecule.symbols(), self.basis_set)
+        return self.size
 
     def _setup_default_substitutions(self):
         self._run_script_substitutions = {
@@ -64,7 +120,8 @@ class Job(object):
 
     def get_jobname(self):
         method = self.get_method()
-        basename = self.get_basename()
+        # the files of a job are named without the directory of its basename
+        basename = os.path.basename(self.get_basename())
         return "{0:s}_{1:s}".format(basename, method)
 
     def get_method(self):
@@ -87,11 +144,50 @@ class Job(object):
         if not os.path.isdir(basename):
             os.mkdir(basename)
 
+    def get_job_directory(self):
+        """ Returns the absolute path of the directory the job runs in """
+        return os.path.abspath(os.path.join(self.work_dir, self.basename))
+
+    def get_input_filename(self):
+        """ Returns the absolute path of the input file of the job """
+        filename = "{0:s}.{1:s}".format(self.get_jobname(), self.input_extension)
+        return os.path.join(self.get_job_directory(), filename)
+
+    def get_output_filename(self):
+        """ Returns the absolute path of the output file of the job """
+        return os.path.join(self.get_job_directory(), "{0:s}.out".format(self.get_jobname()))
+
+    def get_products(self):
+        """ Returns the files written by the job that other jobs may depend on """
+        return [self.get_output_filename()]
+
+    def get_program_version(self):
+        """ Returns the version and location of the program used by the job
+
+            Programs without a version setting are identified by their
+            installation path only. Only the program substitutions are
+            set up so the geometry is not read.
+        """
+        if self._program_version is None:
+            self._run_script_substitutions = {'VERSION': '', 'PROGPATH': ''}
+            self._comp_chem_substitutions = {}
+            try:
+                self._program_substitutions()
+            except Exception:
+                self._run_script_substitutions = None
+                self._comp_chem_substitutions = None
+                raise
+            self._release_substitutions()
+        return self._program_version
+
     def cmd(self, global_paths):
         """ Sets up the command to be run by slave processes. It also
             sets up the correct files needed for a calculation by the
             slave processes.
 
+            Only absolute paths are used and the current working directory
+            is never changed so jobs can be prepared concurrently.
+
             NB: Performs some sanity checks
 
             Arguments:
@@ -110,61 +206,62 @@ class Job(object):
             raise ValueError("Scratch directory not set. Please specify through SCRATCH enviroment variable.")
 
         # substitutions for internal variables. First the general and then the program specific.
-        self._setup_default_substitutions()
-        self._program_substitutions()
+        # the geometry is only kept while the input is written
+        self._molecule = self.load_molecule()
+        try:
+            self.get_size()
+            self._setup_default_substitutions()
+            self._program_substitutions()
 
-        file_to_run = self._setup_files(global_paths['share'])
+            file_to_run = self._setup_files(global_paths['share'])
+        finally:
+            self._molecule = None
+            self._release_substitutions()
 
-        s  = "cd {0};".format(os.path.join(self.work_dir, self.basename))
+        s  = "cd {0};".format(self.get_job_directory())
         s += "./{0}".format(file_to_run)
         return s
 
+    def _release_substitutions(self):
+        """ Keeps the program version and releases the substitutions """
+        if self._run_script_substitutions is not None:
+            self._program_version = "{0} {1}".format(self._run_script_substitutions['VERSION'], self._run_script_substitutions['PROGPATH'])
+        self._run_script_substitutions = None
+        self._comp_chem_substitutions = None
+
     def _setup_files(self, share_path):
-        program = self.get_program()
-        runtype = self.get_runtype()
-        basename = self.get_basename()
+        job_dir = self.get_job_directory()
+        calcit.util.create_scratch_directory(job_dir)
 
-        self._create_input(share_path)
-        file_to_run = self._create_run_script(share_path)
+        self._create_input(share_path, job_dir)
+        file_to_run = self._create_run_script(share_path, job_dir)
 
         return file_to_run
 
-    def _create_run_script(self, share_path):
-        work_dir = os.getcwd()
-        calcit.util.create_scratch_directory(self.basename)
-        os.chdir(self.basename)
-
+    def _create_run_script(self, share_path, job_dir):
         # always assume that no custom run script is provided
         filename_in = '{0:s}.bash'.format(os.path.join(share_path, self.program))
         if self.custom_run_script is not None:
-            filename_in = self.custom_run_script
+            filename_in = os.path.abspath(self.custom_run_script)
 
         filename_out = "{0:s}.sh".format(self.get_jobname())
-        xyz_file = '../{0:s}.xyz'.format(self.basename)
+        path_out = os.path.join(job_dir, filename_out)
 
         try:
-            calcit.util.substitute_file(filename_in, filename_out, self._run_script_substitutions)
+            calcit.util.substitute_file(filename_in, path_out, self._run_script_substitutions)
         except IOError:
-            logging.error("Could not substitute from file '{}'. Please check that it exist.".format(os.path.abspath(filename_in)))
+            logging.error("Could not substitute from file '{}'. Please check that it exist.".format(filename_in))
             raise calcit.util.CalcItJobCreateError("Job: {}".format(str(self)))
 
-        os.chmod(filename_out, stat.S_IRWXU or stat.S_IRGRP or stat.S_IROTH)
-        os.chdir(work_dir)
+        os.chmod(path_out, stat.S_IRWXU or stat.S_IRGRP or stat.S_IROTH)
 
         return filename_out
 
-    def _create_input(self, share_path):
-        work_dir = os.getcwd()
-        calcit.util.create_scratch_directory(self.basename)
-        os.chdir(self.basename)
-
+    def _create_input(self, share_path, job_dir):
         filename_in = '{0:s}.inp'.format(os.path.join(share_path, self.get_method()))
-        filename_out = "{0:s}.{1:s}".format(self.get_jobname(), self.input_extension)
-        xyz_file = '../{0:s}.xyz'.format(self.basename)
-
-        calcit.util.substitute_file(filename_in, filename_out, self._comp_chem_substitutions)
+        path_out = self.get_input_filename()
 
-        os.chdir(work_dir)
+        calcit.util.substitute_file(filename_in, path_out, self._comp_chem_substitutions)
 
 
     def get_title(self):
@@ -1,27 +1,49 @@
 from .gamess import GAMESSEnergyJob
 from .orca import OrcaEnergyJob
-from .dalton import DALTONEnergyJob
+from .dalton import DALTONEnergyJob, DALTONLoPropJob, DALTONPDEMonomerJob, DALTONPDEDimerJob, DALTONPEEXJob, DALTONPDEEXJob
 
 program_matrix = {
-    'energy': {'gamess': GAMESSEnergyJob, 'orca': OrcaEnergyJob, 'dalton': DALTONEnergyJob}
+    'energy': {'gamess': GAMESSEnergyJob, 'orca': OrcaEnergyJob, 'dalton': DALTONEnergyJob},
+    'loprop': {'dalton': DALTONLoPropJob},
+    'pde_monomer': {'dalton': DALTONPDEMonomerJob},
+    'pde_dimer': {'dalton': DALTONPDEDimerJob},
+    'peex': {'dalton': DALTONPEEXJob},
+    'pdeex': {'dalton': DALTONPDEEXJob},
     }
 
-def EnergyJob(basename, program=None, **kwargs):
-    """ Convenience wrapper for energy calculation classes.
+def RuntypeJob(basename, program=None, runtype='energy', **kwargs):
+    """ Creates the job of a runtype for a program
 
         Arguments:
         ----------
         basename -- base name (no extension) of the molecule to calculate
         program -- The quantum chemistry program to run
+        runtype -- the kind of calculation, one of the keys of program_matrix
         kwargs -- keyword based arguments
     """
     if program is None:
-        raise ValueError("Program not supplied as argument 2 to EnergyJob.")
+        raise ValueError("Program not supplied as argument 2 to RuntypeJob.")
+
+    if runtype not in program_matrix:
+        raise ValueError("Runtype '{0:s}' not supported. Please use one of {1}".format(runtype, sorted(program_matrix)))
 
-    matrix = program_matrix['energy']
-    matrix_keys = matrix.keys()
+    matrix = program_matrix[runtype]
+    matrix_keys = list(matrix.keys())
     if program not in matrix.keys():
-        raise ValueError("Program '{0:s}' not supported. Please use one of {1:s}".format(program, matrix_keys))
+        raise ValueError("Program '{0:s}' not supported for runtype '{1:s}'. Please use one of {2}".format(program, runtype, matrix_keys))
 
     return matrix[program](basename, **kwargs)
 
+def EnergyJob(basename, program=None, **kwargs):
+    """ Convenience wrapper for energy calculation classes.
+
+        Arguments:
+        ----------
+        basename -- base name (no extension) of the molecule to calculate
+        program -- The quantum chemistry program to run
+        kwargs -- keyword based arguments
+    """
+    if program is None:
+        raise ValueError("Program not supplied as argument 2 to EnergyJob.")
+
+    return RuntypeJob(basename, program, 'energy', **kwargs)
@@ -0,0 +1,104 @@
+""" Append-only journal of the states of the jobs in a run
+
+    The master writes a line every time a job changes state so a run
+    that was interrupted can be resumed without preparing and sending
+    the jobs that already finished. Every line is tab separated
+
+      <time> <state> <job name> <node>
+
+    where node is empty for states that happen on the master.
+"""
+import threading
+import time
+
+PREPARED = 'prepared'
+DISPATCHED = 'dispatched'
+DONE = 'done'
+FAILED = 'failed'
+STATES = [PREPARED, DISPATCHED, DONE, FAILED]
+
+
+def read_journal(filename):
+    """ Returns the last state of every job in a journal file
+
+        Lines that are incomplete, for instance because the master was
+        killed while writing them, are ignored.
+
+        Arguments:
+        ----------
+        filename -- the journal file
+
+        Returns:
+        --------
+        dictionary of job names and their last state
+    """
+    states = {}
+    try:
+        with open(filename, "r") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) != 4 or fields[1] not in STATES:
+                    continue
+                states[fields[2]] = fields[1]
+    except FileNotFoundError:
+        pass
+    return states
+
+
+class RunJournal(object):
+    """ Journal of job states written by the master
+
+        Lines are written as soon as they are recorded so the journal
+        is complete up to the moment the master stopped.
+
+        Arguments:
+        ----------
+        filename -- the journal file
+        resume -- if True the journal is continued and jobs that are done
+                  in it are skipped by skip_completed. Otherwise it is
+                  started over.
+    """
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.completed = set()
+        if resume:
+            self.completed = set(name for name, state in read_journal(filename).items() if state == DONE)
+        self.skipped = 0
+        self.lock = threading.Lock()
+        self.file = open(filename, "a" if resume else "w", buffering=1)
+
+    def record(self, state, job_name, node=""):
+        """ Appends the state of a job to the journal
+
+            Arguments:
+            ----------
+            state -- one of STATES
+            job_name -- the name of the job
+            node -- the node the job is on, if any
+        """
+        with self.lock:
+            self.file.write("{0:.3f}\t{1:s}\t{2:s}\t{3:s}\n".format(time.time(), state, job_name, node))
+
+    def skip_completed(self, jobs):
+        """ Yields the jobs that are not done in the resumed journal
+
+            Jobs are identified by their name (repr) so nothing about
+            them is written or prepared before they are skipped. Skip
+            jobs before they are ordered by calcit.cost.order_jobs so
+            the geometries of done jobs are not read to get their cost.
+
+            Arguments:
+            ----------
+            jobs -- iterable of jobs
+        """
+        for job in jobs:
+            if repr(job) in self.completed:
+                self.skipped += 1
+                continue
+            yield job
+
+    def close(self):
+        with self.lock:
+            self.file.close()
@@ -0,0 +1,342 @@
+""" Live metrics of a run for monitoring long calculations
+
+    The master updates a RunMetrics as jobs are queued, sent to slaves
+    and finished. The metrics are the number of jobs in every state,
+    the completion rate, the mean and percentiles of recent job times,
+    how busy every node is and an estimate of when the run is done.
+    They are served over HTTP by a MetricsServer and/or written to a
+    file every few seconds by a StatusFile, both in the Prometheus text
+    format and as JSON.
+
+    Jobs are running from when they are sent to a slave, so jobs that
+    a slave fetched in a batch and has not started yet count as running.
+
+    While jobs are still being generated the total is not known and the
+    remaining jobs and the estimate are of the jobs submitted so far,
+    which makes the estimate a lower bound.
+"""
+import collections
+import http.server
+import json
+import os
+import threading
+import time
+
+import numpy
+
+from .process import MSG_SLAVE_READY, MSG_SLAVE_DONE
+from .server import MSG_SLAVE_LOST, MSG_JOBS_DISPATCHED
+
+# the completion rate is measured over the last RATE_WINDOW seconds
+RATE_WINDOW = 600.0
+
+# job time statistics use the last DURATION_WINDOW finished jobs
+DURATION_WINDOW = 1000
+PERCENTILES = (50, 90, 99)
+
+# default seconds between rewrites of a status file
+STATUS_INTERVAL = 10.0
+
+STATES = ('queued', 'running', 'done', 'failed', 'cached', 'cancelled')
+
+
+class NodeUsage(object):
+    """ Slot and busy time of the slaves on a node """
+    def __init__(self):
+        self.slaves = {}
+        self.slot_time = 0.0
+        self.busy_time = 0.0
+        self.done = 0
+
+
+class RunMetrics(object):
+    """ Counts and timings of the jobs of a run
+
+        All methods are safe to call from the threads of the master.
+
+        Arguments:
+        ----------
+        total -- the number of jobs in the run if known up front
+    """
+    def __init__(self, total=None):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.total = total
+        self.counts = dict((state, 0) for state in STATES)
+        self.running = {}
+        # jobs of lost slaves that are queued again and those of them that
+        # finished anyway so sending them again is not counted
+        self.requeued = set()
+        self.finished_requeued = set()
+        self.nodes = collections.defaultdict(NodeUsage)
+        self.completions = collections.deque()
+        self.durations = collections.deque(maxlen=DURATION_WINDOW)
+
+    def job_queued(self, job_name):
+        with self.lock:
+            self.counts['queued'] += 1
+
+    def job_cached(self, job_name):
+        with self.lock:
+            self.counts['cached'] += 1
+            self.completions.append(time.time())
+
+    def job_failed(self, job_name):
+        """ Records a job that failed before it was queued """
+        with self.lock:
+            self.counts['failed'] += 1
+            self.completions.append(time.time())
+
+    def jobs_cancelled(self, job_names):
+        with self.lock:
+            self.counts['cancelled'] += len(job_names)
+
+    def all_queued(self):
+        """ Fixes the total when every job has been queued, cached or cancelled """
+        with self.lock:
+            self.total = sum(self.counts.values())
+
+    def job_finished(self, job_name, slave_id, duration, success):
+        """ Records a job that returned a result
+
+            Arguments:
+            ----------
+            job_name -- the name of the job
+            slave_id -- the slave that ran it, i.e. 'node01:1234'
+            duration -- seconds the job ran
+            success -- whether the job succeeded
+        """
+        now = time.time()
+        with self.lock:
+            if self.running.pop(job_name, None) is not None:
+                self.counts['running'] -= 1
+            else:
+                # the result arrived before the dispatch was reported
+                self.counts['queued'] -= 1
+            self.counts['done' if success else 'failed'] += 1
+            if job_name in self.requeued:
+                self.requeued.discard(job_name)
+                self.finished_requeued.add(job_name)
+            node = self.nodes[slave_id.split(':')[0]]
+            node.busy_time += float(duration)
+            node.done += 1
+            self.completions.append(now)
+            self.durations.append(float(duration))
+
+    def observe(self, message):
+        """ Records slaves connecting and leaving and jobs sent to slaves
+
+            Arguments:
+            ----------
+            message -- a message from the result queue. Results are
+                       ignored, see job_finished.
+        """
+        kind = message[0]
+        now = time.time()
+        with self.lock:
+            if kind == MSG_SLAVE_READY:
+                self.nodes[message[1].split(':')[0]].slaves[message[1]] = now
+            elif kind in (MSG_SLAVE_DONE, MSG_SLAVE_LOST):
+                node = self.nodes[message[1].split(':')[0]]
+                connected = node.slaves.pop(message[1], None)
+                if connected is not None:
+                    node.slot_time += now - connected
+            if kind == MSG_JOBS_DISPATCHED:
+                for job_name in message[2]:
+                    if job_name in self.finished_requeued:
+                        self.finished_requeued.discard(job_name)
+                        continue
+                    if job_name not in self.running:
+                        self.counts['queued'] -= 1
+                        self.counts['running'] += 1
+                    self.running[job_name] = (message[1].split(':')[0], now)
+            elif kind == MSG_SLAVE_LOST:
+                # the jobs of a lost slave are queued again
+                for job_name in message[2]:
+                    if self.running.pop(job_name, None) is not None:
+                        self.counts['running'] -= 1
+                        self.counts['queued'] += 1
+                        self.requeued.add(job_name)
+
+    def snapshot(self):
+        """ Returns the current metrics as a dictionary """
+        now = time.time()
+        with self.lock:
+            while self.completions and self.completions[0] < now - RATE_WINDOW:
+                self.completions.popleft()
+            elapsed = now - self.started
+            rate = len(self.completions) / max(min(elapsed, RATE_WINDOW), 1.0e-3)
+            counts = dict(self.counts)
+            finished = counts['done'] + counts['failed'] + counts['cached'] + counts['cancelled']
+            # until the total is known the jobs submitted so far are used
+            total = self.total if self.total is not None else sum(counts.values())
+            remaining = max(total - finished, 0)
+            eta = None
+            if remaining == 0 and self.total is not None:
+                eta = 0.0
+            elif rate > 0:
+                eta = remaining / rate
+
+            durations = numpy.array(self.durations, dtype=numpy.float64)
+            job_time = {'count': len(durations), 'sum': float(durations.sum()), 'mean': None}
+            for percentile in PERCENTILES:
+                job_time['p{0:d}'.format(percentile)] = None
+            if len(durations):
+                job_time['mean'] = float(durations.mean())
+                for percentile, value in zip(PERCENTILES, numpy.percentile(durations, PERCENTILES)):
+                    job_time['p{0:d}'.format(percentile)] = float(value)
+
+            dispatched = collections.defaultdict(list)
+            for node, sent in self.running.values():
+                dispatched[node].append(sent)
+            nodes = {}
+            for name, node in self.nodes.items():
+                slot_time = node.slot_time + sum(now - connected for connected in node.slaves.values())
+                # at most one job per slave runs, the others wait in its batch
+                running_time = sum(now - sent for sent in sorted(dispatched[name])[:len(node.slaves)])
+                busy = min(1.0, (node.busy_time + running_time) / slot_time) if slot_time > 0 else 0.0
+                nodes[name] = {'slots': len(node.slaves),
+                               'running': len(dispatched[name]),
+                               'done': node.done,
+                               'busy_fraction': busy,
+                               'idle_fraction': 1.0 - busy}
+
+        return {'time': now,
+                'elapsed_seconds': elapsed,
+                'jobs': dict(counts, total=self.total, remaining=remaining),
+                'completion_rate': rate,
+                'job_time_seconds': job_time,
+                'nodes': nodes,
+                'eta_seconds': eta,
+                'eta_is_lower_bound': self.total is None}
+
+    def json(self):
+        """ Returns the metrics as JSON """
+        return json.dumps(self.snapshot(), indent=1, sort_keys=True)
+
+    def prometheus(self):
+        """ Returns the metrics in the Prometheus text exposition format """
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append("# HELP calcit_{0:s} {1:s}".format(name, help_text))
+            lines.append("# TYPE calcit_{0:s} {1:s}".format(name, kind))
+            for labels, value in samples:
+                if value is None:
+                    value = float('nan')
+                label_text = ",".join('{0:s}="{1:s}"'.format(key, str(label).replace('"', '\\"')) for key, label in labels)
+                if label_text:
+                    label_text = "{" + label_text + "}"
+                lines.append("calcit_{0:s}{1:s} {2}".format(name, label_text, float(value)))
+
+        jobs = snapshot['jobs']
+        metric("jobs", "gauge", "Jobs in every state.", [((('state', state),), jobs[state]) for state in STATES])
+        metric("jobs_total", "gauge", "Jobs in the run, NaN until known.", [((), jobs['total'])])
+        metric("completion_rate", "gauge", "Jobs finished per second over the last {0:.0f} s.".format(RATE_WINDOW), [((), snapshot['completion_rate'])])
+        job_time = snapshot['job_time_seconds']
+        metric("job_time_seconds", "summary", "Wall time of the last {0:d} finished jobs.".format(DURATION_WINDOW),
+               [((('quantile', "{0:g}".format(percentile / 100.0)),), job_time['p{0:d}'.format(percentile)]) for percentile in PERCENTILES])
+        lines.append("calcit_job_time_seconds_sum {0}".format(job_time['sum']))
+        lines.append("calcit_job_time_seconds_count {0}".format(float(job_time['count'])))
+        metric("job_time_seconds_mean", "gauge", "Mean wall time of the last {0:d} finished jobs.".format(DURATION_WINDOW), [((), job_time['mean'])])
+        nodes = sorted(snapshot['nodes'].items())
+        metric("node_slots", "gauge", "Connected slaves on every node.", [((('node', name),), node['slots']) for name, node in nodes])
+        metric("node_running", "gauge", "Running jobs on every node.", [((('node', name),), node['running']) for name, node in nodes])
+        metric("node_busy_fraction", "gauge", "Fraction of the slot time of every node spent running jobs.", [((('node', name),), node['busy_fraction']) for name, node in nodes])
+        metric("node_idle_fraction", "gauge", "Fraction of the slot time of every node spent idle.", [((('node', name),), node['idle_fraction']) for name, node in nodes])
+        metric("eta_seconds", "gauge", "Estimated seconds until the run is done, NaN if unknown.", [((), snapshot['eta_seconds'])])
+        metric("eta_is_lower_bound", "gauge", "1 while the total is unknown and the estimate only covers the jobs submitted so far.", [((), snapshot['eta_is_lower_bound'])])
+        metric("elapsed_seconds", "gauge", "Seconds since the run started.", [((), snapshot['elapsed_seconds'])])
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """ Serves /metrics in the Prometheus text format and /metrics.json as JSON """
+    def do_GET(self):
+        metrics = self.server.metrics
+        if self.path in ('/metrics', '/'):
+            body = metrics.prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == '/metrics.json':
+            body = metrics.json().encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(object):
+    """ HTTP server for the metrics running in a background thread
+
+        Arguments:
+        ----------
+        metrics -- the RunMetrics to serve
+        port -- the port to listen on
+        address -- the address to listen on. The default only accepts
+                   connections from the master itself.
+    """
+    def __init__(self, metrics, port, address="127.0.0.1"):
+        self.server = http.server.ThreadingHTTPServer((address, port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.metrics = metrics
+        self.thread = threading.Thread(target=self.server.serve_forever, name="calcit-metrics-server")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StatusFile(object):
+    """ File rewritten with the metrics every interval seconds
+
+        Files ending in .json get JSON and other files the Prometheus
+        text format, i.e. for the textfile collector of node_exporter.
+        The file is replaced atomically so readers never see a partial
+        file.
+
+        Arguments:
+        ----------
+        metrics -- the RunMetrics to write
+        filename -- the status file
+        interval -- seconds between rewrites
+    """
+    def __init__(self, metrics, filename, interval=STATUS_INTERVAL):
+        self.metrics = metrics
+        self.filename = filename
+        self.interval = interval
+        self.closed = threading.Event()
+        self.write()
+        self.thread = threading.Thread(target=self._run, name="calcit-status-file")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self):
+        if self.filename.endswith(".json"):
+            text = self.metrics.json()
+        else:
+            text = self.metrics.prometheus()
+        temporary = "{0:s}.{1:d}.tmp".format(self.filename, os.getpid())
+        with open(temporary, "w") as f:
+            f.write(text)
+        os.replace(temporary, self.filename)
+
+    def _run(self):
+        while not self.closed.wait(self.interval):
+            self.write()
+
+    def close(self):
+        """ Stops rewriting the file after writing the final metrics """
+        self.closed.set()
+        self.thread.join()
+        self.write()
@@ -0,0 +1,161 @@
+""" Compact representation of the atoms of a molecule
+
+    A Molecule stores the element numbers and coordinates of its atoms
+    in NumPy arrays so even QM/MM clusters with many thousands of atoms
+    are cheap to keep and fast to write to input files.
+"""
+import re
+
+import numpy
+
+# element symbols in order of atomic number. ELEMENTS[0] is a dummy atom.
+ELEMENTS = (
+    'X',
+    'H', 'He',
+    'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne',
+    'Na', 'Mg', 'Al', 'Si', 'P', 'S', 'Cl', 'Ar',
+    'K', 'Ca', 'Sc', 'Ti', 'V', 'Cr', 'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn', 'Ga', 'Ge', 'As', 'Se', 'Br', 'Kr',
+    'Rb', 'Sr', 'Y', 'Zr', 'Nb', 'Mo', 'Tc', 'Ru', 'Rh', 'Pd', 'Ag', 'Cd', 'In', 'Sn', 'Sb', 'Te', 'I', 'Xe',
+    'Cs', 'Ba', 'La', 'Ce', 'Pr', 'Nd', 'Pm', 'Sm', 'Eu', 'Gd', 'Tb', 'Dy', 'Ho', 'Er', 'Tm', 'Yb', 'Lu',
+    'Hf', 'Ta', 'W', 'Re', 'Os', 'Ir', 'Pt', 'Au', 'Hg', 'Tl', 'Pb', 'Bi', 'Po', 'At', 'Rn',
+    'Fr', 'Ra', 'Ac', 'Th', 'Pa', 'U', 'Np', 'Pu', 'Am', 'Cm', 'Bk', 'Cf', 'Es', 'Fm', 'Md', 'No', 'Lr',
+    'Rf', 'Db', 'Sg', 'Bh', 'Hs', 'Mt', 'Ds', 'Rg', 'Cn', 'Nh', 'Fl', 'Mc', 'Lv', 'Ts', 'Og',
+)
+
+ATOMIC_NUMBERS = dict((symbol.lower(), number) for number, symbol in enumerate(ELEMENTS))
+
+# element symbol at the start of an atom label such as 'C12' or 'HW'
+LABEL_SYMBOL = re.compile(r"^([A-Za-z]{1,2})")
+
+
+def atomic_number(label):
+    """ Returns the atomic number of an atom label
+
+        The label may be in any case and have a suffix that is not
+        part of an element symbol, i.e. 'C1' is carbon. Labels are read
+        as element symbols first, so 'CA' is calcium and not the alpha
+        carbon of a PDB atom name. Write such atoms with their element
+        symbol, i.e. 'C', in the .xyz file.
+
+        Raises: ValueError if the label is not an element
+
+        Arguments:
+        ----------
+        label -- the atom label
+    """
+    number = ATOMIC_NUMBERS.get(label.lower())
+    if number is not None:
+        return number
+    match = LABEL_SYMBOL.match(label)
+    if match is not None:
+        symbol = match.group(1).lower()
+        if symbol in ATOMIC_NUMBERS:
+            return ATOMIC_NUMBERS[symbol]
+        if symbol[:1] in ATOMIC_NUMBERS:
+            return ATOMIC_NUMBERS[symbol[:1]]
+    raise ValueError("Unknown element '{0:s}'.".format(label))
+
+
+def parse_atoms(block, n_atoms):
+    """ Parses atom lines of an .xyz file
+
+        Arguments:
+        ----------
+        block -- bytes with n_atoms lines of labels and coordinates
+        n_atoms -- the number of atoms
+
+        Returns:
+        --------
+        the Molecule of the atoms
+    """
+    tokens = block.split()
+    if len(tokens) == 4 * n_atoms:
+        labels = tokens[0::4]
+        coordinates = numpy.array([tokens[1::4], tokens[2::4], tokens[3::4]], dtype=numpy.float64).T
+    else:
+        # lines with extra columns
+        lines = [line.split() for line in block.splitlines() if line.strip()]
+        labels = [line[0] for line in lines]
+        coordinates = numpy.array([line[1:4] for line in lines], dtype=numpy.float64).reshape(-1, 3)
+    return Molecule.from_labels([label.decode("ascii") for label in labels], coordinates)
+
+
+class Molecule(object):
+    """ Element numbers and coordinates of the atoms in a molecule
+
+        Arguments:
+        ----------
+        numbers -- atomic numbers of the atoms
+        coordinates -- (number of atoms, 3) coordinates in Angstrom
+    """
+    def __init__(self, numbers, coordinates):
+        self.numbers = numpy.asarray(numbers, dtype=numpy.int16).reshape(-1)
+        self.coordinates = numpy.asarray(coordinates, dtype=numpy.float64).reshape(-1, 3)
+        if len(self.numbers) != len(self.coordinates):
+            raise ValueError("Got {0:d} elements but {1:d} coordinates.".format(len(self.numbers), len(self.coordinates)))
+
+    @classmethod
+    def from_labels(cls, labels, coordinates):
+        """ Returns a Molecule from atom labels and coordinates """
+        numbers = {}
+        for label in set(labels):
+            numbers[label] = atomic_number(label)
+        return cls([numbers[label] for label in labels], coordinates)
+
+    @classmethod
+    def from_xyz(cls, filename):
+        """ Reads a Molecule from an .xyz file
+
+            The first two lines (number of atoms and comment) are skipped
+            and every other non-empty line is an atom.
+
+            Arguments:
+            ----------
+            filename -- the .xyz file
+        """
+        with open(filename, "rb") as f:
+            lines = f.read().split(b"\n", 2)
+        block = lines[2] if len(lines) > 2 else b""
+        n_atoms = len([line for line in block.splitlines() if line.strip()])
+        return parse_atoms(block, n_atoms)
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __iter__(self):
+        """ Yields (symbol, [x, y, z]) for every atom like calcit.util.read_xyz """
+        return zip(self.symbols(), self.coordinates.tolist())
+
+    def symbols(self):
+        """ Returns the element symbols of the atoms """
+        return [ELEMENTS[number] for number in self.numbers.tolist()]
+
+    def format_atoms(self, row_format, start=0, stop=None):
+        """ Returns atoms formatted one per line
+
+            Arguments:
+            ----------
+            row_format -- format string of a line. The fields are the
+                          symbol {0}, atomic number {1} and x, y and z
+                          coordinates {2}, {3} and {4}.
+            start, stop -- the range of atoms to format
+
+            Returns:
+            --------
+            the lines joined by newlines without a trailing newline
+        """
+        numbers = self.numbers[start:stop].tolist()
+        x, y, z = self.coordinates[start:stop].T.tolist()
+        symbols = [ELEMENTS[number] for number in numbers]
+        return "\n".join(map(row_format.format, symbols, numbers, x, y, z))
+
+    def groups(self):
+        """ Returns (atomic number, start, stop) of runs of consecutive
+            atoms with the same element
+        """
+        if len(self) == 0:
+            return []
+        starts = numpy.flatnonzero(self.numbers[1:] != self.numbers[:-1]) + 1
+        starts = [0] + starts.tolist()
+        stops = starts[1:] + [len(self)]
+        return [(int(self.numbers[start]), start, stop) for start, stop in zip(starts, stops)]
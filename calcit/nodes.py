@@ -0,0 +1,227 @@
+""" Discovers the nodes to run slaves on and the number of cores
+    on each of them.
+
+    Nodes are returned as a list of (hostname, cores) tuples where
+    cores is None when the number of cores is not known. Node lists of
+    batch systems count cores (or MPI ranks), so job_slots turns the
+    cores into the number of jobs to run on every node.
+"""
+import collections
+import itertools
+import os
+import re
+
+# matches SLURM core and task counts such as '2(x3)' or '4'
+SLURM_TASKS = re.compile(r"^(\d+)(?:\(x(\d+)\))?$")
+
+# jobs run on a node when neither the user nor the node list says otherwise
+DEFAULT_JOBS_PER_NODE = 1
+
+
+def split_top_level(s, separator=','):
+    """ Splits s on separator but not inside square brackets """
+    parts = []
+    depth = 0
+    current = ""
+    for c in s:
+        if c == '[':
+            depth += 1
+        elif c == ']':
+            depth -= 1
+        if c == separator and depth == 0:
+            parts.append(current)
+            current = ""
+        else:
+            current += c
+    parts.append(current)
+    return [part for part in parts if part]
+
+
+def expand_range(ranges):
+    """ Expands the inside of a host list bracket such as '01-03,7'
+
+        Zero padding of the lower bound is kept.
+    """
+    values = []
+    for item in ranges.split(','):
+        if '-' in item:
+            low, high = item.split('-', 1)
+            width = len(low)
+            values.extend("{0:0{1}d}".format(i, width) for i in range(int(low), int(high) + 1))
+        else:
+            values.append(item)
+    return values
+
+
+def expand_hostlist(hostlist):
+    """ Expands a compressed host list into hostnames
+
+        Understands the format used by SLURM, i.e. 'node[01-03,07],gpu5'
+        gives node01, node02, node03, node07 and gpu5. A hostname may
+        contain several brackets.
+
+        Arguments:
+        ----------
+        hostlist -- the compressed host list
+    """
+    hosts = []
+    for item in split_top_level(hostlist.strip()):
+        pieces = re.split(r"\[([^\]]*)\]", item)
+        # every odd piece is the inside of a bracket
+        choices = [expand_range(piece) if i % 2 else [piece] for i, piece in enumerate(pieces)]
+        hosts.extend("".join(combination) for combination in itertools.product(*choices))
+    return hosts
+
+
+def count_slots(hosts):
+    """ Returns (hostname, count) for hosts in order of first appearance
+        where count is the number of times a host is listed.
+    """
+    slots = collections.OrderedDict()
+    for host in hosts:
+        slots[host] = slots.get(host, 0) + 1
+    return list(slots.items())
+
+
+def parse_nodes(nodes):
+    """ Parses a node specification given on the command line
+
+        Nodes are separated by commas and may use host list ranges.
+        The number of cores can be given after a colon, i.e.
+        'node[1-4]:8,localhost:2'.
+
+        Arguments:
+        ----------
+        nodes -- the node specification
+    """
+    result = []
+    for item in split_top_level(nodes):
+        cores = None
+        if ':' in item:
+            item, cores = item.rsplit(':', 1)
+            cores = int(cores)
+        result.extend((host, cores) for host in expand_hostlist(item))
+    return result
+
+
+def read_hostfile(filename):
+    """ Reads a file with one node per line
+
+        Lines can be a hostname, 'hostname slots=N' (as used by MPI) or
+        'hostname:N' where N is the number of cores. Hosts given on
+        several lines without a count, such as in a PBS_NODEFILE which
+        lists a node once per core, get a core per line. Empty lines and
+        text after # are ignored.
+
+        Arguments:
+        ----------
+        filename -- the file to read nodes from
+    """
+    listed = []
+    cores = {}
+    with open(filename, "r") as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            data = line.split()
+            host = data[0]
+            if ':' in host:
+                host, count = host.rsplit(':', 1)
+                cores[host] = cores.get(host, 0) + int(count)
+            for option in data[1:]:
+                if option.startswith('slots='):
+                    cores[host] = cores.get(host, 0) + int(option[len('slots='):])
+            listed.append(host)
+
+    nodes = []
+    for host, count in count_slots(listed):
+        nodes.append((host, cores.get(host, count)))
+    return nodes
+
+
+def slurm_nodes(environ):
+    """ Returns the nodes of a SLURM allocation
+
+        The number of cores is taken from SLURM_JOB_CPUS_PER_NODE or
+        else SLURM_TASKS_PER_NODE, i.e. '16(x3),8', if it is available.
+
+        Arguments:
+        ----------
+        environ -- the environment to read SLURM variables from
+    """
+    hosts = expand_hostlist(environ['SLURM_JOB_NODELIST'])
+    counts = environ.get('SLURM_JOB_CPUS_PER_NODE') or environ.get('SLURM_TASKS_PER_NODE', '')
+    cores = []
+    for item in split_top_level(counts):
+        match = SLURM_TASKS.match(item)
+        if match is None:
+            cores = []
+            break
+        cores.extend([int(match.group(1))] * int(match.group(2) or 1))
+
+    if len(cores) != len(hosts):
+        cores = [None] * len(hosts)
+    return list(zip(hosts, cores))
+
+
+def discover_nodes(nodes=None, hostfile=None, environ=None):
+    """ Returns the nodes to use as a list of (hostname, cores)
+
+        Nodes are taken from the first of
+          1) the nodes argument (see parse_nodes)
+          2) the hostfile argument (see read_hostfile)
+          3) the file in the PBS_NODEFILE environment variable
+          4) the SLURM_JOB_NODELIST environment variable
+        and localhost is used if none of them are set.
+
+        Arguments:
+        ----------
+        nodes -- node specification given by the user
+        hostfile -- file with nodes given by the user
+        environ -- the environment. Defaults to os.environ
+    """
+    if environ is None:
+        environ = os.environ
+
+    if nodes is not None:
+        return parse_nodes(nodes)
+
+    if hostfile is not None:
+        return read_hostfile(hostfile)
+
+    if environ.get('PBS_NODEFILE'):
+        return read_hostfile(environ['PBS_NODEFILE'])
+
+    if environ.get('SLURM_JOB_NODELIST'):
+        return slurm_nodes(environ)
+
+    return [('localhost', None)]
+
+
+def job_slots(nodes, cores_per_job=1, jobs_per_node=None):
+    """ Returns the number of jobs to run on every node
+
+        Arguments:
+        ----------
+        nodes -- list of (hostname, cores) tuples from discover_nodes
+        cores_per_job -- the number of cores every job uses
+        jobs_per_node -- the number of jobs to run on every node given by
+                         the user. None runs as many jobs as fit in the
+                         cores of a node and DEFAULT_JOBS_PER_NODE jobs
+                         on nodes with an unknown number of cores.
+
+        Returns:
+        --------
+        list of (hostname, slots) tuples
+    """
+    result = []
+    for host, cores in nodes:
+        if jobs_per_node is not None:
+            slots = jobs_per_node
+        elif cores is None:
+            slots = DEFAULT_JOBS_PER_NODE
+        else:
+            slots = max(1, cores // max(cores_per_job, 1))
+        result.append((host, slots))
+    return result
@@ -8,6 +8,8 @@ class OrcaJob(Job):
         Subclasses are responsible for setting the correct parameters
         in the calculation.
     """
+    __slots__ = ()
+
     def __init__(self, basename, **kwargs):
         Job.__init__(self, basename, **kwargs)
         self.program = 'orca'
@@ -19,10 +21,7 @@ class OrcaJob(Job):
             NB! This should return ONLY the coordinates
                 and nothing else
         """
-        s = ""
-        for label, coordinates in self.xyz_data:
-            s += "{0:s}{1[0]:20.9f}{1[1]:16.9f}{1[2]:16.9f}\n".format(label, coordinates)
-        return s[:-1]
+        return self.molecule.format_atoms("{0:s}{2:20.9f}{3:16.9f}{4:16.9f}")
 
     def get_memory(self):
         """ Orca wants memory in MB """
@@ -62,6 +61,8 @@ class OrcaJob(Job):
 
 
 class OrcaEnergyJob(OrcaJob):
+    __slots__ = ()
+
     def __init__(self, basename, **kwargs):
         OrcaJob.__init__(self, basename, **kwargs)
         self.runtype = 'energy'
@@ -0,0 +1,282 @@
+""" Extracts final energies, SCF convergence and timings from the
+    output files of the supported programs.
+
+    Outputs are memory-mapped and searched backwards from the end so
+    only the last part of even very large outputs is read. The parsers
+    are used by 'calcit collect' and, when CalcIt can be imported on the
+    nodes, by the slaves as soon as a job finishes.
+"""
+import collections
+import concurrent.futures
+import csv
+import itertools
+import mmap
+import os
+import re
+import threading
+
+import numpy
+
+from .jobs import program_matrix
+
+OutputSummary = collections.namedtuple('OutputSummary', ['program', 'energy', 'converged', 'scf_iterations', 'wall_time', 'normal_termination'])
+
+COLUMNS = ('job',) + OutputSummary._fields
+
+# matches the output files written by jobs, i.e. water_dalton_energy.out
+# or water_dalton_pde_monomer.out
+OUTPUT_FILENAME = re.compile(r"^(?P<job>.+)_(?P<program>orca|gamess|dalton)_(?P<runtype>{0:s})\.out$".format(
+    "|".join(sorted(program_matrix, key=len, reverse=True))))
+
+# summaries printed when a program finishes are searched for in the
+# last TAIL_WINDOW bytes only so failed jobs do not scan the whole output
+TAIL_WINDOW = 64 * 1024
+
+# number of outputs sent to each worker at once
+COLLECT_CHUNK_SIZE = 16
+
+# number of CSV rows converted to arrays at once when a table is closed
+TABLE_CHUNK_SIZE = 65536
+
+
+def tail(data):
+    """ Returns the offset where the last TAIL_WINDOW bytes of data start """
+    return max(0, len(data) - TAIL_WINDOW)
+
+
+def last_line(data, marker, start=0):
+    """ Returns the last line of data containing marker or None
+
+        The search starts at the end of data so only the bytes after
+        the last occurrence of marker are scanned.
+
+        Arguments:
+        ----------
+        data -- bytes or a memory map of the output
+        marker -- bytes to search for
+        start -- offset where the search stops
+    """
+    position = data.rfind(marker, start)
+    if position < 0:
+        return None
+    start = data.rfind(b"\n", 0, position) + 1
+    end = data.find(b"\n", position)
+    if end < 0:
+        end = len(data)
+    return data[start:end].decode("ascii", "replace")
+
+
+def search(data, marker, pattern, start=0):
+    """ Returns the groups of pattern on the last line with marker or None """
+    line = last_line(data, marker, start)
+    if line is None:
+        return None
+    match = re.search(pattern, line)
+    if match is None:
+        return None
+    return match.groups()
+
+
+def parse_orca(data):
+    energy = search(data, b"FINAL SINGLE POINT ENERGY", r"ENERGY\s+(\S+)")
+    converged = data.rfind(b"SCF CONVERGED AFTER")
+    iterations = search(data, b"SCF CONVERGED AFTER", r"AFTER\s+(\d+)\s+CYCLES", max(converged, 0))
+    runtime = search(data, b"TOTAL RUN TIME:", r"(\d+) days (\d+) hours (\d+) minutes (\d+) seconds (\d+) msec", tail(data))
+    wall_time = None
+    if runtime is not None:
+        days, hours, minutes, seconds, msec = map(int, runtime)
+        wall_time = ((days * 24 + hours) * 60 + minutes) * 60 + seconds + msec / 1000.0
+    return OutputSummary(program='orca',
+                         energy=float(energy[0]) if energy else None,
+                         converged=converged >= 0 and data.rfind(b"SCF NOT CONVERGED", converged) < 0,
+                         scf_iterations=int(iterations[0]) if iterations else None,
+                         wall_time=wall_time,
+                         normal_termination=data.rfind(b"ORCA TERMINATED NORMALLY", tail(data)) >= 0)
+
+
+def parse_gamess(data):
+    position = data.rfind(b" ENERGY IS ")
+    final = search(data, b" ENERGY IS ", r"FINAL .*ENERGY IS\s+(\S+)\s+AFTER\s+(\d+)\s+ITERATIONS", max(position, 0))
+    wall_time = search(data, b"TOTAL WALL CLOCK TIME", r"TIME=\s*([\d.]+)\s+SECONDS", tail(data))
+    # GAMESS reports a failed SCF just before the final energy
+    unconverged = position >= 0 and data.rfind(b"SCF IS UNCONVERGED", max(0, position - TAIL_WINDOW)) >= 0
+    return OutputSummary(program='gamess',
+                         energy=float(final[0]) if final else None,
+                         converged=final is not None and not unconverged,
+                         scf_iterations=int(final[1]) if final else None,
+                         wall_time=float(wall_time[0]) if wall_time else None,
+                         normal_termination=data.rfind(b"TERMINATED NORMALLY", tail(data)) >= 0)
+
+
+def parse_dalton(data):
+    energy = search(data, b"@    Final ", r"Final .*energy:\s+(\S+)")
+    iterations = search(data, b"converged in", r"converged in\s+(\d+)\s+iterations")
+    wall_time = search(data, b"Total wall time used in DALTON:", r"DALTON:\s+([\d.]+)\s+seconds", tail(data))
+    return OutputSummary(program='dalton',
+                         energy=float(energy[0]) if energy else None,
+                         converged=iterations is not None,
+                         scf_iterations=int(iterations[0]) if iterations else None,
+                         wall_time=float(wall_time[0]) if wall_time else None,
+                         normal_termination=wall_time is not None)
+
+
+PARSERS = {'orca': parse_orca, 'gamess': parse_gamess, 'dalton': parse_dalton}
+
+
+def output_program(filename):
+    """ Returns the program that wrote an output file judging from its name or None """
+    match = OUTPUT_FILENAME.match(os.path.basename(filename))
+    if match is None:
+        return None
+    return match.group('program')
+
+
+def parse_output(filename, program=None):
+    """ Returns the OutputSummary of an output file
+
+        Fields that are not found in the output are None. Module level
+        function so it can be sent to a process pool.
+
+        Raises: ValueError if the program is not supported or not known
+
+        Arguments:
+        ----------
+        filename -- the output file
+        program -- the program that wrote the file. Detected from the
+                   filename, i.e. water_orca_energy.out, if None.
+    """
+    if program is None:
+        program = output_program(filename)
+    if program not in PARSERS:
+        raise ValueError("Cannot parse '{0:s}'. Program '{1}' not supported. Please use one of {2}".format(filename, program, sorted(PARSERS)))
+
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return PARSERS[program](b"")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return PARSERS[program](data)
+
+
+def find_outputs(paths):
+    """ Returns the output files in paths
+
+        Directories are searched recursively for files written by
+        CalcIt jobs. Files are used as given.
+
+        Arguments:
+        ----------
+        paths -- files and directories
+    """
+    filenames = []
+    for path in paths:
+        if not os.path.isdir(path):
+            filenames.append(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            filenames.extend(os.path.join(root, filename) for filename in sorted(files) if OUTPUT_FILENAME.match(filename))
+    return filenames
+
+
+def job_name(filename):
+    """ Returns the job name of an output file, i.e. water_orca_energy """
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def try_parse_output(filename, program=None):
+    """ Returns the OutputSummary of an output file or the error
+        raised while parsing it
+    """
+    try:
+        return parse_output(filename, program)
+    except (IOError, ValueError) as e:
+        return e
+
+
+def collect(filenames, program=None, workers=None):
+    """ Parses output files in a process pool
+
+        Arguments:
+        ----------
+        filenames -- the output files
+        program -- the program that wrote the files. None detects it
+                   from each filename.
+        workers -- the number of processes. None uses all cores and
+                   1 parses in this process.
+
+        Returns:
+        --------
+        generator of filenames and their OutputSummary (or the
+        exception raised while parsing) in the order given
+    """
+    if workers == 1:
+        for filename in filenames:
+            yield filename, try_parse_output(filename, program)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        summaries = executor.map(try_parse_output, filenames, [program] * len(filenames), chunksize=COLLECT_CHUNK_SIZE)
+        for filename, summary in zip(filenames, summaries):
+            yield filename, summary
+
+
+class ResultsTable(object):
+    """ Table of parsed outputs written as CSV and NumPy .npz
+
+        Every row is keyed on the name of the output file without its
+        extension, i.e. water_orca_energy, whether it was added during
+        a run or by 'calcit collect'. Rows are written to <basename>.csv
+        as they are added so the table can be followed during a run.
+        Rows are not kept in memory. The columns are read back from the
+        CSV file and written to <basename>.npz when the table is closed.
+        Missing values are empty in the CSV file and NaN (or -1 for
+        iterations) in the .npz file.
+
+        Arguments:
+        ----------
+        basename -- filename of the table without extension
+        resume -- if True rows are added to an existing CSV file, i.e.
+                  of an interrupted run, instead of starting it over
+    """
+    def __init__(self, basename, resume=False):
+        self.basename = basename
+        filename = "{0:s}.csv".format(basename)
+        resume = resume and os.path.isfile(filename) and os.path.getsize(filename) > 0
+        self.file = open(filename, "a" if resume else "w", newline="", buffering=1)
+        self.writer = csv.writer(self.file)
+        if not resume:
+            self.writer.writerow(COLUMNS)
+        self.lock = threading.Lock()
+
+    def add(self, job, summary):
+        """ Adds the OutputSummary of a job to the table """
+        row = (job,) + tuple(summary)
+        with self.lock:
+            self.writer.writerow(["" if value is None else value for value in row])
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+        chunks = dict((column, []) for column in COLUMNS)
+        with open("{0:s}.csv".format(self.basename), "r", newline="") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            while True:
+                rows = [row for row in itertools.islice(reader, TABLE_CHUNK_SIZE) if len(row) == len(COLUMNS)]
+                if not rows:
+                    break
+                for column, values in zip(COLUMNS, zip(*rows)):
+                    chunks[column].append(table_column(column, values))
+        numpy.savez(self.basename, **dict((column, numpy.concatenate(chunks[column]) if chunks[column] else table_column(column, ()))
+                                          for column in COLUMNS))
+
+
+def table_column(column, values):
+    """ Returns the array of CSV values of a column of a ResultsTable """
+    if column in ('job', 'program'):
+        return numpy.array(values, dtype=str)
+    if column in ('converged', 'normal_termination'):
+        return numpy.array([value == 'True' for value in values], dtype=bool)
+    if column == 'scf_iterations':
+        return numpy.array([int(value) if value else -1 for value in values], dtype=numpy.int64)
+    return numpy.array([float(value) if value else numpy.nan for value in values], dtype=numpy.float64)
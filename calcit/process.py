@@ -1,94 +1,347 @@
+import collections
+import concurrent.futures
 import logging
-import multiprocessing
-import multiprocessing.managers
 import os
 import socket
 import stat
 import subprocess
+import threading
 import time
-from queue import Queue
+import zlib
+from queue import Queue, Empty
 
-import numpy
-
-from .util import substitute_file, create_scratch_directory, CalcItJobCreateError
+from .cache import job_cache_key, cacheable
+from .history import describe_job
+from .journal import PREPARED, DISPATCHED, DONE, FAILED
+from .parsers import OutputSummary, try_parse_output, job_name as output_job_name
+from .server import DispatchServer, LEASE_TIMEOUT, MSG_SLAVE_LOST, MSG_JOBS_DISPATCHED
+from .util import substitute_file, create_scratch_directory, CalcItJobCreateError, CalcItSlaveError
+from .workflow import JobGraph
 
 # delays in seconds to different processes
-MANAGER_SHUTDOWN_DELAY = 3
+RESULT_POLL_DELAY = 1
+SLAVE_DRAIN_TIMEOUT = 60
+SLAVE_LAUNCH_TIMEOUT = 60
+SLAVE_READY_TIMEOUT = 300
+
+# maximum number of remote shells launching slaves at the same time
+SLAVE_LAUNCH_CONCURRENCY = 32
+
+# slaves send this many heartbeats per lease timeout
+HEARTBEATS_PER_LEASE = 4
+
+# number of prepared jobs kept waiting in the job queue per slave process
+QUEUE_SIZE_PER_SLAVE = 2
 
-JOB_QUEUE_NAME = 'get_job_queue'
-RES_QUEUE_NAME = 'get_result_queue'
+# number of jobs being prepared concurrently per preparation worker
+PREPARE_JOBS_PER_WORKER = 4
+
+# maximum number of messages the master retrieves from the result queue at once
+RESULT_BATCH_SIZE = 256
+
+# messages put on the result queue by slaves. Every message is a tuple
+# where the first element is the kind of message.
+MSG_RESULT = 'result'
+MSG_SLAVE_READY = 'ready'
+MSG_SLAVE_DONE = 'done'
+# MSG_SLAVE_LOST is put on the result queue by the server when a slave
+# disappears while it holds jobs. The jobs are requeued by the server.
+# MSG_JOBS_DISPATCHED is put there when jobs are sent to a slave.
+
+# put on the job queue to tell slaves that no more jobs will come
+END_OF_WORK = None
 
 #logging.basicConfig(level=logging.INFO)
 
 
-def process_jobs(port, authorization_key, jobs, nodes, jobs_per_node, work_dir, remote_shell, global_paths, do_execute):
+def process_jobs(port, authorization_key, jobs, nodes, jobs_per_node, work_dir, remote_shell, global_paths, do_execute, queue_size=None, prepare_workers=1, prepare_pool='thread', max_batch_size=1, node_resources=(None, None), history=None, launch_concurrency=SLAVE_LAUNCH_CONCURRENCY, ready_timeout=SLAVE_READY_TIMEOUT, log_dir=None, lease_timeout=LEASE_TIMEOUT, journal=None, cache=None, results=None, scratch_pool=None, metrics=None, trace=None):
     """ Parallel processing of jobs that are given in a script, the name of
         which is in the filenames list and located in a directory given in the
         list of directories.
 
+        Jobs are consumed lazily from the jobs iterable. Each job is prepared
+        (input files written) and put on a bounded job queue which blocks the
+        producer when the slaves fall behind. Results are retrieved at the same
+        time as new jobs are produced.
+
         Arguments:
         port -- the port used for communation
         authorization_key -- program secret used to identify correct server
-        jobs -- the jobs to execute
-        nodes -- list of nodes to use during processing
-        jobs_per_node -- number of jobs to start per node
+        jobs -- the jobs to execute. Can be any iterable, i.e. a generator,
+                or a calcit.workflow.JobGraph. Jobs in a graph are prepared
+                and sent to the slaves once their dependencies finished.
+        nodes -- list of nodes to use during processing. Either hostnames or
+                 (hostname, slots) tuples where slots is the number of jobs
+                 to start on the node.
+        jobs_per_node -- number of jobs to start per node when not given in nodes
         work_dir -- the work directory where the slave should be launched from
         remote_shell -- the remote shell to use when connecting to nodes
         global_paths -- directories used to find calcit and its data folders.
                         NB! This is different from work_dir and scratch directories
                             in that global_paths have nothing to do with computations
         do_execute -- whether or not to actually execute calculations
+        queue_size -- maximum number of prepared jobs waiting in the job queue.
+                      Defaults to QUEUE_SIZE_PER_SLAVE (or max_batch_size if
+                      larger) jobs per slave process.
+        prepare_workers -- number of workers writing input files and run scripts
+        prepare_pool -- either 'thread' or 'process' to select the kind of
+                        pool used when prepare_workers is larger than one
+        max_batch_size -- maximum number of jobs a slave fetches at once.
+                          Slaves adapt the batch size to the job durations.
+        node_resources -- tuple of cores and memory (in MB) available on each
+                          node. Jobs are only started on a node when their
+                          cores and memory fit. None means no limit and 'auto'
+                          detects the resources on the node.
+        history -- calcit.history.RuntimeHistory to record the wall time of
+                   jobs that terminated normally in. None disables recording.
+        launch_concurrency -- maximum number of nodes slaves are launched on at once
+        ready_timeout -- seconds a node has to connect its slaves before it is
+                         reported as failed
+        log_dir -- directory on the nodes where the output of jobs is written.
+                   None uses the temporary directory of each node. Only
+                   the output of failed jobs is kept.
+        lease_timeout -- seconds a slave may go without a heartbeat before
+                         its jobs are given to other slaves
+        journal -- calcit.journal.RunJournal to record the state of every job
+                   in. Jobs that are done in a resumed journal must already
+                   be skipped with journal.skip_completed, or completed in
+                   the JobGraph, by the caller. None disables the journal.
+        cache -- calcit.cache.ResultCache with outputs of earlier runs. Jobs
+                 found in it are not run and the outputs of successful jobs
+                 are added to it. None disables the cache.
+        results -- calcit.parsers.ResultsTable to add the energy, convergence
+                   and timings of every finished job to. The outputs are
+                   parsed by the slaves if CalcIt is installed on the nodes
+                   and by the master otherwise. None disables parsing.
+        scratch_pool -- tuple of the node local scratch directory, the space
+                        (in MB) to keep free in it, a tmpfs directory and the
+                        largest scratch_per_job (in MB) put on tmpfs. Every
+                        job gets its own directory in the pool which is
+                        removed when the job ends and jobs wait for their
+                        scratch_per_job to be free. None uses the scratch
+                        directory of the jobs as is.
+        metrics -- calcit.metrics.RunMetrics updated as jobs are queued,
+                   run and finished. None disables metrics.
+        trace -- calcit.trace.TraceRecorder to record when every job is
+                 rendered, queued, sent to a slave, run and returned in.
+                 None disables tracing.
     """
 
-    def send_jobs_to_queue(jobs, job_queue):
+    def add_result(job_name, job, summary=None):
+        """ Adds the parsed output of a finished job to the results table
+
+            Rows are keyed on the name of the output file without its
+            extension like the rows written by 'calcit collect'.
+        """
+        summary = job_summary(job, summary)
+        if isinstance(summary, Exception):
+            logging.warning("Could not parse the output of '{0:s}': {1}".format(job_name, summary))
+            return
+        if summary.energy is not None:
+            logging.info("{0:s} energy {1:.10f} (converged: {2})".format(job_name, summary.energy, summary.converged))
+        results.add(output_job_name(job.get_output_filename()), summary)
+
+    graph = jobs if isinstance(jobs, JobGraph) else None
+
+    def job_finished(job_name, success):
+        """ Releases the jobs in the graph that depend on a finished job """
+        if graph is None:
+            return
+        cancelled = graph.finished(job_name, success)
+        for name in cancelled:
+            if journal is not None:
+                journal.record(FAILED, name)
+        if metrics is not None and cancelled:
+            metrics.jobs_cancelled(cancelled)
+
+    class JobProducer(threading.Thread):
         """ Sends jobs to the job queue specified on input
 
             We wrap it like this so we can shutdown the server appropriately
-            without causing hangups
+            without causing hangups. The producer runs in its own thread
+            so results can be retrieved while jobs are still created.
 
-            Raises:
-            CalcItJobCreateError if there was an error creating the job
+            Any exception raised while creating jobs (for instance
+            CalcItJobCreateError) is stored and re-raised by the master.
+
+            Jobs that are submitted but not finished are kept in the
+            in_flight dictionary keyed on the job name. Jobs whose output
+            is in the result cache are completed here and never submitted.
+
+            Jobs of a JobGraph are taken from it a few at a time so jobs
+            released while others are prepared compete by their priority.
+            A job of a graph that cannot be prepared, i.e. because a file
+            written by a job it depends on is missing, fails on its own
+            and only the jobs depending on it are cancelled.
 
             Arguments:
             jobs -- the jobs to be processed
             job_queue -- the queue to submit the jobs to
         """
-        total_job_count = len(jobs)
-        logging.info("Submitting {0:3d} jobs to the queue.".format(total_job_count))
-        for job_index, job in enumerate(jobs, start=1):
-            job_str = repr(job)
+        def __init__(self, jobs, job_queue):
+            threading.Thread.__init__(self, name="calcit-job-producer")
+            self.daemon = True
+            self.jobs = jobs
+            self.job_queue = job_queue
+            self.job_count = 0
+            self.in_flight = {}
+            self.cache_keys = {}
+            self.cached = 0
+            self.failed = 0
+            self.error = None
+            self.done = threading.Event()
+
+        def run(self):
             try:
-                command = job.cmd(global_paths)
-            except:
-                raise
-            else:
-                cmd = (job_str, command)
-                logging.info("Job '{0[0]:s}' added to queue. Command is '{0[1]:s}'".format(cmd))
-                if do_execute:
-                    job_queue.put(cmd)
-
-        return total_job_count
-
-    def retrieve_jobs_from_queue(total_job_count, result_queue):
+                batches = [self.jobs]
+                if graph is not None:
+                    batches = iter(lambda: graph.take(PREPARE_JOBS_PER_WORKER * max(prepare_workers, 1)), [])
+                for batch in batches:
+                    for job, cmd, rendered in prepare_jobs(batch, global_paths, prepare_workers, prepare_pool, graph is not None):
+                        if isinstance(cmd, Exception):
+                            self.prepare_failed(job, cmd)
+                            continue
+                        if trace is not None:
+                            trace.rendered(cmd[0], *rendered)
+                        self.submit(job, cmd)
+                if metrics is not None:
+                    metrics.all_queued()
+            except Exception as e:
+                self.error = e
+            finally:
+                self.done.set()
+
+        def prepare_failed(self, job, error):
+            """ Fails a job of a graph that could not be prepared """
+            job_name = repr(job)
+            self.failed += 1
+            logging.error("Could not prepare '{0:s}': {1}".format(job_name, error))
+            if journal is not None:
+                journal.record(FAILED, job_name)
+            if metrics is not None:
+                metrics.job_failed(job_name)
+            job_finished(job_name, False)
+
+        def submit(self, job, cmd):
+            if cache is not None and cacheable(job):
+                key = job_cache_key(job)
+                if cache.fetch(key, job.get_output_filename()):
+                    self.cached += 1
+                    logging.info("Job '{0:s}' copied from the result cache.".format(cmd[0]))
+                    if journal is not None:
+                        journal.record(DONE, cmd[0], "cache")
+                    if metrics is not None:
+                        metrics.job_cached(cmd[0])
+                    if results is not None:
+                        add_result(cmd[0], job)
+                    job_finished(cmd[0], True)
+                    return
+                self.cache_keys[cmd[0]] = key
+            self.in_flight[cmd[0]] = job
+            if journal is not None:
+                journal.record(PREPARED, cmd[0])
+            if metrics is not None:
+                metrics.job_queued(cmd[0])
+            if trace is not None:
+                trace.queued(cmd[0])
+            self.job_queue.put(cmd)  # blocks when the queue is full
+            self.job_count += 1
+            logging.info("Job '{0[0]:s}' added to queue. Command is '{0[1]:s}'".format(cmd))
+
+    def retrieve_jobs_from_queue(producer, result_queue, slaves):
         """ Retrieve jobs from the processing queue
 
+            Results are retrieved until the producer has submitted all
+            jobs and every submitted job has returned a result. Jobs of
+            lost slaves are run again by other slaves so a job can return
+            more than one result. Only the first result is counted.
+
+            Raises:
+            CalcItSlaveError if no node could start its slaves
+
             Arguments:
-            total_job_count -- the number of jobs we expect
+            producer -- the thread that submits jobs to the job queue
             result_queue -- the queue to retrieve jobs from
+            slaves -- the SlavePool keeping track of the slaves
         """
         jobs_completed = 0
-        while jobs_completed < total_job_count:
-            if not do_execute:
-                break
-            job_name, time_to_complete, stdout, stderr = result_queue.get()
-            jobs_completed += 1
-            logging.info("Finished '{2:s}' ({0:d} of {1:3d}) in {3:9.2f}s.".format(jobs_completed, total_job_count, job_name, time_to_complete))
-            if len(stdout[:-1]) > 0:
-                logging.info("{0:s} STDOUT: {1:s}".format(job_name, stdout[:-1].decode('utf8')))
+        while not producer.done.is_set() or jobs_completed < producer.job_count:
+            if producer.error is not None:
+                raise producer.error
+            slaves.check()
+            try:
+                messages = result_queue.get_batch(RESULT_BATCH_SIZE, timeout=RESULT_POLL_DELAY)
+            except Empty:
+                continue
+            received = time.time()
+            for message in messages:
+                if metrics is not None:
+                    metrics.observe(message)
+                if message[0] == MSG_JOBS_DISPATCHED:
+                    if journal is not None:
+                        for job_name in message[2]:
+                            journal.record(DISPATCHED, job_name, message[1].split(':')[0])
+                    if trace is not None:
+                        trace.dispatched(message[2], message[1], message[3])
+                if not is_result_message(message, slaves):
+                    continue
+                slave_id, job_name, time_to_complete, returncode, stdout, stderr, log_files, summary, timings = message[1:]
+                if trace is not None:
+                    trace.finished(job_name, slave_id, timings, received)
+                if job_name not in producer.in_flight:
+                    logging.info("Ignoring repeated result of '{0:s}' from {1:s}.".format(job_name, slave_id))
+                    continue
+                job = producer.in_flight.pop(job_name)
+                jobs_completed += 1
+                if metrics is not None:
+                    metrics.job_finished(job_name, slave_id, time_to_complete, returncode == 0)
+                logging.info("Finished '{2:s}' ({0:d} of {1:3d}) in {3:9.2f}s.".format(jobs_completed, producer.job_count, job_name, time_to_complete))
+                stdout = decompress_tail(stdout)
+                if len(stdout) > 0:
+                    logging.info("{0:s} STDOUT: {1:s}".format(job_name, stdout))
+                if returncode != 0:
+                    logging.warning("{0:s} exited with code {1:d} on {2:s}. Output is in {3[0]:s} and {3[1]:s}. STDERR: {4:s}".format(job_name, returncode, slave_id, log_files, decompress_tail(stderr)))
+                if journal is not None:
+                    journal.record(DONE if returncode == 0 else FAILED, job_name, slave_id.split(':')[0])
+                key = producer.cache_keys.pop(job_name, None)
+                if key is not None and returncode == 0:
+                    summary = job_summary(job, summary)
+                    if not cache_output(cache, key, job, returncode, summary):
+                        logging.warning("Output of '{0:s}' is not stored in the result cache since the job did not terminate normally.".format(job_name))
+                if results is not None:
+                    add_result(job_name, job, summary)
+                if history is not None and returncode == 0:
+                    summary = job_summary(job, summary)
+                if history is not None and terminated_normally(returncode, summary):
+                    # crashed jobs would skew the runtime fits with their short wall times
+                    history.record(job_name, describe_job(job), slave_id.split(':')[0], time_to_complete)
+                job_finished(job_name, returncode == 0)
+            if history is not None:
+                history.commit()
+
+        if producer.error is not None:
+            raise producer.error
+        if journal is not None and journal.skipped:
+            logging.info("Skipped {0:d} jobs that were done in journal '{1:s}'.".format(journal.skipped, journal.filename))
+        if producer.cached:
+            logging.info("Copied {0:d} jobs from the result cache.".format(producer.cached))
+        if producer.failed:
+            logging.warning("Could not prepare {0:d} jobs.".format(producer.failed))
+        logging.info("All {0:d} jobs finished.".format(jobs_completed))
 
     if not do_execute:
         return
 
+    if metrics is not None and metrics.total is None:
+        if graph is not None:
+            metrics.total = len(graph) - (journal.skipped if journal is not None else 0)
+        elif hasattr(jobs, '__len__'):
+            metrics.total = len(jobs)
+
+    nodes = node_slots(nodes, jobs_per_node)
+    if queue_size is None:
+        queue_size = max(QUEUE_SIZE_PER_SLAVE, max_batch_size) * sum(slots for node, slots in nodes)
+
     authorization_key_encoded = authorization_key.encode("utf-8")
 
     # get hostname of running script to pass to slaves
@@ -96,126 +349,459 @@ def process_jobs(port, authorization_key, jobs, nodes, jobs_per_node, work_dir,
 
     # create manager and queues
     # logging.info("Creating manager".format())
-    server, job_queue, result_queue = start_server(port, authorization_key_encoded)
-
-    # start the slaves on the remote nodes
-    start_slaves(host, port, authorization_key, nodes, jobs_per_node, work_dir, remote_shell, global_paths)
+    server, job_queue, result_queue = start_server(port, authorization_key_encoded, queue_size, lease_timeout)
 
     try:
-        # send jobs to job queue
-        total_job_count = send_jobs_to_queue(jobs, job_queue)
+        # start sending jobs to the job queue before the slaves are up
+        # so the first jobs are ready when they connect
+        producer = JobProducer(jobs, job_queue)
+        producer.start()
+
+        # start the slaves on the remote nodes. Jobs are dispatched
+        # as soon as the first slaves connect.
+        slaves = SlavePool(nodes, ready_timeout)
+        start_slaves(host, port, authorization_key, nodes, jobs_per_node, work_dir, remote_shell, global_paths, max_batch_size, node_resources, slaves, launch_concurrency, log_dir, lease_timeout / HEARTBEATS_PER_LEASE, scratch_pool)
 
-        # retrieve results from slaves
-        retrieve_jobs_from_queue(total_job_count, result_queue)
+        # retrieve results from slaves while jobs are being produced
+        retrieve_jobs_from_queue(producer, result_queue, slaves)
+
+        # tell slaves to quit and wait for them to do so
+        drain_slaves(job_queue, result_queue, slaves, metrics=metrics)
     finally:
         # shutdown server.
         stop_server(server)
 
 
-def start_server(port, authorization_key):
+class SlavePool(object):
+    """ Keeps track of the nodes slaves are launched on and the
+        slaves that are connected to the master.
+
+        Slaves are identified as '<node>:<pid>'. A node is ready when
+        its first slave connects and failed if the launch failed or no
+        slave connected within ready_timeout seconds. Slaves that stop
+        sending heartbeats or drop their connection before the end of
+        work are lost, whether or not they hold jobs.
+
+        Arguments:
+        nodes -- list of (hostname, slots) tuples slaves are launched on
+        ready_timeout -- seconds a node has to connect before it has failed
+    """
+    def __init__(self, nodes, ready_timeout=SLAVE_READY_TIMEOUT):
+        self.ready_timeout = ready_timeout
+        self.started = time.time()
+        self.pending_nodes = set(node for node, slots in nodes)
+        self.ready_nodes = set()
+        self.failed_nodes = {}
+        self.connected = set()
+        self.lost = set()
+        self.lock = threading.Lock()
+
+    def launch_failed(self, node, reason):
+        """ Marks node as failed because its slaves could not be launched """
+        with self.lock:
+            self.pending_nodes.discard(node)
+            self.failed_nodes[node] = reason
+        logging.error("Could not start slaves on node {0:s}: {1:s}".format(node, reason))
+
+    def slave_ready(self, slave_id):
+        node = slave_id.rsplit(':', 1)[0]
+        with self.lock:
+            self.connected.add(slave_id)
+            if node in self.pending_nodes:
+                self.pending_nodes.discard(node)
+                self.ready_nodes.add(node)
+                logging.info("Node {0:s} ready after {1:.1f}s.".format(node, time.time() - self.started))
+        logging.info("Slave '{0:s}' connected.".format(slave_id))
+
+    def slave_done(self, slave_id):
+        with self.lock:
+            self.connected.discard(slave_id)
+        logging.info("Slave '{0:s}' finished.".format(slave_id))
+
+    def slave_lost(self, slave_id, job_names):
+        with self.lock:
+            self.connected.discard(slave_id)
+            self.lost.add(slave_id)
+        if job_names:
+            logging.error("Slave '{0:s}' was lost. Its {1:d} jobs are given to other slaves: {2}".format(slave_id, len(job_names), job_names))
+        else:
+            logging.error("Slave '{0:s}' was lost while it held no jobs.".format(slave_id))
+
+    def check(self):
+        """ Fails nodes that did not connect within ready_timeout
+
+            Raises:
+            CalcItSlaveError if no node is ready and none are pending or
+            all slaves have been lost
+        """
+        if self.pending_nodes and time.time() - self.started > self.ready_timeout:
+            for node in sorted(self.pending_nodes):
+                self.launch_failed(node, "no slave connected within {0:d}s".format(int(self.ready_timeout)))
+
+        if not self.ready_nodes and not self.pending_nodes:
+            raise CalcItSlaveError("Slaves could not be started on any node: {0}".format(self.failed_nodes))
+
+        if self.lost and not self.connected and not self.pending_nodes:
+            raise CalcItSlaveError("All slaves were lost: {0}".format(sorted(self.lost)))
+
+
+def decompress_tail(data):
+    """ Returns the text of a compressed output tail sent by a slave """
+    return zlib.decompress(data).decode('utf8', 'replace').rstrip()
+
+
+def job_summary(job, summary=None):
+    """ Returns the OutputSummary of a finished job
+
+        Arguments:
+        job -- the finished job
+        summary -- the summary parsed by the slave or returned by an
+                   earlier call. The output of the job is parsed if None.
+
+        Returns:
+        the OutputSummary or the exception raised while parsing the output
+    """
+    if summary is None:
+        summary = try_parse_output(job.get_output_filename(), job.get_program())
+    if isinstance(summary, Exception):
+        return summary
+    return OutputSummary(*summary)
+
+
+def terminated_normally(returncode, summary):
+    """ Returns whether a job exited with code 0 and its OutputSummary,
+        from job_summary, reports normal termination
+    """
+    return returncode == 0 and isinstance(summary, OutputSummary) and bool(summary.normal_termination)
+
+
+def cache_output(cache, key, job, returncode, summary):
+    """ Stores the output of a finished job in the result cache
+
+        Only outputs of jobs that exited with code 0 and whose output
+        the parser reports as terminated normally are stored. Outputs
+        of crashed jobs would otherwise be used as done by later runs.
+
+        Arguments:
+        cache -- the calcit.cache.ResultCache to store the output in
+        key -- the cache key of the job
+        job -- the finished job
+        returncode -- the exit code of the run script of the job
+        summary -- the OutputSummary of the output from job_summary
+
+        Returns:
+        True if the output was stored
+    """
+    if not terminated_normally(returncode, summary):
+        return False
+    if not os.path.isfile(job.get_output_filename()):
+        return False
+    cache.store(key, job.get_program(), job.get_output_filename())
+    return True
+
+
+def is_result_message(message, slaves):
+    """ Handles slave bookkeeping messages from the result queue
+
+        Arguments:
+        message -- message obtained from the result queue
+        slaves -- the SlavePool keeping track of slaves. Updated by this function.
+
+        Returns:
+        True if the message is a job result
+    """
+    kind = message[0]
+    if kind == MSG_SLAVE_READY:
+        slaves.slave_ready(message[1])
+    elif kind == MSG_SLAVE_DONE:
+        slaves.slave_done(message[1])
+    elif kind == MSG_SLAVE_LOST:
+        slaves.slave_lost(message[1], message[2])
+    return kind == MSG_RESULT
+
+
+def drain_slaves(job_queue, result_queue, slaves, timeout=SLAVE_DRAIN_TIMEOUT, metrics=None):
+    """ Signals end of work to the slaves and waits for all connected
+        slaves to acknowledge it before the server is shut down
+
+        Every slave that receives END_OF_WORK puts it back on the job
+        queue for the remaining slaves and reports back with MSG_SLAVE_DONE.
+
+        Arguments:
+        job_queue -- the queue to put the end of work signal on
+        result_queue -- the queue slaves report back on
+        slaves -- the SlavePool keeping track of connected slaves
+        timeout -- seconds to wait for slaves before giving up
+        metrics -- calcit.metrics.RunMetrics to report the slaves leaving
+                   to. None disables metrics.
+    """
+    job_queue.put(END_OF_WORK)
+    deadline = time.time() + timeout
+    while slaves.connected:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            logging.warning("Slaves {0} did not finish in {1:d}s.".format(sorted(slaves.connected), timeout))
+            return
+        try:
+            messages = result_queue.get_batch(RESULT_BATCH_SIZE, timeout=min(remaining, RESULT_POLL_DELAY))
+        except Empty:
+            continue
+        for message in messages:
+            if metrics is not None:
+                metrics.observe(message)
+            is_result_message(message, slaves)
+
+
+def prepare_job(job, global_paths):
+    """ Writes the input file and run script of a single job
+
+        Module level function so it can be sent to a process pool.
+
+        Arguments:
+        job -- the job to prepare
+        global_paths -- directories used to find calcit and its data folders.
+
+        Returns:
+        tuple of the job name, the command to run on the slave, the
+        cores, memory and node local scratch (in MB) the job needs and
+        the program and output file the slave can parse when the job is done
+    """
+    return repr(job), job.cmd(global_paths), job.cores_per_job, job.memory_per_job, job.scratch_per_job, (job.get_program(), job.get_output_filename())
+
+
+def timed_prepare_job(job, global_paths, return_errors=False):
+    """ Prepares a single job and records how long it took
+
+        Arguments:
+        job -- the job to prepare
+        global_paths -- directories used to find calcit and its data folders.
+        return_errors -- return the exception instead of raising it if
+                         the job could not be prepared
+
+        Returns:
+        the tuple of prepare_job (or the exception) and a tuple of the
+        times preparation started and ended and the process and thread
+        that prepared the job
+    """
+    start = time.time()
+    try:
+        cmd = prepare_job(job, global_paths)
+    except Exception as e:
+        if not return_errors:
+            raise
+        cmd = e
+    worker = "{0:d}/{1:s}".format(os.getpid(), threading.current_thread().name)
+    return cmd, (start, time.time(), worker)
+
+
+def timed_prepare_job_in_process(job, global_paths, return_errors=False):
+    """ Prepares a single job in a process pool
+
+        The job is prepared in a copy of the job of the master, so the
+        JobSize the copy found is returned to keep on the job of the
+        master and spare it reading the geometry again.
+
+        Arguments:
+        job -- the job to prepare
+        global_paths -- directories used to find calcit and its data folders.
+        return_errors -- return the exception instead of raising it if
+                         the job could not be prepared
+
+        Returns:
+        the tuple of timed_prepare_job and the JobSize of the job or None
+    """
+    return timed_prepare_job(job, global_paths, return_errors), getattr(job, 'size', None)
+
+
+def prepare_jobs(jobs, global_paths, prepare_workers=1, prepare_pool='thread', return_errors=False):
+    """ Prepares jobs, possibly in parallel, and yields them with their commands
+
+        Jobs are yielded in the order they are given. At most
+        PREPARE_JOBS_PER_WORKER jobs per worker are prepared ahead of
+        the consumer so a lazy iterable of jobs is never exhausted up front.
+
+        Arguments:
+        jobs -- iterable of jobs to prepare
+        global_paths -- directories used to find calcit and its data folders.
+        prepare_workers -- number of concurrent workers. 1 prepares serially.
+        prepare_pool -- 'thread' or 'process'
+        return_errors -- yield the exception of a job that could not be
+                         prepared in place of its tuple instead of raising it
+
+        Returns:
+        generator of jobs, their tuples from prepare_job and the times
+        and workers from timed_prepare_job
+    """
+    if prepare_workers <= 1:
+        for job in jobs:
+            yield (job,) + timed_prepare_job(job, global_paths, return_errors)
+        return
+
+    executors = {'thread': concurrent.futures.ThreadPoolExecutor,
+                 'process': concurrent.futures.ProcessPoolExecutor}
+    if prepare_pool not in executors:
+        raise ValueError("Unknown preparation pool '{0:s}'. Please use one of {1}".format(prepare_pool, list(executors.keys())))
+
+    def prepared(job, future):
+        if prepare_pool != 'process':
+            return (job,) + future.result()
+        result, size = future.result()
+        if size is not None:
+            job.size = size
+        return (job,) + result
+
+    prepare = timed_prepare_job_in_process if prepare_pool == 'process' else timed_prepare_job
+    max_pending = PREPARE_JOBS_PER_WORKER * prepare_workers
+    with executors[prepare_pool](max_workers=prepare_workers) as executor:
+        pending = collections.deque()
+        for job in jobs:
+            pending.append((job, executor.submit(prepare, job, global_paths, return_errors)))
+            if len(pending) >= max_pending:
+                yield prepared(*pending.popleft())
+
+        while pending:
+            yield prepared(*pending.popleft())
+
+
+def start_server(port, authorization_key, queue_size=0, lease_timeout=LEASE_TIMEOUT):
     """ Starts the server on the master node
 
         Arguments:
         port -- Port to use for communication
         authorization_key -- program secret used to identify correct server
+        queue_size -- maximum number of jobs in the job queue. 0 means unbounded.
+        lease_timeout -- seconds without a heartbeat before the jobs of a slave are requeued
+
+        Returns:
+        the server, the job queue to put jobs on and the result queue
     """
     logging.info("Starting server on port {0:d}".format(port, authorization_key))
 
-    manager = make_server_manager(port, authorization_key)
-    manager.start()
-    job_queue = manager.get_job_queue()
-    result_queue = manager.get_result_queue()
-    return manager, job_queue, result_queue
+    result_queue = BatchQueue()
+    server = DispatchServer(port, authorization_key, queue_size, result_queue, lease_timeout)
+    server.start()
+    return server, server, result_queue
 
 
-def stop_server(manager):
+def stop_server(server):
     """ Stops the server on the master node when all jobs have finished
 
         Arguments:
-        manager -- the server to stop
+        server -- the server to stop
     """
     logging.info("Shutting down server.")
-    time.sleep(MANAGER_SHUTDOWN_DELAY)  # needed to prevent hanging
-    manager.shutdown()
+    server.shutdown()
 
 
-def make_server_manager(port, authorization_key):
-    """ Create a manager for the server, listening on the given port.
+class BatchQueue(Queue):
+    """ Queue that can get and put several items in one call
 
-        Return a manager object with get_job_q and get_result_q
-        methods.
+        Used by the master to read the results that the dispatch
+        server receives from the slaves in batches.
+    """
+    def get_batch(self, max_items, timeout=None):
+        """ Blocks until at least one item is available and returns
+            it together with up to max_items - 1 items that are
+            immediately available.
 
-        Arguments:
-        port -- Port to use for communication
-        authorization_key -- program secret used to identify correct server
+            Raises: queue.Empty if no item arrived within timeout
 
-        Returns:
-        Manager to process jobs
-    """
+            Arguments:
+            max_items -- maximum number of items to return
+            timeout -- seconds to wait for the first item. None waits forever.
+        """
+        items = [self.get(timeout=timeout)]
+        while len(items) < max_items:
+            try:
+                items.append(self.get_nowait())
+            except Empty:
+                break
+        return items
 
-    job_queue = Queue()
-    result_queue = Queue()
+    def put_batch(self, items):
+        """ Puts all items on the queue in order
 
-    class JobQueueManager(multiprocessing.managers.SyncManager):
-        pass
+            Arguments:
+            items -- the items to put on the queue
+        """
+        for item in items:
+            self.put(item)
 
-    JobQueueManager.register(JOB_QUEUE_NAME, callable=lambda: job_queue)
-    JobQueueManager.register(RES_QUEUE_NAME, callable=lambda: result_queue)
 
-    manager = JobQueueManager(address=('', port), authkey=authorization_key)
+def node_slots(nodes, jobs_per_node):
+    """ Returns nodes as (hostname, slots) tuples
 
-    return manager
+        Arguments:
+        nodes -- list of hostnames or (hostname, slots) tuples. slots may be None.
+        jobs_per_node -- number of slots for nodes without a slot count
+    """
+    result = []
+    for node in nodes:
+        slots = None
+        if not isinstance(node, str):
+            node, slots = node
+        result.append((node, slots or jobs_per_node))
+    return result
 
 
-def start_slaves(server, port, authorization_key, nodes, jobs_per_node, work_dir, remote_shell, global_paths):
+def start_slaves(server, port, authorization_key, nodes, jobs_per_node, work_dir, remote_shell, global_paths, max_batch_size=1, node_resources=(None, None), slaves=None, launch_concurrency=SLAVE_LAUNCH_CONCURRENCY, log_dir=None, heartbeat_interval=LEASE_TIMEOUT / HEARTBEATS_PER_LEASE, scratch_pool=None):
     """ Start slave prcesses on remote computers.
 
+        Slaves are launched in the background on at most launch_concurrency
+        nodes at a time and the function returns immediately. Launches that
+        fail or time out are reported to the SlavePool.
+
         Arguments:
         server -- the master server that the slaves connect to
         port -- the port used for communation
         authorization_key -- program secret used to identify correct server
-        nodes -- list of nodes to use during processing
-        jobs_per_node -- number of jobs to start per node
+        nodes -- list of nodes to use during processing. Either hostnames or
+                 (hostname, slots) tuples.
+        jobs_per_node -- number of jobs to start per node when not given in nodes
         work_dir -- the work directory where the slaves should be launched from
         remote_shell -- the remote shell to use when connecting to nodes
         global_paths -- directories used to find calcit and its data folders.
                         NB! This is different from work_dir and scratch directories
                             in that global_paths have nothing to do with computations
+        max_batch_size -- maximum number of jobs a slave fetches at once
+        node_resources -- tuple of cores and memory (in MB) available on each node
+        slaves -- the SlavePool to report launches to. Created if None.
+        launch_concurrency -- maximum number of concurrent launches
+        log_dir -- directory on the nodes where the output of jobs is written
+        heartbeat_interval -- seconds between heartbeats sent by each slave
+        scratch_pool -- tuple of the node local scratch directory, the space
+                        to keep free, a tmpfs directory and the tmpfs job limit.
+                        None disables the scratch pool.
+
+        Returns:
+        the SlavePool keeping track of the slaves
     """
+    nodes = node_slots(nodes, jobs_per_node)
+    if slaves is None:
+        slaves = SlavePool(nodes)
 
     share_path = global_paths['share']
     # write scripts to start slave nodes
-    write_slave_python_script(server, port, authorization_key, jobs_per_node, share_path)
+    write_slave_python_script(server, port, authorization_key, jobs_per_node, share_path, max_batch_size, node_resources, log_dir, heartbeat_interval, scratch_pool)
     slave_execute_script = write_slave_execute_script(work_dir, remote_shell, share_path)
 
-    procs = []
-    for node in nodes:
-        command_to_execute = "./{0} {1}".format(slave_execute_script, node)
+    def launch(node, slots):
+        command_to_execute = "./{0} {1} {2:d}".format(slave_execute_script, node, slots)
         logging.info("executing command '{0:s}' on node {1:s}".format(command_to_execute, node))
-        process = multiprocessing.Process(target=execute, args=(command_to_execute,))
-        procs.append(process)
-        process.start()
-
-
-def execute(command, is_slave=False):
-    """ Executes command given an argument through a shell
-
-        If is_slave is True there will be a delay added through
-        the global constant CLIENT_RETURN_DELAY
+        try:
+            process = subprocess.run(command_to_execute, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, timeout=SLAVE_LAUNCH_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            slaves.launch_failed(node, "remote shell did not return within {0:d}s".format(SLAVE_LAUNCH_TIMEOUT))
+            return
+        if process.returncode != 0:
+            slaves.launch_failed(node, "exit code {0:d}: {1:s}".format(process.returncode, process.stderr.decode('utf8', 'replace').strip()))
 
-        This command will also calculate the time it took for
-        execution (sans CLIENT_RETURN_DELAY) and return it
-
-        Arguments:
-        command -- command line arguments to run a job
-        is_slave -- if True then the execute process will be delayed before returning
-    """
-    t0 = numpy.asarray(time.time(),dtype=numpy.float64)
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-    output, error = process.communicate()
-    t1 = numpy.asarray(time.time(),dtype=numpy.float64)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, launch_concurrency))
+    for node, slots in nodes:
+        executor.submit(launch, node, slots)
+    executor.shutdown(wait=False)
 
-    return output, error, t1 - t0
+    return slaves
 
 
 def write_slave_execute_script(work_dir, remote_shell, share_path):
@@ -248,7 +834,7 @@ def write_slave_execute_script(work_dir, remote_shell, share_path):
     return filename_out
 
 
-def write_slave_python_script(server, port, authorization_key, jobs_per_node, share_path):
+def write_slave_python_script(server, port, authorization_key, jobs_per_node, share_path, max_batch_size=1, node_resources=(None, None), log_dir=None, heartbeat_interval=LEASE_TIMEOUT / HEARTBEATS_PER_LEASE, scratch_pool=None):
     """ Writes the slave script that connects to the server.
 
         Uses slave.py from the share directory.
@@ -259,6 +845,13 @@ def write_slave_python_script(server, port, authorization_key, jobs_per_node, sh
         authorization_key -- program secret used to identify correct server
         jobs_per_node -- the number of jobs each node can run
         share_path -- the directory of common template files
+        max_batch_size -- maximum number of jobs a slave fetches at once
+        node_resources -- tuple of cores and memory (in MB) available on each node
+        log_dir -- directory on the nodes where the output of jobs is written
+        heartbeat_interval -- seconds between heartbeats sent by each slave
+        scratch_pool -- tuple of the node local scratch directory, the space
+                        to keep free, a tmpfs directory and the tmpfs job limit.
+                        None disables the scratch pool.
 
         Returns:
         filename of slave python script
@@ -270,7 +863,13 @@ def write_slave_python_script(server, port, authorization_key, jobs_per_node, sh
     substitutions = {'PORT': str(port),
                      'HOSTNAME': server,
                      'AUTHKEY': authorization_key,
-                     'JOBS_PER_NODE': str(jobs_per_node)}
+                     'JOBS_PER_NODE': str(jobs_per_node),
+                     'MAX_BATCH_SIZE': str(max_batch_size),
+                     'CORES_PER_NODE': repr(node_resources[0]),
+                     'MEMORY_PER_NODE': repr(node_resources[1]),
+                     'LOG_DIR': repr(log_dir),
+                     'HEARTBEAT_INTERVAL': repr(float(heartbeat_interval)),
+                     'SCRATCH_POOL': repr(scratch_pool)}
     substitute_file(filename_in, filename_out, substitutions)
 
     return filename_out
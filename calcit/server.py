@@ -0,0 +1,336 @@
+""" Asyncio based dispatch server that hands out jobs to slaves
+    and collects their results.
+
+    Wire protocol
+    -------------
+    Every frame is a 4 byte big-endian length followed by the payload.
+
+    After connecting, the server and the slave authenticate each other
+    with HMAC-SHA256 challenges using the authorization key. The frames
+    of the handshake are raw bytes:
+
+      server -> slave   challenge
+      slave  -> server  HMAC(key, challenge)
+      slave  -> server  challenge
+      server -> slave   HMAC(key, challenge)
+
+    Once authenticated all payloads are pickled tuples:
+
+      slave  -> server  ('hello', slave_id)      identifies the slave
+      slave  -> server  ('get', n)               up to n jobs, answered when one is available
+      server -> slave   ('jobs', [job, ...])
+      slave  -> server  ('put', queue, [item, ...])  queue is JOB_QUEUE or RESULT_QUEUE
+      slave  -> server  ('done', [job name, ...])    releases the leases of finished jobs
+      slave  -> server  ('heartbeat',)           renews the leases of the slave
+
+    Leases
+    ------
+    Every job handed to a slave is leased to its connection until the
+    slave reports it done. Any frame from the slave renews its leases.
+    If the slave disconnects before it was sent END_OF_WORK (None) or
+    is silent for longer than the lease timeout, even while it holds no
+    jobs, its leased jobs are requeued and a
+    (MSG_SLAVE_LOST, slave_id, [job name, ...]) message is put on the
+    result queue. Jobs sent to a slave are reported on the result queue
+    as (MSG_JOBS_DISPATCHED, slave_id, [job name, ...], time sent).
+
+    Requeued jobs, and jobs a slave puts back, are kept in an unbounded
+    queue that is served before the job queue so putting them back
+    never waits for the master to stop filling the job queue.
+"""
+import asyncio
+import collections
+import hashlib
+import hmac
+import logging
+import os
+import pickle
+import struct
+import threading
+import time
+
+HEADER = struct.Struct("!I")
+CHALLENGE_SIZE = 32
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+JOB_QUEUE = 'jobs'
+RESULT_QUEUE = 'results'
+
+# reported on the result queue when a slave is lost with leased jobs
+MSG_SLAVE_LOST = 'lost'
+# reported on the result queue when jobs are sent to a slave
+MSG_JOBS_DISPATCHED = 'dispatched'
+
+# seconds without hearing from a slave before its jobs are requeued
+LEASE_TIMEOUT = 120
+LEASE_CHECK_INTERVAL = 1.0
+
+
+def encode_frame(payload):
+    """ Returns payload (bytes) prefixed with its length """
+    return HEADER.pack(len(payload)) + payload
+
+
+def encode_message(message):
+    """ Returns a pickled message as a frame """
+    return encode_frame(pickle.dumps(message, pickle.HIGHEST_PROTOCOL))
+
+
+def digest(authorization_key, challenge):
+    return hmac.new(authorization_key, challenge, hashlib.sha256).digest()
+
+
+async def read_frame(reader):
+    """ Reads the payload of a frame
+
+        Raises: asyncio.IncompleteReadError if the connection was closed
+    """
+    size, = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if size > MAX_FRAME_SIZE:
+        raise ValueError("Frame of {0:d} bytes is too large.".format(size))
+    return await reader.readexactly(size)
+
+
+class SlaveConnection(object):
+    """ A connected slave and the jobs leased to it """
+    def __init__(self, peer, writer):
+        self.peer = peer
+        self.writer = writer
+        self.slave_id = str(peer)
+        self.last_seen = time.time()
+        self.leases = {}
+        self.get_task = None
+        # whether the slave said hello, was sent END_OF_WORK and was reported lost
+        self.identified = False
+        self.finished = False
+        self.lost = False
+
+    def expected(self):
+        """ Returns whether the master still expects the slave to talk to it """
+        return bool(self.leases) or (self.identified and not self.finished)
+
+
+class DispatchServer(object):
+    """ Serves jobs to slaves from an asyncio event loop running in
+        a background thread.
+
+        The master puts jobs with put (which blocks while the job queue
+        is full) and reads results from the results queue which is an
+        ordinary thread safe queue with get_batch.
+
+        Jobs are tuples with the job name as the first element. Jobs
+        handed out to slaves are leased until they are done. Jobs that
+        come back from slaves are sent again before the jobs of the
+        job queue.
+
+        Arguments:
+        port -- the port to listen on
+        authorization_key -- program secret (bytes) shared with the slaves
+        queue_size -- maximum number of jobs in the job queue. 0 means unbounded.
+        result_queue -- thread safe queue with put_batch to put results in
+        lease_timeout -- seconds a slave can be silent before its jobs are requeued
+    """
+    def __init__(self, port, authorization_key, queue_size, result_queue, lease_timeout=LEASE_TIMEOUT):
+        self.port = port
+        self.authorization_key = authorization_key
+        self.queue_size = queue_size
+        self.results = result_queue
+        self.lease_timeout = lease_timeout
+        self.connections = set()
+        self._loop = None
+        self._jobs = None
+        self._requeued = collections.deque()
+        self._requeue_ready = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+        self._stopping = False
+        self._error = None
+
+    def start(self):
+        """ Starts listening in a background thread """
+        self._thread = threading.Thread(target=self._run, name="calcit-dispatch-server")
+        self._thread.daemon = True
+        self._thread.start()
+        self._started.wait()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._jobs = asyncio.Queue(maxsize=self.queue_size)
+            self._requeue_ready = asyncio.Event()
+            self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, host=None, port=self.port))
+        except Exception as e:
+            self._error = e
+            self._started.set()
+            return
+        self._loop.create_task(self._expire_leases())
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._stopping = True
+            self._server.close()
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+    def shutdown(self):
+        """ Stops the server and closes all connections """
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join()
+
+    def put(self, item):
+        """ Puts a job on the job queue. Blocks while the queue is full. """
+        asyncio.run_coroutine_threadsafe(self._jobs.put(item), self._loop).result()
+
+    def put_batch(self, items):
+        """ Puts jobs on the job queue in order """
+        for item in items:
+            self.put(item)
+
+    def qsize(self):
+        """ Returns the number of jobs waiting in the job queue """
+        return self._jobs.qsize() + len(self._requeued)
+
+    def _requeue_items(self, items):
+        """ Puts jobs back to be sent before the jobs of the job queue. Never blocks. """
+        self._requeued.extend(items)
+        if self._requeued:
+            self._requeue_ready.set()
+
+    async def _next_item(self):
+        """ Waits for the next job, taking requeued jobs first """
+        while not self._requeued:
+            if not self._jobs.empty():
+                return self._jobs.get_nowait()
+            self._requeue_ready.clear()
+            get = asyncio.ensure_future(self._jobs.get())
+            requeued = asyncio.ensure_future(self._requeue_ready.wait())
+            try:
+                await asyncio.wait([get, requeued], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                requeued.cancel()
+                if not get.done():
+                    get.cancel()
+            if get.done() and not get.cancelled():
+                return get.result()
+        return self._requeued.popleft()
+
+    def _take_item_nowait(self):
+        """ Returns the next job without waiting or raises asyncio.QueueEmpty """
+        if self._requeued:
+            return self._requeued.popleft()
+        return self._jobs.get_nowait()
+
+    async def _authenticate(self, reader, writer):
+        challenge = os.urandom(CHALLENGE_SIZE)
+        writer.write(encode_frame(challenge))
+        response = await read_frame(reader)
+        if not hmac.compare_digest(response, digest(self.authorization_key, challenge)):
+            return False
+        writer.write(encode_frame(digest(self.authorization_key, await read_frame(reader))))
+        await writer.drain()
+        return True
+
+    async def _send_jobs(self, connection, max_items):
+        """ Waits for at least one job and sends up to max_items jobs
+
+            The jobs are leased to the connection before they are sent.
+        """
+        items = [await self._next_item()]
+        while len(items) < max_items:
+            try:
+                items.append(self._take_item_nowait())
+            except asyncio.QueueEmpty:
+                break
+        names = []
+        for item in items:
+            if item is not None:
+                connection.leases[item[0]] = item
+                names.append(item[0])
+            else:
+                connection.finished = True
+        connection.writer.write(encode_message(('jobs', items)))
+        if names:
+            self.results.put_batch([(MSG_JOBS_DISPATCHED, connection.slave_id, names, time.time())])
+        await connection.writer.drain()
+
+    def _requeue(self, connection, reason):
+        """ Reports a slave as lost and requeues the jobs leased to it
+
+            Slaves that leave after they were sent END_OF_WORK without
+            holding jobs finished normally and are not reported.
+        """
+        if self._stopping or connection.lost or not connection.expected():
+            return
+        connection.lost = True
+        items = list(connection.leases.values())
+        connection.leases.clear()
+        if items:
+            logging.warning("Slave '{0:s}' lost ({1:s}). Requeueing {2:d} jobs.".format(connection.slave_id, reason, len(items)))
+        else:
+            logging.warning("Slave '{0:s}' lost ({1:s}) while it held no jobs.".format(connection.slave_id, reason))
+        self.results.put_batch([(MSG_SLAVE_LOST, connection.slave_id, [item[0] for item in items])])
+        self._requeue_items(items)
+
+    async def _expire_leases(self):
+        """ Reports slaves that have been silent for too long and requeues their jobs """
+        while True:
+            await asyncio.sleep(LEASE_CHECK_INTERVAL)
+            now = time.time()
+            for connection in list(self.connections):
+                if connection.expected() and now - connection.last_seen > self.lease_timeout:
+                    self._requeue(connection, "no heartbeat for {0:.0f}s".format(now - connection.last_seen))
+                    connection.writer.close()
+
+    async def _handle(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        connection = SlaveConnection(peer, writer)
+        try:
+            if not await self._authenticate(reader, writer):
+                logging.warning("Rejected slave connection from {0} with wrong authorization key.".format(peer))
+                return
+            self.connections.add(connection)
+            while True:
+                message = pickle.loads(await read_frame(reader))
+                connection.last_seen = time.time()
+                kind = message[0]
+                if kind == 'get':
+                    connection.get_task = asyncio.ensure_future(self._send_jobs(connection, message[1]))
+                elif kind == 'heartbeat':
+                    pass
+                elif kind == 'hello':
+                    connection.slave_id = message[1]
+                    connection.identified = True
+                elif kind == 'done':
+                    for name in message[1]:
+                        connection.leases.pop(name, None)
+                elif kind == 'put' and message[1] == JOB_QUEUE:
+                    for item in message[2]:
+                        if item is not None:
+                            connection.leases.pop(item[0], None)
+                    self._requeue_items(message[2])
+                elif kind == 'put' and message[1] == RESULT_QUEUE:
+                    self.results.put_batch(message[2])
+                else:
+                    raise ValueError("Unknown message '{0}'".format(kind))
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # slave disconnected or the server is shutting down
+            pass
+        except Exception as e:
+            logging.error("Closing slave connection from {0}: {1}".format(peer, e))
+        finally:
+            self.connections.discard(connection)
+            if connection.get_task is not None:
+                connection.get_task.cancel()
+            writer.close()
+            self._requeue(connection, "disconnected")
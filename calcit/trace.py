@@ -0,0 +1,178 @@
+""" Timelines of the phases of every job in a run
+
+    Every job is timestamped as it goes through the master and a slave:
+
+    render   -- the master writes the input file and run script (Job.cmd)
+    queue    -- the job waits in the job queue until it is sent to a slave
+    pickup   -- the job travels to the slave
+    wait     -- the job waits in the batch of the slave for the jobs before
+                it and for its cores, memory and scratch
+    run      -- the program runs
+    transfer -- the result travels back to the master
+
+    A TraceRecorder collects the timestamps and writes them in the trace
+    event format of Chrome which is read by https://ui.perfetto.dev and
+    chrome://tracing. Every node is a process with a track (thread) per
+    slave, and the master is a process with a track per preparation
+    worker and the queue waits of the jobs. Timestamps of the slaves are
+    taken on their nodes, so the pickup and transfer phases are only
+    accurate when the clocks of the nodes are synchronised (i.e. NTP).
+"""
+import collections
+import json
+import threading
+import time
+
+# process id of the master in the trace. Nodes are numbered from 1.
+MASTER_PID = 0
+MASTER_NAME = "master"
+QUEUE_TRACK = "queue"
+
+
+class TraceRecorder(object):
+    """ Collects the timestamps of the phases of jobs
+
+        All methods are safe to call from the threads of the master.
+        Times are seconds since the epoch as returned by time.time().
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        # job name -> [queued, dispatched, slave_id]
+        self.pending = {}
+        # (process, track, job name, phase, start, end)
+        self.spans = []
+        # (job name, queued, dispatched)
+        self.waits = []
+
+    def rendered(self, job_name, start, end, worker):
+        """ Records the input file and run script of a job being written
+
+            Arguments:
+            ----------
+            job_name -- the name of the job
+            start -- time the job started rendering
+            end -- time the job was rendered
+            worker -- name of the thread or process that rendered it
+        """
+        with self.lock:
+            self.spans.append((MASTER_NAME, "prepare {0:s}".format(worker), job_name, "render", start, end))
+
+    def queued(self, job_name, queued=None):
+        """ Records a job put on the job queue """
+        if queued is None:
+            queued = time.time()
+        with self.lock:
+            self.pending[job_name] = [queued, None, None]
+
+    def dispatched(self, job_names, slave_id, dispatched):
+        """ Records jobs sent to a slave
+
+            Jobs of a lost slave are sent again, and then the last
+            dispatch is kept.
+
+            Arguments:
+            ----------
+            job_names -- the names of the jobs
+            slave_id -- the slave the jobs are sent to, i.e. 'node01:1234'
+            dispatched -- time the jobs were sent
+        """
+        with self.lock:
+            for job_name in job_names:
+                pending = self.pending.get(job_name)
+                if pending is None:
+                    continue
+                if pending[1] is None:
+                    self.waits.append((job_name, pending[0], dispatched))
+                pending[1] = dispatched
+                pending[2] = slave_id
+
+    def finished(self, job_name, slave_id, timings, received):
+        """ Records the phases of a job that returned a result
+
+            Arguments:
+            ----------
+            job_name -- the name of the job
+            slave_id -- the slave that ran it
+            timings -- the times the slave received the job, started and
+                       ended it and sent the result
+            received -- time the master received the result
+        """
+        slave_received, started, ended, sent = timings
+        node = slave_id.split(':')[0]
+        with self.lock:
+            pending = self.pending.pop(job_name, None)
+            if pending is not None and pending[1] is not None and pending[2] == slave_id:
+                self.spans.append((node, slave_id, job_name, "pickup", pending[1], slave_received))
+            self.spans.append((node, slave_id, job_name, "wait", slave_received, started))
+            self.spans.append((node, slave_id, job_name, "run", started, ended))
+            self.spans.append((node, slave_id, job_name, "transfer", sent, received))
+
+    def phase_spans(self):
+        """ Returns the (start, end) times of the recorded phases keyed on the phase """
+        phases = collections.defaultdict(list)
+        with self.lock:
+            for process, track, job_name, phase, start, end in self.spans:
+                phases[phase].append((start, end))
+            for job_name, queued, dispatched in self.waits:
+                phases["queue"].append((queued, dispatched))
+        return dict(phases)
+
+    def events(self):
+        """ Yields the trace events of the recorded phases
+
+            Times are in microseconds since the first recorded time.
+        """
+        with self.lock:
+            spans = list(self.spans)
+            waits = list(self.waits)
+
+        origin = self.started
+        for span in spans:
+            origin = min(origin, span[4])
+        for wait in waits:
+            origin = min(origin, wait[1])
+
+        def microseconds(t):
+            return round((t - origin) * 1.0e6, 1)
+
+        processes = collections.OrderedDict([(MASTER_NAME, MASTER_PID)])
+        tracks = collections.OrderedDict([((MASTER_NAME, QUEUE_TRACK), 1)])
+        for process, track, job_name, phase, start, end in sorted(spans, key=lambda span: span[4]):
+            if process not in processes:
+                processes[process] = len(processes)
+            if (process, track) not in tracks:
+                tracks[(process, track)] = len(tracks) + 1
+
+        for process, pid in processes.items():
+            yield {"ph": "M", "name": "process_name", "pid": pid, "tid": 0, "args": {"name": process}}
+            yield {"ph": "M", "name": "process_sort_index", "pid": pid, "tid": 0, "args": {"sort_index": pid}}
+        for (process, track), tid in tracks.items():
+            yield {"ph": "M", "name": "thread_name", "pid": processes[process], "tid": tid, "args": {"name": track}}
+
+        for process, track, job_name, phase, start, end in spans:
+            yield {"ph": "X", "name": phase, "cat": phase, "pid": processes[process], "tid": tracks[(process, track)],
+                   "ts": microseconds(start), "dur": round(max(end - start, 0.0) * 1.0e6, 1), "args": {"job": job_name}}
+
+        # queue waits overlap, so they are async events on the queue track
+        tid = tracks[(MASTER_NAME, QUEUE_TRACK)]
+        for index, (job_name, queued, dispatched) in enumerate(waits):
+            event = {"name": "queue", "cat": "queue", "id": index, "pid": MASTER_PID, "tid": tid, "args": {"job": job_name}}
+            yield dict(event, ph="b", ts=microseconds(queued))
+            yield dict(event, ph="e", ts=microseconds(max(dispatched, queued)))
+
+    def write(self, filename):
+        """ Writes the trace to a JSON file
+
+            Arguments:
+            ----------
+            filename -- the file to write
+        """
+        with open(filename, "w") as f:
+            f.write('{"displayTimeUnit": "ms", "traceEvents": [\n')
+            separator = ""
+            for event in self.events():
+                f.write(separator)
+                f.write(json.dumps(event, separators=(",", ":")))
+                separator = ",\n"
+            f.write("\n]}\n")
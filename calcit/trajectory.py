@@ -0,0 +1,188 @@
+""" Reads frames from (possibly very large) multi-frame .xyz files
+
+    A trajectory is a concatenation of ordinary .xyz frames
+
+      <number of atoms>
+      <comment>
+      <label> <x> <y> <z>
+      ...
+
+    The file is memory-mapped and the byte offset of every frame is
+    found in a single pass when the trajectory is opened. Frames are
+    parsed on request so only the frames that are used are ever read.
+"""
+import mmap
+import os
+import threading
+
+import numpy
+
+from .molecule import parse_atoms
+
+NEWLINE = ord("\n")
+
+# initial number of bytes searched for the end of a frame. Later frames
+# use the size of the previous frame. The line with the number of atoms
+# is searched in a small window.
+INITIAL_WINDOW = 64 * 1024
+COUNT_LINE_WINDOW = 256
+
+# memory maps of trajectories opened by this process keyed on filename
+_mapped_files = {}
+_mapped_files_lock = threading.Lock()
+
+
+def mapped_file(filename):
+    """ Returns the contents of a file as a memory-mapped array of bytes
+
+        The file is mapped once per process.
+
+        Arguments:
+        ----------
+        filename -- absolute path of the file
+    """
+    with _mapped_files_lock:
+        data = _mapped_files.get(filename)
+        if data is None:
+            with open(filename, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    data = numpy.zeros(0, dtype=numpy.uint8)
+                else:
+                    data = numpy.frombuffer(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), dtype=numpy.uint8)
+            _mapped_files[filename] = data
+        return data
+
+
+def line_end(data, start, count, window=INITIAL_WINDOW):
+    """ Returns the offset just after the count'th line from start
+
+        The last line of the data does not need to end with a newline.
+
+        Raises: ValueError if there are fewer than count lines left
+
+        Arguments:
+        ----------
+        data -- array of bytes
+        start -- offset of the first line
+        count -- the number of lines to skip
+        window -- the number of bytes to search first
+    """
+    size = len(data)
+    while True:
+        end = min(start + window, size)
+        newlines = numpy.flatnonzero(data[start:end] == NEWLINE)
+        if len(newlines) >= count:
+            return start + int(newlines[count - 1]) + 1
+        if end == size:
+            unterminated = size > start and data[size - 1] != NEWLINE
+            if unterminated and len(newlines) == count - 1:
+                return size
+            raise ValueError("Unexpected end of file after {0:d} of {1:d} lines.".format(len(newlines) + unterminated, count))
+        window *= 2
+
+
+class TrajectoryFrame(object):
+    """ Geometry of a single frame of a trajectory
+
+        Calling it returns the calcit.molecule.Molecule of the frame so
+        it can be given to a job as its geometry. A frame only knows where it is in
+        the file so it is cheap to keep and to pickle.
+
+        Arguments:
+        ----------
+        filename -- absolute path of the trajectory
+        offset -- byte offset of the frame
+        n_atoms -- the number of atoms in the frame
+    """
+    def __init__(self, filename, offset, n_atoms):
+        self.filename = filename
+        self.offset = offset
+        self.n_atoms = n_atoms
+
+    def __call__(self):
+        """ Returns the Molecule of the frame """
+        data = mapped_file(self.filename)
+        start = line_end(data, self.offset, 2, COUNT_LINE_WINDOW)
+        end = line_end(data, start, self.n_atoms) if self.n_atoms else start
+        return parse_atoms(data[start:end].tobytes(), self.n_atoms)
+
+
+class XYZTrajectory(object):
+    """ Index of the frames in a memory-mapped multi-frame .xyz file
+
+        Raises: ValueError if the file is not a valid trajectory
+
+        Arguments:
+        ----------
+        filename -- the trajectory file
+    """
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+        self.offsets, self.n_atoms = self._index(mapped_file(self.filename))
+
+    def __len__(self):
+        return len(self.n_atoms)
+
+    def __getitem__(self, index):
+        return TrajectoryFrame(self.filename, int(self.offsets[index]), int(self.n_atoms[index]))
+
+    def _index(self, data):
+        """ Returns the offsets and atom counts of all frames """
+        offsets = []
+        n_atoms = []
+        size = len(data)
+        position = 0
+        window = INITIAL_WINDOW
+        while position < size:
+            end_of_count = line_end(data, position, 1, COUNT_LINE_WINDOW)
+            count = data[position:end_of_count].tobytes().strip()
+            if not count:
+                # blank lines after the last frame
+                position = end_of_count
+                continue
+            try:
+                count = int(count)
+                end = line_end(data, end_of_count, count + 1, window)
+            except ValueError:
+                raise ValueError("Frame {0:d} at byte {1:d} of '{2:s}' is not valid.".format(len(offsets), position, self.filename))
+            offsets.append(position)
+            n_atoms.append(count)
+            window = end - position + COUNT_LINE_WINDOW
+            position = end
+        return numpy.array(offsets, dtype=numpy.int64), numpy.array(n_atoms, dtype=numpy.int64)
+
+    def read_frame(self, index):
+        """ Parses a frame
+
+            Arguments:
+            ----------
+            index -- the index of the frame starting from zero
+
+            Returns:
+            --------
+            the calcit.molecule.Molecule of the frame
+        """
+        return self[index]()
+
+
+def frames(filename, stride=1, start=0, stop=None):
+    """ Yields the frames of a trajectory to create jobs from
+
+        Arguments:
+        ----------
+        filename -- the trajectory file
+        stride -- use every stride'th frame
+        start -- the first frame to use
+        stop -- the frame to stop before. None uses all frames.
+
+        Returns:
+        --------
+        generator of frame basenames, i.e. 'data/md_000042' for frame 42
+        of data/md.xyz, and the TrajectoryFrame of the frame
+    """
+    trajectory = XYZTrajectory(filename)
+    # jobs are created next to the trajectory like jobs of .xyz files
+    base = os.path.splitext(filename)[0]
+    width = max(6, len(str(len(trajectory))))
+    for index in range(len(trajectory))[start:stop:stride]:
+        yield "{0:s}_{1:0{2}d}".format(base, index, width), trajectory[index]
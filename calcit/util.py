@@ -1,16 +1,64 @@
 import os
 import random
 import string
+import threading
 
 class CalcItJobCreateError(IOError):
     """ Exception cast if there is an error to create a job"""
     pass
 
 
+class CalcItSlaveError(RuntimeError):
+    """ Exception cast if slaves could not be started"""
+    pass
+
+
+# compiled templates keyed on the absolute template filename.
+# each entry is a (modification time, string.Template) tuple.
+_template_cache = {}
+_template_cache_lock = threading.Lock()
+
+
+def load_template(filename):
+    """ Returns a compiled string.Template for filename
+
+        Templates are loaded once and kept in a cache. A template is
+        reloaded if the modification time of the file changes.
+
+        Raises: IOError if the template file is not found
+
+        Arguments:
+        ----------
+        filename -- template file to load
+    """
+    filename = os.path.abspath(filename)
+    mtime = os.stat(filename).st_mtime_ns
+    with _template_cache_lock:
+        cached = _template_cache.get(filename)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+    with open(filename, "r") as f_in:
+        template = string.Template(f_in.read())
+
+    with _template_cache_lock:
+        _template_cache[filename] = (mtime, template)
+    return template
+
+
+def clear_template_cache():
+    """ Removes all compiled templates from the cache """
+    with _template_cache_lock:
+        _template_cache.clear()
+
+
 def substitute_file(from_file, to_file, substitutions):
     """ Substitute contents in from_file with substitutions and
         output to to_file using string.Template class
 
+        The template is compiled once through load_template and
+        reused for subsequent calls.
+
         Raises: IOError file the file to replace from is not found
 
         Arguments:
@@ -19,23 +67,21 @@ def substitute_file(from_file, to_file, substitutions):
         to_file -- substituted file
         substitutions -- dictionary of substitutions.
     """
-    with open(from_file, "r") as f_in:
-        source = string.Template(f_in.read())
-
-        with open(to_file, "w") as f_out:
-            outcome = source.safe_substitute(substitutions)
-            f_out.write(outcome)
+    source = load_template(from_file)
+    with open(to_file, "w") as f_out:
+        f_out.write(source.safe_substitute(substitutions))
 
 
 def create_scratch_directory(basename):
     """ Creates scratch directory named basename
 
+        Safe to call concurrently for the same directory.
+
         Arguments:
         ----------
         basename -- name of folder to create
     """
-    if not os.path.isdir(basename):
-        os.mkdir(basename)
+    os.makedirs(basename, exist_ok=True)
 
 
 def only_coordinates(f):
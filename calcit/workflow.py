@@ -0,0 +1,221 @@
+""" Runs jobs that depend on files written by other jobs
+
+    A JobGraph holds jobs and the jobs they depend on (their
+    dependencies). The master takes jobs from the graph as their
+    dependencies finish so every stage of a multi-stage workflow,
+    i.e. fragment densities before the embedding integrals that use
+    them, runs in a single CalcIt invocation without a barrier between
+    the stages. Of the jobs that can run, those on the longest
+    remaining path through the graph (the critical path) go first.
+"""
+import collections
+import heapq
+import itertools
+import logging
+import threading
+
+from .cost import estimate_cost
+from .jobs import RuntypeJob
+from .util import CalcItJobCreateError
+
+# states of the jobs in a graph
+WAITING = 'waiting'
+READY = 'ready'
+RELEASED = 'released'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class JobGraph(object):
+    """ Jobs released to the master in dependency order
+
+        Jobs are identified by their name (repr). Dependencies that are
+        not in jobs are added to the graph. A job is ready when all its
+        dependencies are done and ready jobs are taken in order of their
+        priority, the estimated cost of the job and of the most costly
+        chain of jobs depending on it. When a job fails, the jobs that
+        depend on it are cancelled.
+
+        Raises: CalcItJobCreateError if the dependencies form a cycle
+
+        Arguments:
+        ----------
+        jobs -- iterable of jobs
+        cost -- function returning the cost of a job
+    """
+    def __init__(self, jobs, cost=estimate_cost):
+        self.jobs = collections.OrderedDict()
+        stack = list(jobs)
+        stack.reverse()
+        while stack:
+            job = stack.pop()
+            name = repr(job)
+            if name in self.jobs:
+                continue
+            self.jobs[name] = job
+            stack.extend(reversed(job.dependencies))
+
+        self.dependents = collections.defaultdict(list)
+        self.waiting = {}
+        for name, job in self.jobs.items():
+            dependencies = set(repr(dependency) for dependency in job.dependencies)
+            self.waiting[name] = len(dependencies)
+            for dependency in dependencies:
+                self.dependents[dependency].append(name)
+
+        self.priority = self._priorities(cost)
+        self.state = {}
+        self.ready = []
+        self.sequence = itertools.count()
+        for name in self.jobs:
+            self.state[name] = WAITING
+            if self.waiting[name] == 0:
+                self._make_ready(name)
+        self.remaining = len(self.jobs)
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def _priorities(self, cost):
+        """ Returns the length of the most costly path from every job to the end of the graph """
+        order = []
+        waiting = dict(self.waiting)
+        queue = collections.deque(name for name, count in waiting.items() if count == 0)
+        while queue:
+            name = queue.popleft()
+            order.append(name)
+            for dependent in self.dependents[name]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    queue.append(dependent)
+        if len(order) != len(self.jobs):
+            cycle = sorted(name for name, count in waiting.items() if count > 0)
+            raise CalcItJobCreateError("The dependencies of {0} form a cycle.".format(cycle))
+
+        priority = {}
+        for name in reversed(order):
+            path = max((priority[dependent] for dependent in self.dependents[name]), default=0.0)
+            priority[name] = float(cost(self.jobs[name])) + path
+        return priority
+
+    def _make_ready(self, name):
+        self.state[name] = READY
+        heapq.heappush(self.ready, (-self.priority[name], next(self.sequence), name))
+
+    def take(self, max_jobs):
+        """ Returns up to max_jobs ready jobs in order of priority
+
+            Blocks while no job is ready but jobs are still waiting for
+            their dependencies to finish.
+
+            Arguments:
+            ----------
+            max_jobs -- the largest number of jobs to return
+
+            Returns:
+            --------
+            list of jobs. Empty when every job has been taken, is done
+            or was cancelled.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.ready or self.remaining == 0)
+            jobs = []
+            while self.ready and len(jobs) < max_jobs:
+                name = heapq.heappop(self.ready)[2]
+                if self.state[name] != READY:
+                    continue
+                self.state[name] = RELEASED
+                self.remaining -= 1
+                jobs.append(self.jobs[name])
+            return jobs
+
+    def finished(self, name, success=True):
+        """ Marks a job as finished and releases the jobs depending on it
+
+            Arguments:
+            ----------
+            name -- the name of the job
+            success -- whether the job succeeded. If not, the jobs that
+                       depend on it are cancelled.
+
+            Returns:
+            --------
+            list of the names of the cancelled jobs
+        """
+        cancelled = []
+        with self.condition:
+            state = self.state.get(name)
+            if state is None or state in (DONE, FAILED, CANCELLED):
+                return cancelled
+            if state in (WAITING, READY):
+                self.remaining -= 1
+            self.state[name] = DONE if success else FAILED
+            if success:
+                for dependent in self.dependents[name]:
+                    self.waiting[dependent] -= 1
+                    if self.waiting[dependent] == 0 and self.state[dependent] == WAITING:
+                        self._make_ready(dependent)
+            else:
+                stack = list(self.dependents[name])
+                while stack:
+                    dependent = stack.pop()
+                    if self.state[dependent] not in (WAITING, READY):
+                        continue
+                    self.state[dependent] = CANCELLED
+                    self.remaining -= 1
+                    cancelled.append(dependent)
+                    stack.extend(self.dependents[dependent])
+            self.condition.notify_all()
+        for dependent in cancelled:
+            logging.warning("Cancelled '{0:s}' because '{1:s}' failed.".format(dependent, name))
+        return cancelled
+
+    def complete(self, names):
+        """ Marks jobs that finished in an earlier run as done
+
+            Arguments:
+            ----------
+            names -- names of the finished jobs
+
+            Returns:
+            --------
+            the number of jobs in the graph that were marked as done
+        """
+        count = 0
+        for name in names:
+            if self.state.get(name) in (WAITING, READY):
+                self.finished(name)
+                count += 1
+        return count
+
+
+def pde_workflow(core, environment, program='dalton', geometry=None, **kwargs):
+    """ Returns the jobs of excitation energies with polarizable density embedding
+
+        The density of the environment is saved first. The embedding
+        integrals of the density are then computed in the basis of the
+        core molecule and finally the excitation energies of the core
+        are calculated in the embedding.
+
+        Arguments:
+        ----------
+        core -- base name of the molecule whose excitations are calculated
+        environment -- base name of the molecule embedding the core
+        program -- the quantum chemistry program to run
+        geometry -- function returning the Molecule of the core. None
+                    reads it from <core>.xyz.
+        kwargs -- keyword based arguments given to the jobs
+
+        Returns:
+        --------
+        list of the monomer, dimer and excitation jobs
+    """
+    excitation_kwargs = dict(kwargs)
+    kwargs.pop('mprank', None)
+    kwargs.pop('excitations', None)
+    monomer = RuntypeJob(environment, program, 'pde_monomer', **kwargs)
+    dimer = RuntypeJob(core, program, 'pde_dimer', fragment=monomer, geometry=geometry, **kwargs)
+    excitations = RuntypeJob(core, program, 'pdeex', embedding=dimer, geometry=geometry, **excitation_kwargs)
+    return [monomer, dimer, excitations]
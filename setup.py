@@ -37,6 +37,7 @@ def setup_calcit():
                                  'share/dalton_pdeex.inp',
                                  'share/orca.bash', 'share/orca_energy.inp',
                                  'share/gamess.bash', 'share/gamess_energy.inp',
+                                 'share/benchmark.bash', 'share/fake_program.py',
                                  'share/slave.py', 'share/start_slaves.bash'
                                 ])
                    ]
@@ -0,0 +1,14 @@
+#!/usr/bin/env bash
+# runs the stand-in program of 'calcit benchmark' instead of
+# a quantum chemistry program
+#
+# options to be substituted
+#  WORK_DIR     : $WORK_DIR
+#  PATH         : $PROGPATH
+#  FAKE_PROGRAM : $FAKE_PROGRAM
+#  DURATION     : $DURATION
+#  MODE         : $MODE
+#  JOB          : $JOB
+#
+
+$PROGPATH $FAKE_PROGRAM --duration $DURATION --mode $MODE $JOB.inp > $WORK_DIR/$JOB.out
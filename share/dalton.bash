@@ -7,17 +7,21 @@
 #  PATH    : $PROGPATH
 #  JOB     : $JOB
 #  MEMORY  : $MEMORY
+#  FILES   : $DALTON_FILES
+#
+# jobs use the scratch directory the slave gives them in CALCIT_SCRATCH
+# when the node has a scratch pool and SCRATCH otherwise
 #
 
 if [ ! -e $WORK_DIR/$JOB.out ]
 then
 
-    export DALTON_TMPDIR=$SCRATCH
+    export DALTON_TMPDIR=${CALCIT_SCRATCH:-$SCRATCH}
     export DALTON_NUM_MPI_PROCS=$NCPUS
     export OMP_NUM_THREADS=1
     
     # run the calculation
-    $PROGPATH/dalton -mb $MEMORY -noappend -ow $JOB.dal
+    $PROGPATH/dalton -mb $MEMORY -noappend -ow $DALTON_FILES $JOB.dal
 
 else
     echo "Skipping $JOB because output exists."
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+""" Stand-in for a quantum chemistry program used by 'calcit benchmark'
+
+    Sleeps or keeps a core busy for the given number of seconds and
+    writes an output in the format of ORCA to standard output so the
+    output can be parsed like that of a real calculation.
+"""
+import argparse
+import os
+import time
+
+
+def burn(seconds):
+    """ Keeps a core busy for seconds """
+    end = time.perf_counter() + seconds
+    value = 0
+    while time.perf_counter() < end:
+        for i in range(1000):
+            value += i * i
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in for a quantum chemistry program.")
+    parser.add_argument("input", type=str, help="the input file of the job")
+    parser.add_argument("--duration", type=float, default=0.0, help="seconds the job takes")
+    parser.add_argument("--mode", choices=["sleep", "burn"], default="sleep", help="sleep or keep a core busy")
+    args = parser.parse_args()
+
+    t0 = time.time()
+    if args.mode == "burn":
+        burn(args.duration)
+    elif args.duration > 0:
+        time.sleep(args.duration)
+    elapsed = time.time() - t0
+
+    size = os.path.getsize(args.input) if os.path.isfile(args.input) else 0
+    seconds = int(elapsed)
+    print("Stand-in program of calcit benchmark")
+    print("Input file {0:s} ({1:d} bytes)".format(args.input, size))
+    print("*** SCF CONVERGED AFTER   1 CYCLES ***")
+    print("FINAL SINGLE POINT ENERGY       {0:.10f}".format(-float(size) / 1000.0))
+    print("                             ****ORCA TERMINATED NORMALLY****")
+    print("TOTAL RUN TIME: 0 days 0 hours {0:d} minutes {1:d} seconds {2:d} msec".format(seconds // 60, seconds % 60, int((elapsed - seconds) * 1000)))
+
+
+if __name__ == '__main__':
+    main()
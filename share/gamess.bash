@@ -11,6 +11,9 @@
 #  SCRATCH : $SCRATCH
 #  # CPUS  : $NCPUS
 #
+# jobs use the scratch directory the slave gives them in CALCIT_SCRATCH
+# when the node has a scratch pool and SCRATCH otherwise
+#
 
 #
 # the GAMESS rungms script was modified to make it understand
@@ -19,10 +22,15 @@
 #
 if [ ! -e $JOB.out ]
 then
-    mkdir -p $SCRATCH
-    export TMPDIR=$SCRATCH
+    SCRATCH_DIR=${CALCIT_SCRATCH:-$SCRATCH}
+    mkdir -p $SCRATCH_DIR
+    export TMPDIR=$SCRATCH_DIR
     $PROGPATH/rungms $JOB.inp $VERSION $NCPUS > $JOB.out
-    rm -rf $SCRATCH
+    STATUS=$?
+    rm -rf $SCRATCH_DIR
+
+    # report the exit status of GAMESS and not that of the clean up
+    exit $STATUS
 else
     echo "Skipping $JOB because output exists."
 fi
@@ -7,19 +7,27 @@
 #  PATH    : $PROGPATH
 #  JOB     : $JOB
 #
+# jobs use the scratch directory the slave gives them in CALCIT_SCRATCH
+# when the node has a scratch pool and SCRATCH otherwise
+#
 
 if [ ! -e $WORK_DIR/$JOB.out ]
 then
 
-    mkdir -p $SCRATCH
-    cp $JOB.inp $SCRATCH
-    cd $SCRATCH
+    SCRATCH_DIR=${CALCIT_SCRATCH:-$SCRATCH}
+    mkdir -p $SCRATCH_DIR
+    cp $JOB.inp $SCRATCH_DIR
+    cd $SCRATCH_DIR
     
     # run the calculation
     $PROGPATH/orca $JOB.inp > $WORK_DIR/$JOB.out
+    STATUS=$?
     
     cd $WORK_DIR
-    rm -rf $SCRATCH
+    rm -rf $SCRATCH_DIR
+
+    # report the exit status of ORCA and not that of the clean up
+    exit $STATUS
 else
     echo "Skipping $JOB because output exists."
 fi
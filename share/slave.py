@@ -1,102 +1,581 @@
+import hashlib
+import hmac
+import os
+import pickle
+import re
+import shutil
+import socket
+import struct
 import subprocess
+import sys
 import multiprocessing as mp
-import multiprocessing.managers
-import queue
+import tempfile
+import threading
 import time
+import zlib
 
 import numpy
 
-SLAVE_RETURN_DELAY = 3
-JOB_QUEUE_NAME = 'get_job_queue'
-RES_QUEUE_NAME = 'get_result_queue'
+try:
+    from calcit.parsers import try_parse_output
+except ImportError:
+    # CalcIt is not in the python path of this node. The master parses the outputs.
+    try_parse_output = None
+
+# wire protocol. Must match calcit/server.py
+HEADER = struct.Struct("!I")
+CHALLENGE_SIZE = 32
+JOB_QUEUE = 'jobs'
+RESULT_QUEUE = 'results'
+
+# messages put on the result queue. Must match calcit/process.py
+MSG_RESULT = 'result'
+MSG_SLAVE_READY = 'ready'
+MSG_SLAVE_DONE = 'done'
+
+# received from the job queue when the master has no more jobs
+END_OF_WORK = None
+
+# slaves fetch enough jobs to keep busy for about BATCH_TARGET_TIME
+# seconds based on a moving average of the observed job durations
+BATCH_TARGET_TIME = 10.0
+DURATION_SMOOTHING = 0.3
+
+# job output is written to log files on the node and only the last
+# LOG_TAIL_SIZE bytes (compressed) are sent back to the master
+LOG_TAIL_SIZE = 4096
+
+# default seconds between heartbeats renewing the leases of the jobs of
+# a slave. The master sets it well below its lease timeout.
+HEARTBEAT_INTERVAL = 30.0
+
+# seconds between checks of the free disk space while a job waits for
+# scratch. Space can be freed by processes outside the pool.
+SCRATCH_POLL_INTERVAL = 10.0
+
+# scratch pool directories are named calcit-<hostname>-<pid of the node driver>
+SCRATCH_POOL_NAME = "calcit-{0:s}-{1:d}"
+SCRATCH_POOL_PATTERN = re.compile(r"^calcit-(?P<hostname>.+)-(?P<pid>\d+)$")
 
 
 """ Connects to a host from remote nodes and begins executing jobs.
 """
 
-def make_slave_manager(ip, port, authorization_key):
-    """ Sets up a SlaveManagThe slave manager is responsible for connecting to the
-        server and obtain the queues needed to both run jobs
-        and post results back.
+def encode_frame(payload):
+    """ Returns payload (bytes) prefixed with its length """
+    return HEADER.pack(len(payload)) + payload
+
+
+def digest(authorization_key, challenge):
+    return hmac.new(authorization_key, challenge, hashlib.sha256).digest()
+
+
+class DispatchClient(object):
+    """ Connection to the dispatch server of the master
+
+        See calcit/server.py for the wire protocol.
+
+        Raises: ConnectionError if the master could not be authenticated
 
         Arguments:
         ip -- the ip address (or fully qualified domain name)
               of master that slave connects to
         port -- the port over which a connection attempt is made
         authorization_key -- program secret used to identify correct server
+    """
+    def __init__(self, ip, port, authorization_key):
+        key = authorization_key.encode("utf-8")
+        self.sock = socket.create_connection((ip, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
-        Returns:
-        The slave manager
+        # the master challenges us first and then we challenge the master
+        self.sock.sendall(encode_frame(digest(key, self._recv_frame())))
+        challenge = os.urandom(CHALLENGE_SIZE)
+        self.sock.sendall(encode_frame(challenge))
+        if not hmac.compare_digest(self._recv_frame(), digest(key, challenge)):
+            raise ConnectionError("Master at {0}:{1} failed to authenticate.".format(ip, port))
+
+        self.send_lock = threading.Lock()
+        self.closed = threading.Event()
+        self.heartbeat = None
+
+    def _recv_exactly(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise EOFError("Master closed the connection.")
+            data += chunk
+        return data
+
+    def _recv_frame(self):
+        size, = HEADER.unpack(self._recv_exactly(HEADER.size))
+        return self._recv_exactly(size)
+
+    def send(self, message):
+        frame = encode_frame(pickle.dumps(message, pickle.HIGHEST_PROTOCOL))
+        with self.send_lock:
+            self.sock.sendall(frame)
+
+    def start_heartbeat(self, slave_id, interval=HEARTBEAT_INTERVAL):
+        """ Identifies the slave and keeps its job leases alive from a
+            background thread while jobs run
+        """
+        self.send(('hello', slave_id))
+        self.heartbeat = threading.Thread(target=self._send_heartbeats, args=(interval,))
+        self.heartbeat.daemon = True
+        self.heartbeat.start()
+
+    def _send_heartbeats(self, interval):
+        while not self.closed.wait(interval):
+            try:
+                self.send(('heartbeat',))
+            except OSError:
+                return
+
+    def done(self, job_names):
+        """ Releases the leases of finished jobs """
+        self.send(('done', list(job_names)))
+
+    def receive(self):
+        return pickle.loads(self._recv_frame())
+
+    def queue(self, name):
+        return RemoteQueue(self, name)
+
+    def close(self):
+        self.closed.set()
+        self.sock.close()
+
+
+class RemoteQueue(object):
+    """ Job or result queue on the master accessed through a DispatchClient """
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def get_batch(self, max_items):
+        """ Blocks until the master sends between 1 and max_items items """
+        self.client.send(('get', max_items))
+        kind, items = self.client.receive()
+        return items
+
+    def put_batch(self, items):
+        self.client.send(('put', self.name, list(items)))
+
+    def put(self, item):
+        self.put_batch([item])
+
+
+class NodeResources(object):
+    """ Cores and memory of a node shared by all slave processes on it
+
+        A slave acquires the cores and memory of a job before running
+        it and releases them afterwards so jobs of different sizes are
+        packed onto the node without oversubscribing it. A job asking
+        for more than the node has is clamped to the node capacity and
+        thus runs alone.
+
+        Arguments:
+        cores -- number of cores on the node. None means no limit.
+        memory -- memory in MB on the node. None means no limit.
+    """
+    def __init__(self, cores, memory):
+        self.cores = cores
+        self.memory = memory
+        self.free_cores = mp.Value('i', cores or 0, lock=False)
+        self.free_memory = mp.Value('q', memory or 0, lock=False)
+        self.condition = mp.Condition()
+
+    def _clamp(self, cores, memory):
+        if self.cores is not None:
+            cores = min(cores, self.cores)
+        if self.memory is not None:
+            memory = min(memory, self.memory)
+        return cores, memory
+
+    def _fits(self, cores, memory):
+        if self.cores is not None and cores > self.free_cores.value:
+            return False
+        if self.memory is not None and memory > self.free_memory.value:
+            return False
+        return True
+
+    def acquire(self, cores, memory):
+        """ Blocks until cores and memory (in MB) are free and takes them """
+        cores, memory = self._clamp(cores, memory)
+        with self.condition:
+            self.condition.wait_for(lambda: self._fits(cores, memory))
+            self.free_cores.value -= cores
+            self.free_memory.value -= memory
+
+    def release(self, cores, memory):
+        """ Returns cores and memory (in MB) to the node """
+        cores, memory = self._clamp(cores, memory)
+        with self.condition:
+            self.free_cores.value += cores
+            self.free_memory.value += memory
+            self.condition.notify_all()
+
+
+class ScratchPool(object):
+    """ Node local scratch space shared by all slave processes on it
+
+        Every job gets its own scratch directory in the pool which is
+        removed when the job ends, also if it fails. The scratch a job
+        asks for is reserved before it starts and the job waits while
+        the free space of the disk minus the reservations of running
+        jobs would drop below min_free. A job that does not fit even
+        when no other job has scratch starts anyway.
+
+        Jobs asking for at most tmpfs_limit MB are given a directory on
+        tmpfs, i.e. /dev/shm, if it has room.
+
+        The pool directory is removed by the node driver when it exits.
+        Pools left behind by node drivers that were killed are removed
+        when a new pool is created on the node.
+
+        Arguments:
+        directory -- node local directory to create the pool in
+        min_free -- space in MB to always leave free on the disk
+        tmpfs -- directory on a memory backed file system. None disables tmpfs.
+        tmpfs_limit -- the largest scratch (in MB) of jobs put on tmpfs
     """
+    def __init__(self, directory, min_free=0, tmpfs=None, tmpfs_limit=0):
+        name = SCRATCH_POOL_NAME.format(socket.gethostname(), os.getpid())
+        self.directories = [os.path.join(os.path.expandvars(directory), name)]
+        self.min_free = [min_free]
+        if tmpfs is not None:
+            self.directories.append(os.path.join(os.path.expandvars(tmpfs), name))
+            self.min_free.append(0)
+        self.tmpfs_limit = tmpfs_limit
+        for pool_directory in self.directories:
+            remove_stale_scratch(os.path.dirname(pool_directory))
+            os.makedirs(pool_directory, exist_ok=True)
+        self.reserved = mp.Array('q', len(self.directories), lock=False)
+        self.jobs = mp.Value('i', 0, lock=False)
+        self.condition = mp.Condition()
+
+    def _fits(self, index, size):
+        free = shutil.disk_usage(self.directories[index]).free // (1024 * 1024)
+        return free - self.reserved[index] - size >= self.min_free[index]
+
+    def _place(self, size):
+        """ Returns the index of the directory to put a job in or None if it must wait """
+        if len(self.directories) > 1 and size <= self.tmpfs_limit and self._fits(1, size):
+            return 1
+        if self._fits(0, size) or self.jobs.value == 0:
+            return 0
+        return None
+
+    def acquire(self, job, size):
+        """ Blocks until size MB of scratch are free and creates the
+            scratch directory of a job
+
+            Arguments:
+            job -- the name of the job
+            size -- the scratch (in MB) the job needs
 
-    class ServerQueueManager(multiprocessing.managers.SyncManager):
-        pass
+            Returns:
+            the lease to give to release. The directory is its second element.
+        """
+        with self.condition:
+            index = self._place(size)
+            while index is None:
+                self.condition.wait(SCRATCH_POLL_INTERVAL)
+                index = self._place(size)
+            self.reserved[index] += size
+            self.jobs.value += 1
+        directory = os.path.join(self.directories[index], "{0:s}.{1:d}".format(safe_filename(job), os.getpid()))
+        os.makedirs(directory, exist_ok=True)
+        return index, directory, size
 
-    ServerQueueManager.register(JOB_QUEUE_NAME)
-    ServerQueueManager.register(RES_QUEUE_NAME)
+    def release(self, lease):
+        """ Removes the scratch directory of a job and returns its space to the pool """
+        index, directory, size = lease
+        shutil.rmtree(directory, ignore_errors=True)
+        with self.condition:
+            self.reserved[index] -= size
+            self.jobs.value -= 1
+            self.condition.notify_all()
 
-    manager = ServerQueueManager(address=(ip, port), authkey=authorization_key.encode("utf-8"))
-    manager.connect()
+    def close(self):
+        """ Removes the pool including scratch left by slaves that were killed """
+        for directory in self.directories:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def remove_stale_scratch(directory):
+    """ Removes the scratch pools of node drivers on this node that are no longer running
+
+        Arguments:
+        directory -- directory the pools are created in
+    """
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    hostname = socket.gethostname()
+    for name in names:
+        match = SCRATCH_POOL_PATTERN.match(name)
+        if match is None or match.group('hostname') != hostname:
+            continue
+        try:
+            os.kill(int(match.group('pid')), 0)
+        except ProcessLookupError:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+        except PermissionError:
+            # the process exists but belongs to someone else
+            pass
 
-    return manager
 
-def slave_node_driver(shared_job_queue, shared_result_queue, n_jobs_per_node):
+def detect_node_resources(cores, memory):
+    """ Returns the cores and memory (in MB) of this node
+
+        Arguments:
+        cores -- number of cores, None for no limit or 'auto' to detect
+        memory -- memory in MB, None for no limit or 'auto' to detect
+    """
+    if cores == 'auto':
+        cores = os.cpu_count()
+    if memory == 'auto':
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    return cores, memory
+
+
+def slave_node_driver(server, n_jobs_per_node, max_batch_size, cores_per_node=None, memory_per_node=None, node=None, log_dir=None, heartbeat_interval=HEARTBEAT_INTERVAL, scratch_pool=None):
     """ Starts slave processes on a single node
 
         Arguments:
-        shared_job_queue -- the job queue to obtain jobs from
-        shared_result_queue -- the queue that results are sent to
+        server -- (ip, port, authorization_key) of the master
         n_jobs_per_node -- the number of slave processes to start per node
+        max_batch_size -- the maximum number of jobs a slave fetches at once
+        cores_per_node -- cores available to jobs. None for no limit or 'auto'
+        memory_per_node -- memory (in MB) available to jobs. None for no limit or 'auto'
+        node -- the name of this node as known by the master
+        log_dir -- directory for job output. None uses a directory in the
+                   temporary directory of the node.
+        heartbeat_interval -- seconds between heartbeats of each slave
+        scratch_pool -- tuple of the arguments of the ScratchPool shared by
+                        the slaves. None lets jobs use the scratch directory
+                        in their run scripts.
+    """
+    if log_dir is None:
+        log_dir = os.path.join(tempfile.gettempdir(), "calcit_logs")
+    os.makedirs(log_dir, exist_ok=True)
+    resources = NodeResources(*detect_node_resources(cores_per_node, memory_per_node))
+    pool = None
+    if scratch_pool is not None:
+        pool = ScratchPool(*scratch_pool)
+    try:
+        procs = []
+        for i in range(n_jobs_per_node):
+            proc = mp.Process(target=slave, args=(server, max_batch_size, resources, node, log_dir, heartbeat_interval, pool))
+            procs.append(proc)
+            proc.start()
+
+        for proc in procs:
+            proc.join()
+    finally:
+        if pool is not None:
+            pool.close()
+
+def next_batch_size(mean_duration, max_batch_size):
+    """ Returns the number of jobs to fetch in the next batch
+
+        Short jobs give large batches while jobs that take longer
+        than BATCH_TARGET_TIME are fetched one at a time.
+
+        Arguments:
+        mean_duration -- average job duration in seconds. None if unknown.
+        max_batch_size -- the largest batch allowed
     """
-    procs = []
-    for i in range(n_jobs_per_node):
-        proc = mp.Process(target=slave, args=(shared_job_queue, shared_result_queue))
-        procs.append(proc)
-        proc.start()
+    if mean_duration is None:
+        return 1
+    batch_size = int(BATCH_TARGET_TIME / max(mean_duration, 1.0e-3))
+    return max(1, min(max_batch_size, batch_size))
 
-    for proc in procs:
-        proc.join()
 
-def slave(job_queue, result_queue):
+def slave(server, max_batch_size=1, resources=None, node=None, log_dir=None, heartbeat_interval=HEARTBEAT_INTERVAL, scratch=None):
     """ Continously run commands from job queue and
         put results into result queue. The result queue
         is used for accounting when everything is done.
 
+        Jobs are fetched and results are returned in batches
+        whose size adapts to the duration of the jobs. Each job
+        waits for its cores and memory to be free on the node.
+
+        With a scratch pool every job also waits for its scratch and
+        gets its own scratch directory in the CALCIT_SCRATCH environment
+        variable. The directory is removed when the job ends.
+
+        The output of a job is written to log files in log_dir and
+        only the compressed tails are part of the result. The log files
+        of jobs that succeed are removed once their tails are read so
+        only the logs of failed jobs are left on the node. If CalcIt
+        is installed on the node the energy, convergence and timings
+        are parsed from the output and sent back as well.
+
+        The slave blocks on the job queue until the master
+        sends END_OF_WORK. The signal is put back on the job
+        queue for the other slaves and the slave reports that
+        it is done before it quits.
+
+        Every slave has its own connection to the master. Jobs
+        are leased to the slave until it reports them done and
+        the lease is kept alive by heartbeats. If the slave dies
+        the master gives its jobs to another slave.
+
         This function is called from slave_node_driver
 
         Arguments:
-        job_queue -- the queue from which to get jobs
-        result_queue -- the queue to put results into
+        server -- (ip, port, authorization_key) of the master
+        max_batch_size -- the maximum number of jobs to fetch at once
+        resources -- the NodeResources shared by slaves on this node
+        node -- the name of this node as known by the master
+        log_dir -- directory for job output
+        heartbeat_interval -- seconds between heartbeats to the master
+        scratch -- the ScratchPool shared by slaves on this node or None
+    """
+    if log_dir is None:
+        log_dir = tempfile.gettempdir()
+    slave_id = "{0:s}:{1:d}".format(node or socket.gethostname(), os.getpid())
+    mean_duration = None
+    client = DispatchClient(*server)
+    client.start_heartbeat(slave_id, heartbeat_interval)
+    job_queue = client.queue(JOB_QUEUE)
+    result_queue = client.queue(RESULT_QUEUE)
+    try:
+        result_queue.put((MSG_SLAVE_READY, slave_id))
+        running = True
+        while running:
+            batch = job_queue.get_batch(next_batch_size(mean_duration, max_batch_size)) # get jobs from job queue
+            received = time.time()
+            results = []
+            for index, item in enumerate(batch):
+                if item is END_OF_WORK:
+                    # return the signal (and anything after it) for the other slaves
+                    job_queue.put_batch(batch[index:])
+                    running = False
+                    break
+                job, cmd, cores, memory, scratch_size, output = item
+                log_files = job_log_files(log_dir, job)
+                lease = None
+                env = None
+                # scratch is taken first so a job waiting for disk does not hold cores and memory
+                if scratch is not None:
+                    lease = scratch.acquire(job, scratch_size)
+                    env = dict(os.environ, CALCIT_SCRATCH=lease[1])
+                try:
+                    if resources is not None:
+                        resources.acquire(cores, memory)
+                    try:
+                        started = time.time()
+                        returncode, duration = execute(cmd, *log_files, env=env)
+                        ended = time.time()
+                    finally:
+                        if resources is not None:
+                            resources.release(cores, memory)
+                finally:
+                    if lease is not None:
+                        scratch.release(lease)
+                if mean_duration is None:
+                    mean_duration = float(duration)
+                else:
+                    mean_duration += DURATION_SMOOTHING * (float(duration) - mean_duration)
+                out, err = [read_tail(filename) for filename in log_files]
+                if returncode == 0:
+                    remove_files(log_files)
+                # when the batch was received, the job started and ended and the result was sent
+                timings = [received, started, ended, None]
+                results.append((MSG_RESULT, slave_id, job, duration, returncode, out, err, log_files, parse_output(output), timings))
+            if results:
+                sent = time.time()
+                for result in results:
+                    result[-1][3] = sent
+                result_queue.put_batch(results) # dump results in result queue
+                client.done(result[2] for result in results)
+        result_queue.put((MSG_SLAVE_DONE, slave_id))
+    except (EOFError, ConnectionError):
+        # the master has shut down
+        return
+    finally:
+        client.close()
+
+def parse_output(output):
+    """ Returns the parsed output of a job as a tuple or None if it could not be parsed
+
+        Arguments:
+        output -- tuple of the program and the output file of the job
     """
-    while True:
+    if try_parse_output is None:
+        return None
+    program, filename = output
+    summary = try_parse_output(filename, program)
+    if isinstance(summary, Exception):
+        return None
+    return tuple(summary)
+
+
+def safe_filename(job):
+    """ Returns the name of a job with only characters safe in filenames """
+    return re.sub(r"[^\w.-]+", "_", job).strip("_")
+
+
+def job_log_files(log_dir, job):
+    """ Returns the stdout and stderr log filenames of a job """
+    basename = os.path.join(log_dir, safe_filename(job))
+    return basename + ".stdout", basename + ".stderr"
+
+
+def remove_files(filenames):
+    """ Removes files that may have been removed already """
+    for filename in filenames:
         try:
-            job, cmd = job_queue.get_nowait() # get job from job queue
-            out, err, time = execute(cmd)
-            result = (job, time, out, err)
-            result_queue.put(result) # dump result in result queue
-        except queue.Empty:
-            return
-
-def execute(command):
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+
+
+def read_tail(filename, size=LOG_TAIL_SIZE):
+    """ Returns the last size bytes of a file compressed with zlib """
+    with open(filename, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - size))
+        return zlib.compress(f.read())
+
+
+def execute(command, stdout_filename=os.devnull, stderr_filename=os.devnull, env=None):
     """ Executes command given an argument through a shell
 
+        Output is streamed to files so it is never held in memory.
+
         This command will also calculate the time it took for
-        execution (sans SLAVE_RETURN_DELAY) and return it
+        execution and return it
 
         Arguments:
         command -- command line arguments to run a job
+        stdout_filename -- file to write standard output to
+        stderr_filename -- file to write standard error to
+        env -- environment of the command. None uses the environment of the slave.
+
+        Returns:
+        the exit code of the command and the time it took
     """
     t0 = numpy.asarray(time.time(),dtype=numpy.float64)
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-    output, error = process.communicate()
+    with open(stdout_filename, "wb") as stdout, open(stderr_filename, "wb") as stderr:
+        process = subprocess.Popen(command, stdout=stdout, stderr=stderr, shell=True, env=env)
+        returncode = process.wait()
     t1 = numpy.asarray(time.time(),dtype=numpy.float64)
 
-    time.sleep(SLAVE_RETURN_DELAY)
-
-    return output, error, t1 - t0
+    return returncode, t1 - t0
 
 if __name__ == '__main__':
-    manager = make_slave_manager("$HOSTNAME", $PORT, "$AUTHKEY")
-    job_queue = manager.get_job_queue()
-    result_queue = manager.get_result_queue()
-    slave_node_driver(job_queue, result_queue, $JOBS_PER_NODE)
+    server = ("$HOSTNAME", $PORT, "$AUTHKEY")
+    jobs_per_node = $JOBS_PER_NODE
+    node = None
+    if len(sys.argv) > 1:
+        jobs_per_node = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        node = sys.argv[2]
+    slave_node_driver(server, jobs_per_node, $MAX_BATCH_SIZE, $CORES_PER_NODE, $MEMORY_PER_NODE, node, $LOG_DIR, $HEARTBEAT_INTERVAL, $SCRATCH_POOL)
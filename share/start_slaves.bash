@@ -1,8 +1,10 @@
 #!/usr/bin/env bash
 # this script starts a python multiprocessing slave process
 # on a remote node (given as argument to this script) using
-# the REMOTE_SHELL protocol.
+# the REMOTE_SHELL protocol. The optional second argument is
+# the number of jobs to run on the node. The node name is passed
+# on to the slaves so they identify themselves with it.
 #
 # For your convenience (and debugging satisfaction) it also
 # dumps node output and error files (hopefully they are empty!)
-$REMOTE_SHELL $1 "if [ -e ~/.bash_profile ]; then source ~/.bash_profile; fi; cd $WORK_DIR; python3 slave.py >& ${1}.stdout 2> ${1}.stderr  &"
+$REMOTE_SHELL $1 "if [ -e ~/.bash_profile ]; then source ~/.bash_profile; fi; cd $WORK_DIR; python3 slave.py $2 $1 >& ${1}.stdout 2> ${1}.stderr  &"
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from calcit.cache import ResultCache, job_cache_key
+from calcit.process import job_summary, cache_output
+
+
+class FakeJob(object):
+    """ ORCA job with an output file """
+    def __init__(self, filename):
+        self.filename = filename
+
+    def get_program(self):
+        return 'orca'
+
+    def get_output_filename(self):
+        return self.filename
+
+
+class TestCacheOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ResultCache(os.path.join(self.directory, "cache"))
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory)
+
+    def write_job(self, name, text):
+        filename = os.path.join(self.directory, "{0:s}_orca_energy.out".format(name))
+        with open(filename, "w") as f:
+            f.write(text)
+        return FakeJob(filename)
+
+    def test_normal_termination_is_cached(self):
+        job = self.write_job("good", "FINAL SINGLE POINT ENERGY     -76.0\n****ORCA TERMINATED NORMALLY****\n")
+        self.assertTrue(cache_output(self.cache, "good", job, 0, job_summary(job)))
+        self.assertTrue(self.cache.fetch("good", os.path.join(self.directory, "copy.out")))
+
+    def test_failed_job_is_not_cached(self):
+        # the run script exits with 0 but ORCA stopped before the end
+        job = self.write_job("crashed", "SCF ITERATIONS\n")
+        self.assertFalse(cache_output(self.cache, "crashed", job, 0, job_summary(job)))
+        self.assertFalse(self.cache.fetch("crashed", os.path.join(self.directory, "copy.out")))
+
+    def test_nonzero_exit_is_not_cached(self):
+        job = self.write_job("killed", "****ORCA TERMINATED NORMALLY****\n")
+        self.assertFalse(cache_output(self.cache, "killed", job, 1, job_summary(job)))
+        self.assertEqual(self.cache.size(), 0)
+
+    def test_unparsable_output_is_not_cached(self):
+        job = FakeJob(os.path.join(self.directory, "missing_orca_energy.out"))
+        self.assertFalse(cache_output(self.cache, "missing", job, 0, job_summary(job)))
+
+
+class InputJob(object):
+    """ Job with an input file, an output file and dependencies """
+    def __init__(self, directory, name, text, dependencies=()):
+        self.input_filename = os.path.join(directory, "{0:s}.dal".format(name))
+        self.output_filename = os.path.join(directory, "{0:s}.out".format(name))
+        self.dependencies = tuple(dependencies)
+        with open(self.input_filename, "w") as f:
+            f.write(text)
+
+    def get_program(self):
+        return 'dalton'
+
+    def get_program_version(self):
+        return ' /opt/dalton'
+
+    def get_input_filename(self):
+        return self.input_filename
+
+
+class TestJobCacheKey(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.monomer = InputJob(self.directory, "monomer", "**DALTON\n.PDE\n")
+        self.excitation = InputJob(self.directory, "excitation", "**DALTON\n.PEQM\n", [self.monomer])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_outputs_of_dependencies_are_not_hashed(self):
+        with open(self.monomer.output_filename, "w") as f:
+            f.write("Date and time: Mon\n")
+        key = job_cache_key(self.excitation)
+        with open(self.monomer.output_filename, "w") as f:
+            f.write("Date and time: Tue\n")
+        self.assertEqual(job_cache_key(self.excitation), key)
+
+    def test_inputs_of_dependencies_are_hashed(self):
+        key = job_cache_key(self.excitation)
+        with open(self.monomer.input_filename, "w") as f:
+            f.write("**DALTON\n.PDE\n.DIRECT\n")
+        self.assertNotEqual(job_cache_key(self.excitation), key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import itertools
+import unittest
+
+from calcit.cost import JobSize, job_size, order_jobs
+
+
+class TestOrderJobs(unittest.TestCase):
+
+    def test_input_order_is_kept(self):
+        jobs = iter([3, 1, 2])
+        self.assertIs(order_jobs(jobs, 'input', cost=float), jobs)
+
+    def test_unbounded_window_sorts_all_jobs(self):
+        self.assertEqual(list(order_jobs([3, 1, 2, 5], 'longest-first', cost=float, window=None)), [5, 3, 2, 1])
+        self.assertEqual(list(order_jobs([3, 1, 2, 5], 'shortest-first', cost=float, window=0)), [1, 2, 3, 5])
+
+    def test_window_orders_jobs_read_so_far(self):
+        self.assertEqual(list(order_jobs([1, 4, 2, 8, 3, 0], 'longest-first', cost=float, window=2)), [4, 8, 3, 2, 1, 0])
+        self.assertEqual(sorted(order_jobs(range(100), 'shortest-first', cost=float, window=7)), list(range(100)))
+
+    def test_window_equal_costs_keep_input_order(self):
+        self.assertEqual(list(order_jobs("abcd", 'longest-first', cost=lambda job: 1.0, window=3)), list("abcd"))
+
+    def test_jobs_are_streamed(self):
+        read = []
+
+        def jobs():
+            for job in itertools.count():
+                read.append(job)
+                yield job
+
+        ordered = order_jobs(jobs(), 'longest-first', cost=float, window=10)
+        self.assertEqual(next(ordered), 10)
+        self.assertEqual(len(read), 11)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            order_jobs([], 'random')
+
+
+class TestJobSize(unittest.TestCase):
+
+    def test_job_size(self):
+        self.assertEqual(job_size(['C', 'h', 'H', 'O', 'H', 'H'], 'STO-3G'), JobSize(6, 14, 'CH4O'))
+        self.assertEqual(job_size([], 'sto-3g'), JobSize(0, 0, ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import itertools
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from calcit.fragments import split_fragments, fragment_neighbors, fragment_trimers, fragments
+from calcit.molecule import Molecule
+
+# a water molecule with its oxygen at the origin
+WATER = [('O', (0.0, 0.0, 0.0)), ('H', (0.76, 0.59, 0.0)), ('H', (-0.76, 0.59, 0.0))]
+
+
+def cluster(offsets):
+    """ Returns a Molecule of water molecules shifted by offsets """
+    labels = [label for offset in offsets for label, position in WATER]
+    coordinates = [numpy.add(position, offset) for offset in offsets for label, position in WATER]
+    return Molecule.from_labels(labels, coordinates)
+
+
+def brute_force_pairs(molecule, monomers, cutoff):
+    pairs = []
+    for a, b in itertools.combinations(range(len(monomers)), 2):
+        difference = molecule.coordinates[monomers[a]][:, None, :] - molecule.coordinates[monomers[b]][None, :, :]
+        if numpy.sqrt((difference**2).sum(axis=2)).min() <= cutoff:
+            pairs.append((a, b))
+    return pairs
+
+
+class TestSplitFragments(unittest.TestCase):
+
+    def setUp(self):
+        # three waters in a row 3 Angstrom apart and one far away
+        self.molecule = cluster([(0.0, 0.0, 0.0), (3.0, 0.0, 0.0), (6.0, 0.0, 0.0), (30.0, 0.0, 0.0)])
+
+    def test_bonded_fragments(self):
+        monomers = split_fragments(self.molecule)
+        self.assertEqual([atoms.tolist() for atoms in monomers], [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9, 10, 11]])
+
+    def test_fixed_size_fragments(self):
+        monomers = split_fragments(self.molecule, 6)
+        self.assertEqual([atoms.tolist() for atoms in monomers], [[0, 1, 2, 3, 4, 5], [6, 7, 8, 9, 10, 11]])
+        self.assertRaises(ValueError, split_fragments, self.molecule, 5)
+
+    def test_neighbors_and_trimers(self):
+        monomers = split_fragments(self.molecule)
+        pairs = fragment_neighbors(self.molecule, monomers, 4.0)
+        self.assertEqual(pairs, [(0, 1), (1, 2)])
+        self.assertEqual(fragment_trimers(pairs), [])
+        pairs = fragment_neighbors(self.molecule, monomers, 7.0)
+        self.assertEqual(pairs, [(0, 1), (0, 2), (1, 2)])
+        self.assertEqual(fragment_trimers(pairs), [(0, 1, 2)])
+
+    def test_cell_list_matches_brute_force(self):
+        offsets = numpy.random.RandomState(0).uniform(0.0, 15.0, (40, 3))
+        molecule = cluster(offsets)
+        monomers = split_fragments(molecule, 3)
+        self.assertEqual(fragment_neighbors(molecule, monomers, 4.0), brute_force_pairs(molecule, monomers, 4.0))
+
+
+class TestFragmentNames(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "water.xyz")
+        molecule = cluster([(0.0, 0.0, 0.0), (3.0, 0.0, 0.0), (6.0, 0.0, 0.0)])
+        with open(self.filename, "w") as f:
+            f.write("{0:d}\n\n".format(len(molecule)))
+            for symbol, (x, y, z) in molecule:
+                f.write("{0:s} {1:f} {2:f} {3:f}\n".format(symbol, x, y, z))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_monomers_dimers_and_trimers(self):
+        base = os.path.join(self.directory, "water")
+        generated = list(fragments(self.filename, order=3, cutoff=7.0))
+        self.assertEqual([name[len(base) + 1:] for name, geometry in generated],
+                         ['m0000', 'm0001', 'm0002', 'd0000_0001', 'd0000_0002', 'd0001_0002', 't0000_0001_0002'])
+        dimer = dict(generated)[base + "_d0000_0002"]()
+        self.assertEqual(dimer.symbols(), ['O', 'H', 'H'] * 2)
+        self.assertEqual(dimer.coordinates[3].tolist(), [6.0, 0.0, 0.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
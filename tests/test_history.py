@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from calcit.history import JobInfo, RuntimeHistory
+from calcit.parsers import OutputSummary
+from calcit.process import terminated_normally
+
+
+def info(n_basis):
+    return JobInfo(program='orca', runtype='energy', basis_set='sto-3g', dft_functional='',
+                   n_atoms=3, n_basis=n_basis, composition='H2O', cores=1)
+
+
+class TestRuntimeHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.history = RuntimeHistory(os.path.join(self.directory, "history.sqlite"))
+
+    def tearDown(self):
+        self.history.close()
+        shutil.rmtree(self.directory)
+
+    def test_fit_is_kept_until_commit(self):
+        self.history.record('a', info(10), 'node', 10.0)
+        self.history.commit()
+        self.assertAlmostEqual(self.history.predict(info(10)), 10.0)
+
+        # runs that are not committed do not change the prediction
+        self.history.record('b', info(10), 'node', 30.0)
+        self.assertAlmostEqual(self.history.predict(info(10)), 10.0)
+
+        self.history.commit()
+        self.assertAlmostEqual(self.history.predict(info(10)), 10.0 * 3.0 ** 0.5)
+
+    def test_no_runs(self):
+        self.assertIsNone(self.history.predict(info(10)))
+        self.assertIsNone(self.history.calibration())
+
+
+class TestTerminatedNormally(unittest.TestCase):
+
+    def test_only_normal_runs_are_recorded(self):
+        normal = OutputSummary('orca', -76.0, True, 10, 1.0, True)
+        crashed = normal._replace(normal_termination=False)
+        self.assertTrue(terminated_normally(0, normal))
+        self.assertFalse(terminated_normally(0, crashed))
+        self.assertFalse(terminated_normally(1, normal))
+        self.assertFalse(terminated_normally(0, IOError("no output")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import os
+import unittest
+
+from calcit.orca import OrcaEnergyJob
+
+
+def unread_geometry():
+    raise AssertionError("The geometry was read.")
+
+
+class TestProgramVersion(unittest.TestCase):
+
+    def setUp(self):
+        self.environ = dict(os.environ)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    def test_version_does_not_read_geometry(self):
+        os.environ['ORCA'] = '/opt/orca'
+        job = OrcaEnergyJob('water', geometry=unread_geometry)
+        self.assertEqual(job.get_program_version(), ' /opt/orca')
+        self.assertIsNone(job._run_script_substitutions)
+
+    def test_missing_program_is_not_cached(self):
+        os.environ.pop('ORCA', None)
+        job = OrcaEnergyJob('water', geometry=unread_geometry)
+        self.assertRaises(ValueError, job.get_program_version)
+        os.environ['ORCA'] = '/opt/orca'
+        self.assertEqual(job.get_program_version(), ' /opt/orca')
+
+
+if __name__ == '__main__':
+    unittest.main()
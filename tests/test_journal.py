@@ -0,0 +1,72 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+from calcit.journal import RunJournal, DONE, FAILED, PREPARED
+from calcit.parsers import OutputSummary, ResultsTable
+
+
+class FakeJob(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+def summary(energy):
+    return OutputSummary('orca', energy, True, 10, 1.0, True)
+
+
+class TestResume(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.journal = os.path.join(self.directory, "calcit.journal")
+        self.results = os.path.join(self.directory, "results")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def interrupted_run(self):
+        journal = RunJournal(self.journal)
+        table = ResultsTable(self.results)
+        journal.record(PREPARED, 'a')
+        journal.record(DONE, 'a', 'node1')
+        table.add('a_orca_energy', summary(-1.0))
+        journal.record(FAILED, 'b', 'node1')
+        journal.close()
+        table.close()
+
+    def read_rows(self):
+        with open(self.results + ".csv") as f:
+            return list(csv.reader(f))
+
+    def test_done_jobs_are_skipped(self):
+        self.interrupted_run()
+        journal = RunJournal(self.journal, resume=True)
+        jobs = list(journal.skip_completed(FakeJob(name) for name in 'abc'))
+        journal.close()
+        self.assertEqual([repr(job) for job in jobs], ['b', 'c'])
+        self.assertEqual(journal.skipped, 1)
+
+    def test_results_table_is_continued(self):
+        self.interrupted_run()
+        table = ResultsTable(self.results, resume=True)
+        table.add('b_orca_energy', summary(-2.0))
+        table.close()
+        rows = self.read_rows()
+        self.assertEqual(rows[0][0], 'job')
+        self.assertEqual([row[0] for row in rows[1:]], ['a_orca_energy', 'b_orca_energy'])
+
+    def test_results_table_is_started_over(self):
+        self.interrupted_run()
+        table = ResultsTable(self.results)
+        table.close()
+        self.assertEqual(len(self.read_rows()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+from calcit.metrics import RunMetrics
+from calcit.process import BatchQueue, SlavePool, drain_slaves, MSG_SLAVE_READY, MSG_SLAVE_DONE, END_OF_WORK
+
+
+class TestEstimate(unittest.TestCase):
+
+    def test_estimate_while_total_is_unknown(self):
+        metrics = RunMetrics()
+        for name in 'abcd':
+            metrics.job_queued(name)
+        metrics.job_finished('a', 'node1:1', 1.0, True)
+        snapshot = metrics.snapshot()
+        self.assertIsNone(snapshot['jobs']['total'])
+        self.assertEqual(snapshot['jobs']['remaining'], 3)
+        self.assertIsNotNone(snapshot['eta_seconds'])
+        self.assertTrue(snapshot['eta_is_lower_bound'])
+
+        metrics.all_queued()
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['jobs']['total'], 4)
+        self.assertFalse(snapshot['eta_is_lower_bound'])
+
+
+class TestDrainSlaves(unittest.TestCase):
+
+    def test_slaves_leaving_are_observed(self):
+        metrics = RunMetrics()
+        slaves = SlavePool([('node1', 1)])
+        job_queue = BatchQueue()
+        result_queue = BatchQueue()
+        for message in [(MSG_SLAVE_READY, 'node1:1')]:
+            metrics.observe(message)
+            slaves.slave_ready(message[1])
+        self.assertEqual(metrics.snapshot()['nodes']['node1']['slots'], 1)
+
+        result_queue.put((MSG_SLAVE_DONE, 'node1:1'))
+        drain_slaves(job_queue, result_queue, slaves, timeout=5, metrics=metrics)
+        self.assertEqual(job_queue.get(), END_OF_WORK)
+        self.assertEqual(metrics.snapshot()['nodes']['node1']['slots'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
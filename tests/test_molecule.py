@@ -0,0 +1,29 @@
+import unittest
+
+from calcit.gamess import GAMESSEnergyJob
+from calcit.molecule import Molecule, atomic_number
+
+
+class TestAtomicNumber(unittest.TestCase):
+
+    def test_labels(self):
+        self.assertEqual(atomic_number('Cl'), 17)
+        self.assertEqual(atomic_number('C1'), 6)
+        self.assertEqual(atomic_number('HW'), 1)
+        # labels are element symbols first
+        self.assertEqual(atomic_number('CA'), 20)
+        self.assertRaises(ValueError, atomic_number, '1')
+
+
+class TestGAMESSCoordinates(unittest.TestCase):
+
+    def test_symbol_and_charge_are_separate(self):
+        molecule = Molecule.from_labels(['Cl', 'Fe', 'H'], [[0.0, 0.0, 0.0], [1.0, 2.0, 3.0], [0.5, 0.0, 0.0]])
+        job = GAMESSEnergyJob('complex', geometry=lambda: molecule)
+        lines = job.get_coordinates().split("\n")
+        self.assertEqual([line.split()[:2] for line in lines], [['Cl', '17.0'], ['Fe', '26.0'], ['H', '1.0']])
+        self.assertEqual(lines[1].split()[2:], ['1.000000000', '2.000000000', '3.000000000'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+
+from calcit.nodes import expand_hostlist, parse_nodes, read_hostfile, slurm_nodes, discover_nodes, job_slots
+
+
+class TestHostlist(unittest.TestCase):
+
+    def test_plain_hosts(self):
+        self.assertEqual(expand_hostlist("localhost"), ["localhost"])
+        self.assertEqual(expand_hostlist("a,b"), ["a", "b"])
+
+    def test_ranges_keep_zero_padding(self):
+        self.assertEqual(expand_hostlist("node[01-03,07],gpu5"), ["node01", "node02", "node03", "node07", "gpu5"])
+        self.assertEqual(expand_hostlist("n[8-10]"), ["n8", "n9", "n10"])
+
+    def test_several_brackets(self):
+        self.assertEqual(expand_hostlist("r[1-2]n[1,3]"), ["r1n1", "r1n3", "r2n1", "r2n3"])
+
+    def test_parse_nodes_with_cores(self):
+        self.assertEqual(parse_nodes("node[1-2]:8,localhost"), [("node1", 8), ("node2", 8), ("localhost", None)])
+
+
+class TestHostfile(unittest.TestCase):
+
+    def write(self, text):
+        f = tempfile.NamedTemporaryFile("w", suffix=".nodes", delete=False)
+        f.write(text)
+        f.close()
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def test_pbs_nodefile_counts_cores(self):
+        filename = self.write("localhost\nlocalhost\n127.0.0.1\nlocalhost\n127.0.0.1\n")
+        self.assertEqual(read_hostfile(filename), [("localhost", 3), ("127.0.0.1", 2)])
+
+    def test_slots_and_counts(self):
+        filename = self.write("# nodes\nnode01 slots=8\n\nnode02:4  # half a node\n")
+        self.assertEqual(read_hostfile(filename), [("node01", 8), ("node02", 4)])
+
+
+class TestSlurm(unittest.TestCase):
+
+    def test_cores_per_node(self):
+        environ = {'SLURM_JOB_NODELIST': "node[01-03],gpu1", 'SLURM_JOB_CPUS_PER_NODE': "16(x3),8", 'SLURM_TASKS_PER_NODE': "1(x4)"}
+        self.assertEqual(slurm_nodes(environ), [("node01", 16), ("node02", 16), ("node03", 16), ("gpu1", 8)])
+
+    def test_tasks_per_node(self):
+        environ = {'SLURM_JOB_NODELIST': "node[1-2]", 'SLURM_TASKS_PER_NODE': "4(x2)"}
+        self.assertEqual(slurm_nodes(environ), [("node1", 4), ("node2", 4)])
+
+    def test_mismatched_counts_are_unknown(self):
+        environ = {'SLURM_JOB_NODELIST': "node[1-3]", 'SLURM_TASKS_PER_NODE': "4(x2)"}
+        self.assertEqual(slurm_nodes(environ), [("node1", None), ("node2", None), ("node3", None)])
+
+
+class TestDiscoverNodes(unittest.TestCase):
+
+    def test_order_of_sources(self):
+        f = tempfile.NamedTemporaryFile("w", delete=False)
+        f.write("localhost\nlocalhost\n")
+        f.close()
+        self.addCleanup(os.remove, f.name)
+        environ = {'PBS_NODEFILE': f.name, 'SLURM_JOB_NODELIST': "localhost", 'SLURM_TASKS_PER_NODE': "7"}
+        self.assertEqual(discover_nodes("127.0.0.1:3", None, environ), [("127.0.0.1", 3)])
+        self.assertEqual(discover_nodes(None, f.name, {}), [("localhost", 2)])
+        self.assertEqual(discover_nodes(None, None, environ), [("localhost", 2)])
+        del environ['PBS_NODEFILE']
+        self.assertEqual(discover_nodes(None, None, environ), [("localhost", 7)])
+        self.assertEqual(discover_nodes(None, None, {}), [("localhost", None)])
+
+
+class TestJobSlots(unittest.TestCase):
+
+    def test_cores_are_divided_by_cores_per_job(self):
+        nodes = [("node01", 16), ("node02", 2), ("node03", None)]
+        self.assertEqual(job_slots(nodes, 4), [("node01", 4), ("node02", 1), ("node03", 1)])
+        self.assertEqual(job_slots(nodes), [("node01", 16), ("node02", 2), ("node03", 1)])
+
+    def test_jobs_per_node_wins(self):
+        self.assertEqual(job_slots([("node01", 16), ("node02", None)], 4, 3), [("node01", 3), ("node02", 3)])
+
+
+if __name__ == '__main__':
+    unittest.main()
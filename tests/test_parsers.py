@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from calcit.parsers import OutputSummary, ResultsTable, find_outputs, job_name, output_program
+
+
+class TestOutputFilename(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_pde_outputs_are_found(self):
+        names = ["water_dalton_energy.out", "env_dalton_pde_monomer.out", "env_water_dalton_pde_dimer.out", "water_dalton_energy.log"]
+        for name in names:
+            open(os.path.join(self.directory, name), "w").close()
+        found = [os.path.basename(filename) for filename in find_outputs([self.directory])]
+        self.assertEqual(found, ["env_dalton_pde_monomer.out", "env_water_dalton_pde_dimer.out", "water_dalton_energy.out"])
+
+    def test_program_and_job_name(self):
+        self.assertEqual(output_program("env_dalton_pde_monomer.out"), "dalton")
+        self.assertEqual(job_name("run/env_dalton_pde_monomer.out"), "env_dalton_pde_monomer")
+        self.assertIsNone(output_program("water_dalton_unknown.out"))
+
+
+class TestResultsTable(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.basename = os.path.join(self.directory, "results")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_npz_is_read_from_csv(self):
+        table = ResultsTable(self.basename)
+        table.add('a_orca_energy', OutputSummary('orca', -76.0123456789, True, 12, 3.5, True))
+        table.close()
+
+        # rows of a resumed table are added to those of the first run
+        table = ResultsTable(self.basename, resume=True)
+        table.add('b_dalton_pde_monomer', OutputSummary('dalton', None, False, None, None, False))
+        table.close()
+
+        arrays = numpy.load(self.basename + ".npz")
+        self.assertEqual(arrays['job'].tolist(), ['a_orca_energy', 'b_dalton_pde_monomer'])
+        self.assertEqual(arrays['energy'][0], -76.0123456789)
+        self.assertTrue(numpy.isnan(arrays['energy'][1]))
+        self.assertEqual(arrays['scf_iterations'].tolist(), [12, -1])
+        self.assertEqual(arrays['converged'].tolist(), [True, False])
+        self.assertEqual(arrays['normal_termination'].tolist(), [True, False])
+
+    def test_empty_table(self):
+        ResultsTable(self.basename).close()
+        arrays = numpy.load(self.basename + ".npz")
+        self.assertEqual(len(arrays['job']), 0)
+        self.assertEqual(arrays['energy'].dtype, numpy.float64)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+import asyncio
+import importlib.util
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+
+from calcit.process import BatchQueue
+from calcit.process import MSG_RESULT, MSG_SLAVE_DONE, END_OF_WORK
+from calcit.server import DispatchServer, MSG_SLAVE_LOST, MSG_JOBS_DISPATCHED, MAX_FRAME_SIZE, HEADER, encode_frame, read_frame
+from calcit.util import substitute_file
+
+SHARE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "share")
+AUTHORIZATION_KEY = "calcit-test"
+
+
+def load_slave_module(directory):
+    """ Returns share/slave.py as a module like it is written for the nodes """
+    filename = os.path.join(directory, "calcit_test_slave.py")
+    substitute_file(os.path.join(SHARE, "slave.py"), filename,
+                    {'PORT': '0', 'HOSTNAME': 'localhost', 'AUTHKEY': AUTHORIZATION_KEY, 'JOBS_PER_NODE': '1',
+                     'MAX_BATCH_SIZE': '1', 'CORES_PER_NODE': 'None', 'MEMORY_PER_NODE': 'None',
+                     'LOG_DIR': 'None', 'HEARTBEAT_INTERVAL': '1.0', 'SCRATCH_POOL': 'None'})
+    spec = importlib.util.spec_from_file_location("calcit_test_slave", filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def job(name):
+    return (name, "true", 1, 0, 0, ('orca', name + ".out"))
+
+
+class ServerTestCase(unittest.TestCase):
+    """ Runs a DispatchServer in this process with slaves connecting from threads """
+    queue_size = 0
+    lease_timeout = 120
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.slave = load_slave_module(self.directory)
+        self.results = BatchQueue()
+        self.server = DispatchServer(free_port(), AUTHORIZATION_KEY.encode("utf-8"), self.queue_size, self.results, self.lease_timeout)
+        self.server.start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.shutdown()
+        shutil.rmtree(self.directory)
+
+    def connect(self, slave_id):
+        client = self.slave.DispatchClient("localhost", self.server.port, AUTHORIZATION_KEY)
+        client.send(('hello', slave_id))
+        self.clients.append(client)
+        return client
+
+    def wait_for(self, kind, timeout=10.0):
+        """ Returns the first message of kind on the result queue """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            for message in self.results.get_batch(16, timeout=deadline - time.time()):
+                if message[0] == kind:
+                    return message
+        self.fail("No '{0:s}' message within {1:.0f}s".format(kind, timeout))
+
+
+class TestFraming(ServerTestCase):
+
+    def read(self, data):
+        async def read():
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            return await read_frame(reader)
+        return asyncio.run(read())
+
+    def test_frames_of_master_and_slave_match(self):
+        payload = b"calcit" * 1000
+        self.assertEqual(self.slave.encode_frame(payload), encode_frame(payload))
+        self.assertEqual(self.read(encode_frame(payload) + encode_frame(b"next")), payload)
+
+    def test_large_frame_is_rejected(self):
+        self.assertRaises(ValueError, self.read, HEADER.pack(MAX_FRAME_SIZE + 1))
+
+    def test_truncated_frame(self):
+        self.assertRaises(asyncio.IncompleteReadError, self.read, encode_frame(b"calcit")[:-1])
+
+    def test_large_job_is_sent_whole(self):
+        item = ('a', "echo " + "x" * (1024 * 1024), 1, 0, 0, ('orca', "a.out"))
+        self.server.put(item)
+        client = self.connect('node1:1')
+        self.assertEqual(client.queue('jobs').get_batch(1), [item])
+
+
+class TestAuthentication(ServerTestCase):
+
+    def test_wrong_key_is_rejected(self):
+        with self.assertRaises((EOFError, ConnectionError)):
+            client = self.slave.DispatchClient("localhost", self.server.port, "wrong-key")
+            self.clients.append(client)
+            client.send(('hello', 'node1:1'))
+            client.queue('jobs').get_batch(1)
+        self.assertEqual(len(self.server.connections), 0)
+
+
+class TestEndOfWork(ServerTestCase):
+
+    def test_slaves_pass_on_end_of_work(self):
+        self.server.put(job('a'))
+        self.server.put(END_OF_WORK)
+        server = ("localhost", self.server.port, AUTHORIZATION_KEY)
+        threads = [threading.Thread(target=self.slave.slave, args=(server, 1, None, "node{0:d}".format(i), self.directory, 0.1)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+
+        # slaves that leave after END_OF_WORK are not lost
+        kinds = []
+        deadline = time.time() + 2.0
+        while time.time() < deadline:
+            if not self.results.empty():
+                kinds.extend(message[0] for message in self.results.get_batch(16))
+            time.sleep(0.05)
+        self.assertEqual(kinds.count(MSG_RESULT), 1)
+        self.assertEqual(kinds.count(MSG_SLAVE_DONE), 2)
+        self.assertNotIn(MSG_SLAVE_LOST, kinds)
+
+
+class TestSlaveLogs(ServerTestCase):
+
+    def test_only_logs_of_failed_jobs_are_kept(self):
+        log_dir = os.path.join(self.directory, "logs")
+        os.makedirs(log_dir)
+        self.server.put(job('good'))
+        self.server.put(('bad', "echo failed >&2; false", 1, 0, 0, ('orca', "bad.out")))
+        self.server.put(END_OF_WORK)
+        self.slave.slave(("localhost", self.server.port, AUTHORIZATION_KEY), 1, None, "node1", log_dir, 0.1)
+
+        results = dict((message[2], message) for message in self.results.get_batch(16, timeout=5) if message[0] == MSG_RESULT)
+        while len(results) < 2:
+            results.update((message[2], message) for message in self.results.get_batch(16, timeout=5) if message[0] == MSG_RESULT)
+        self.assertEqual(sorted(os.listdir(log_dir)), ['bad.stderr', 'bad.stdout'])
+        self.assertEqual(zlib.decompress(results['bad'][6]), b"failed\n")
+
+
+class TestRequeue(ServerTestCase):
+    # the job queue is full while jobs are requeued
+    queue_size = 1
+    lease_timeout = 0.5
+
+    def test_jobs_of_disconnected_slave_are_dispatched_again(self):
+        self.server.put(job('a'))
+        first = self.connect('node1:1')
+        self.assertEqual(first.queue('jobs').get_batch(1), [job('a')])
+        self.server.put(job('b'))
+
+        first.close()
+        self.assertEqual(self.wait_for(MSG_SLAVE_LOST)[1:], ('node1:1', ['a']))
+
+        second = self.connect('node2:1')
+        self.assertEqual(second.queue('jobs').get_batch(2), [job('a'), job('b')])
+        self.assertEqual(self.wait_for(MSG_JOBS_DISPATCHED)[1:3], ('node2:1', ['a', 'b']))
+
+    def test_jobs_of_silent_slave_are_dispatched_again(self):
+        self.server.put(job('a'))
+        first = self.connect('node1:1')
+        self.assertEqual(first.queue('jobs').get_batch(1), [job('a')])
+        self.server.put(job('b'))
+
+        # the slave sends no heartbeats so its lease expires
+        self.assertEqual(self.wait_for(MSG_SLAVE_LOST)[1:], ('node1:1', ['a']))
+
+        second = self.connect('node2:1')
+        self.assertEqual(second.queue('jobs').get_batch(1), [job('a')])
+
+    def test_heartbeats_keep_leases(self):
+        self.server.put(job('a'))
+        first = self.connect('node1:1')
+        first.start_heartbeat('node1:1', 0.1)
+        self.assertEqual(first.queue('jobs').get_batch(1), [job('a')])
+        time.sleep(2.5)
+        self.assertTrue(all(message[0] != MSG_SLAVE_LOST for message in self.results.get_batch(16, timeout=0.1)))
+        first.done(['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
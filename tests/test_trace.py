@@ -0,0 +1,66 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from calcit.trace import TraceRecorder, MASTER_PID
+
+
+class TestTraceRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.trace = TraceRecorder()
+        t = self.trace.started
+        self.trace.rendered('a', t + 0.0, t + 0.1, "1/worker")
+        self.trace.queued('a', t + 0.1)
+        self.trace.dispatched(['a'], 'node1:7', t + 0.2)
+        self.trace.finished('a', 'node1:7', [t + 0.3, t + 0.4, t + 1.4, t + 1.5], t + 1.6)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_phase_spans(self):
+        phases = self.trace.phase_spans()
+        self.assertEqual(sorted(phases), ['pickup', 'queue', 'render', 'run', 'transfer', 'wait'])
+        start, end = phases['run'][0]
+        self.assertAlmostEqual(end - start, 1.0)
+
+    def test_written_events(self):
+        filename = os.path.join(self.directory, "trace.json")
+        self.trace.write(filename)
+        with open(filename) as f:
+            trace = json.load(f)
+        events = trace['traceEvents']
+
+        names = dict((event['args']['name'], event['pid']) for event in events if event['name'] == 'process_name')
+        self.assertEqual(names, {'master': MASTER_PID, 'node1': 1})
+        tracks = set(event['args']['name'] for event in events if event['name'] == 'thread_name')
+        self.assertEqual(tracks, {'queue', 'prepare 1/worker', 'node1:7'})
+
+        spans = dict((event['name'], event) for event in events if event['ph'] == 'X')
+        self.assertEqual(spans['render']['ts'], 0.0)
+        self.assertEqual(spans['render']['pid'], MASTER_PID)
+        self.assertEqual(spans['run']['pid'], 1)
+        self.assertAlmostEqual(spans['run']['ts'], 400000.0, places=0)
+        self.assertAlmostEqual(spans['run']['dur'], 1000000.0, places=0)
+        self.assertEqual(spans['run']['args'], {'job': 'a'})
+
+        # the queue wait is an async begin and end pair
+        queue = [event for event in events if event['name'] == 'queue' and event['ph'] in 'be']
+        self.assertEqual([event['ph'] for event in queue], ['b', 'e'])
+        self.assertAlmostEqual(queue[1]['ts'] - queue[0]['ts'], 100000.0, places=0)
+
+    def test_lost_dispatch_has_no_pickup(self):
+        t = self.trace.started
+        self.trace.queued('b', t)
+        self.trace.dispatched(['b'], 'node1:7', t + 0.1)
+        # the job was run by another slave after node1:7 was lost
+        self.trace.finished('b', 'node2:8', [t + 0.2, t + 0.3, t + 0.4, t + 0.5], t + 0.6)
+        pickups = [span for span in self.trace.spans if span[2] == 'b' and span[3] == 'pickup']
+        self.assertEqual(pickups, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
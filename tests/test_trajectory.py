@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from calcit.trajectory import XYZTrajectory, frames, line_end
+
+FRAMES = [
+    "3\nframe 0\nO 0.0 0.0 0.0\nH 0.0 0.0 1.0\nH 0.0 1.0 0.0\n",
+    "2\nframe 1 with a longer comment\nCl 1.0 2.0 3.0\nNa -1.0 -2.0 -3.0\n",
+    "1\n\nH 5.0 5.0 5.0",
+]
+
+
+class TestXYZTrajectory(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "md.xyz")
+        with open(self.filename, "w") as f:
+            f.write("".join(FRAMES))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_offsets(self):
+        trajectory = XYZTrajectory(self.filename)
+        self.assertEqual(len(trajectory), 3)
+        self.assertEqual(trajectory.offsets.tolist(), [0, len(FRAMES[0]), len(FRAMES[0]) + len(FRAMES[1])])
+        self.assertEqual(trajectory.n_atoms.tolist(), [3, 2, 1])
+
+    def test_frames_are_read_by_offset(self):
+        trajectory = XYZTrajectory(self.filename)
+        molecule = trajectory.read_frame(1)
+        self.assertEqual(molecule.symbols(), ['Cl', 'Na'])
+        self.assertEqual(molecule.coordinates.tolist(), [[1.0, 2.0, 3.0], [-1.0, -2.0, -3.0]])
+        # the last frame does not end with a newline
+        self.assertEqual(trajectory.read_frame(2).coordinates.tolist(), [[5.0, 5.0, 5.0]])
+
+    def test_small_window(self):
+        # frames larger than the first window are still found
+        with open(self.filename, "rb") as f:
+            data = numpy.frombuffer(f.read(), dtype=numpy.uint8)
+        self.assertEqual(line_end(data, 0, 5, window=4), len(FRAMES[0]))
+
+    def test_invalid_frame(self):
+        with open(self.filename, "a") as f:
+            f.write("\n5\ntruncated\nH 0.0 0.0 0.0\n")
+        self.assertRaises(ValueError, XYZTrajectory, self.filename)
+
+    def test_frame_names(self):
+        names = [name for name, frame in frames(self.filename, stride=2)]
+        base = os.path.join(self.directory, "md")
+        self.assertEqual(names, [base + "_000000", base + "_000002"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from calcit.util import load_template, substitute_file, clear_template_cache
+
+
+class TestTemplateCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.template = os.path.join(self.directory, "job.inp")
+        self.output = os.path.join(self.directory, "water.inp")
+        self.write_template("energy $BASIS", 1000000000)
+
+    def tearDown(self):
+        clear_template_cache()
+        shutil.rmtree(self.directory)
+
+    def write_template(self, text, mtime):
+        with open(self.template, "w") as f:
+            f.write(text)
+        os.utime(self.template, ns=(mtime, mtime))
+
+    def substitute(self):
+        substitute_file(self.template, self.output, {'BASIS': 'sto-3g'})
+        with open(self.output) as f:
+            return f.read()
+
+    def test_template_is_compiled_once(self):
+        self.assertIs(load_template(self.template), load_template(self.template))
+
+    def test_template_is_reloaded_when_modified(self):
+        self.assertEqual(self.substitute(), "energy sto-3g")
+        self.write_template("gradient $BASIS", 2000000000)
+        self.assertEqual(self.substitute(), "gradient sto-3g")
+
+    def test_unchanged_mtime_keeps_template(self):
+        template = load_template(self.template)
+        self.write_template("gradient $BASIS", 1000000000)
+        self.assertIs(load_template(self.template), template)
+        clear_template_cache()
+        self.assertEqual(self.substitute(), "gradient sto-3g")
+
+    def test_missing_template(self):
+        self.assertRaises(IOError, load_template, os.path.join(self.directory, "missing.inp"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import threading
+import time
+import unittest
+
+from calcit.process import prepare_jobs
+from calcit.util import CalcItJobCreateError
+from calcit.workflow import JobGraph, WAITING, READY, RELEASED, DONE, FAILED, CANCELLED
+
+
+class FakeJob(object):
+    """ Job with a name, a cost and dependencies """
+    def __init__(self, name, cost=1.0, dependencies=()):
+        self.name = name
+        self.cost = cost
+        self.dependencies = tuple(dependencies)
+
+    def __repr__(self):
+        return self.name
+
+
+def job_cost(job):
+    return job.cost
+
+
+def names(jobs):
+    return [repr(job) for job in jobs]
+
+
+class TestJobGraph(unittest.TestCase):
+
+    def setUp(self):
+        # a -> b -> c is the costly chain, d is cheap and e depends on d
+        self.a = FakeJob('a', 1.0)
+        self.b = FakeJob('b', 5.0, [self.a])
+        self.c = FakeJob('c', 5.0, [self.b])
+        self.d = FakeJob('d', 2.0)
+        self.e = FakeJob('e', 1.0, [self.d])
+        self.graph = JobGraph([self.c, self.d, self.e], cost=job_cost)
+
+    def test_dependencies_are_added(self):
+        self.assertEqual(len(self.graph), 5)
+        self.assertEqual(self.graph.state['a'], READY)
+        self.assertEqual(self.graph.state['b'], WAITING)
+
+    def test_critical_path_priorities(self):
+        self.assertEqual(self.graph.priority['c'], 5.0)
+        self.assertEqual(self.graph.priority['b'], 10.0)
+        self.assertEqual(self.graph.priority['a'], 11.0)
+        self.assertEqual(self.graph.priority['d'], 3.0)
+
+    def test_release_order(self):
+        self.assertEqual(names(self.graph.take(10)), ['a', 'd'])
+        self.graph.finished('d')
+        self.assertEqual(names(self.graph.take(10)), ['e'])
+        self.graph.finished('a')
+        self.graph.finished('e')
+        self.assertEqual(names(self.graph.take(10)), ['b'])
+        self.graph.finished('b')
+        self.assertEqual(names(self.graph.take(10)), ['c'])
+        self.graph.finished('c')
+        self.assertEqual(self.graph.take(10), [])
+
+    def test_take_respects_max_jobs(self):
+        self.assertEqual(names(self.graph.take(1)), ['a'])
+        self.assertEqual(names(self.graph.take(1)), ['d'])
+
+    def test_take_blocks_until_a_dependency_finishes(self):
+        self.graph.take(10)
+        taken = []
+        thread = threading.Thread(target=lambda: taken.extend(self.graph.take(10)))
+        thread.start()
+        time.sleep(0.1)
+        self.assertEqual(taken, [])
+        self.graph.finished('a')
+        thread.join(5)
+        self.assertEqual(names(taken), ['b'])
+
+    def test_failure_cancels_dependents(self):
+        self.graph.take(10)
+        cancelled = self.graph.finished('a', success=False)
+        self.assertEqual(sorted(cancelled), ['b', 'c'])
+        self.assertEqual(self.graph.state['a'], FAILED)
+        self.assertEqual(self.graph.state['c'], CANCELLED)
+        # the independent chain still runs
+        self.graph.finished('d')
+        self.assertEqual(names(self.graph.take(10)), ['e'])
+        self.graph.finished('e')
+        self.assertEqual(self.graph.take(10), [])
+
+    def test_repeated_finish_is_ignored(self):
+        self.graph.take(10)
+        self.graph.finished('a')
+        self.assertEqual(self.graph.finished('a', success=False), [])
+        self.assertEqual(self.graph.state['a'], DONE)
+        self.assertEqual(self.graph.state['b'], READY)
+
+    def test_resume_completes_done_jobs(self):
+        self.assertEqual(self.graph.complete(['a', 'b', 'unknown']), 2)
+        self.assertEqual(names(self.graph.take(10)), ['c', 'd'])
+        # jobs are only completed once
+        self.assertEqual(self.graph.complete(['a']), 0)
+
+    def test_resume_of_released_job_is_ignored(self):
+        self.graph.take(10)
+        self.assertEqual(self.graph.complete(['a']), 0)
+        self.assertEqual(self.graph.state['a'], RELEASED)
+
+    def test_cycle_is_rejected(self):
+        first = FakeJob('first')
+        second = FakeJob('second', dependencies=[first])
+        first.dependencies = (second,)
+        with self.assertRaises(CalcItJobCreateError):
+            JobGraph([first], cost=job_cost)
+
+
+class FailingJob(FakeJob):
+    """ Job whose input cannot be written """
+    def cmd(self, global_paths):
+        raise CalcItJobCreateError("Job: {0:s} needs a missing file.".format(self.name))
+
+
+class TestPrepareErrors(unittest.TestCase):
+
+    def test_errors_are_raised_by_default(self):
+        with self.assertRaises(CalcItJobCreateError):
+            list(prepare_jobs([FailingJob('x')], {}))
+
+    def test_errors_are_returned(self):
+        for workers in (1, 2):
+            prepared = list(prepare_jobs([FailingJob('x'), FailingJob('y')], {}, workers, return_errors=True))
+            self.assertEqual(names(job for job, cmd, rendered in prepared), ['x', 'y'])
+            for job, cmd, rendered in prepared:
+                self.assertIsInstance(cmd, CalcItJobCreateError)
+
+
+if __name__ == '__main__':
+    unittest.main()